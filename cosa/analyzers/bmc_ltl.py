@@ -9,13 +9,15 @@
 # limitations under the License.
 
 import re
+import copy
 
 from pysmt.shortcuts import And, Or, Solver, TRUE, FALSE, Not, EqualsOrIff, Implies, Iff, Symbol, BOOL
 
 from cosa.utils.logger import Logger
 from cosa.utils.formula_mngm import substitute, get_free_variables
 from cosa.representation import TS
-from cosa.encoders.ltl import LTLEncoder, verification_type
+from cosa.printers import HIDDEN
+from cosa.encoders.ltl import LTLEncoder, LTLLinearEncoder, verification_type
 
 from cosa.problem import VerificationStatus, VerificationType
 from cosa.analyzers.mcsolver import TraceSolver, BMCSolver, VerificationStrategy
@@ -37,38 +39,35 @@ class BMCLTL(BMCTemporal, BMCSafety):
 
         self.enc = LTLEncoder()
 
-    def unroll(self, trans, invar, k_end, k_start=0, gen_list=False):
-        Logger.log("Unroll from %s to %s"%(k_start, k_end), 2)
+    def liveness(self, prop, k, k_min):
+        if self.config.liveness_to_safety:
+            return self.liveness_to_safety(prop, k, k_min, False)
 
-        fwd = k_start <= k_end
-        time_function = self.at_time if fwd else self.at_ptime
-        (k_start, k_end) = (min(k_start, k_end), max(k_start, k_end))
+        return BMCTemporal.liveness(self, prop, k, k_min)
 
-        formula = []
-        t = k_start
-        while t < k_end:
-            to_t = t+1 if fwd else t
-            formula.append(time_function(trans, t))
-            formula.append(time_function(invar, to_t))
-            Logger.log("Add trans, k=%s"%t, 2)
-            t += 1
+    def eventually(self, prop, k, k_min):
+        if self.config.liveness_to_safety:
+            return self.liveness_to_safety(prop, k, k_min, True)
 
-        if gen_list:
-            return formula
-            
-        return And(formula)
+        return BMCTemporal.eventually(self, prop, k, k_min)
+
+    def liveness_to_safety(self, prop, k, k_min, eventually):
+        hts = self.preprocess(self.hts, [prop])
+        (hts, safety_prop) = self.liveness_to_safety_hts(hts, prop, eventually)
+
+        # The cone of the monitor is the whole reduced system
+        config = copy.copy(self.config)
+        config.coi = False
+        config.sweep = False
+        config.functional = False
+
+        bmc_safety = BMCSafety(hts, config)
+        (res, trace, t) = bmc_safety.safety(safety_prop, k, k_min)
+        bmc_safety.close_traces()
+        self.engine = bmc_safety.engine
+
+        return (res, trace, t)
 
-    def _init_v_time(self, vars, k):
-        self.vars_time = []
-        
-        for t in range(k+1):
-            vars_at_t = []
-            for v in vars:
-                vars_at_t.append((v, TS.get_timed_name(v, t)))
-            self.vars_time.append((t, dict(vars_at_t)))
-            
-        self.vars_time = dict(self.vars_time)
-    
     def ltl(self, prop, k, k_min=0):
         if self.config.strategy != VerificationStrategy.LTL:
             (vtype, prop) = verification_type(self.enc.to_nnf(prop))
@@ -85,18 +84,18 @@ class BMCLTL(BMCTemporal, BMCSafety):
         return self.ltl_generic(prop, k, k_min)
         
     def ltl_generic(self, prop, k, k_min=0):
-        lemmas = self.hts.lemmas
+        hts = self.preprocess(self.hts, [prop])
+        lemmas = hts.lemmas
         
-        self._init_at_time(self.hts.vars, k)
-        self._init_v_time(self.hts.vars, k)
+        self._init_at_time(hts.vars)
 
-        (t, model) = self.solve(self.hts, prop, k, lemmas)
+        (t, model) = self.solve(hts, prop, k, lemmas)
 
         if model == True:
             return (VerificationStatus.TRUE, None, t)
         elif model is not None:
-            model = self._remap_model(self.hts.vars, model, t)
-            trace = self.print_trace(self.hts, model, t, get_free_variables(prop), map_function=self.config.map_function, find_loop=True)
+            model = self._remap_model(hts.vars, model, t)
+            trace = self.print_trace(hts, model, t, get_free_variables(prop), map_function=self.config.map_function, find_loop=True)
             return (VerificationStatus.FALSE, trace, t)
         else:
             return (VerificationStatus.UNK, None, t)
@@ -110,7 +109,13 @@ class BMCLTL(BMCTemporal, BMCSafety):
                 return (0, True)
 
         hts.reset_formulae()
-        
+
+        if self.config.incremental:
+            nprop = self.enc.to_nnf(Not(prop))
+            if LTLLinearEncoder.is_supported(nprop):
+                return self.solve_inc_linear(hts, nprop, k)
+            Logger.log("Linear encoding not supported for \"%s\", using the explicit loops encoding"%(prop), 1)
+
         return self.solve_inc(hts, prop, k)
 
     def all_simple_loopbacks(self, vars, k):
@@ -131,6 +136,10 @@ class BMCLTL(BMCTemporal, BMCSafety):
         loopback.append(FALSE())
         return loopback
     
+    def _timed_vars(self, vars, k):
+        # The unconstrained variables are not always in the model
+        return [TS.get_timed(v, t) for v in vars for t in range(k+1)]
+
     def solve_inc(self, hts, prop, k, all_vars=True):
 
         if all_vars:
@@ -152,7 +161,7 @@ class BMCLTL(BMCTemporal, BMCSafety):
         
         for t in range(1, k+1, 1):
             
-            trans_t = self.unroll(trans, invar, t)
+            trans_t = self.unroll(trans, invar, t, t-1)
             self._add_assertion(self.solver, trans_t)
                 
             lb = self.all_simple_loopbacks(relevant_vars, t)
@@ -165,7 +174,7 @@ class BMCLTL(BMCTemporal, BMCSafety):
 
             if self._solve(self.solver):
                 Logger.log("Counterexample (no-loop) found with k=%s"%(t), 1)
-                model = self._get_model(self.solver)
+                model = self._get_model(self.solver, self._timed_vars(hts.vars, t))
                 return (t, model)
 
             nltlprop = []
@@ -180,7 +189,7 @@ class BMCLTL(BMCTemporal, BMCSafety):
 
             if self._solve(self.solver):
                 Logger.log("Counterexample (with-loop) found with k=%s"%(t), 1)
-                model = self._get_model(self.solver)
+                model = self._get_model(self.solver, self._timed_vars(hts.vars, t))
                 return (t, model)
             else:
                 Logger.log("No counterexample found with k=%s"%(t), 1)
@@ -190,3 +199,37 @@ class BMCLTL(BMCTemporal, BMCSafety):
                 
         return (k-1, None)
     
+
+    def solve_inc_linear(self, hts, nprop, k):
+        init = hts.single_init()
+        trans = hts.single_trans()
+        invar = hts.single_invar()
+
+        enc = LTLLinearEncoder(nprop, hts.vars, self.at_time, HIDDEN)
+
+        self._reset_assertions(self.solver)
+        self._add_assertion(self.solver, self.at_time(And(init, invar), 0), "init")
+
+        t = 0
+        while (t < k+1):
+            if t > 0:
+                self._add_assertion(self.solver, self.unroll(trans, invar, t, t-1), "trans")
+
+            self._add_assertion(self.solver, And(enc.frame(t)), "ltl frame %s"%t)
+
+            act_k = self._activation_literal("ltl_k%s"%t)
+            self._add_assertion(self.solver, Implies(act_k, And(enc.final(t))), "ltl bound %s"%t)
+
+            if self._solve(self.solver, [act_k]):
+                Logger.log("Counterexample found with k=%s"%(t), 1)
+                model = self._get_model(self.solver)
+                return (t, model)
+            else:
+                Logger.log("No counterexample found with k=%s"%(t), 1)
+                Logger.msg(".", 0, not(Logger.level(1)))
+
+            # The bound constraints of the previous depths are disabled
+            self._add_assertion(self.solver, Not(act_k))
+            t += 1
+
+        return (t-1, None)
@@ -9,7 +9,10 @@
 # limitations under the License.
 
 import re
+import os
 import copy
+import time
+import multiprocessing
 from six.moves import cStringIO
 
 from pysmt.shortcuts import And, Or, Solver, TRUE, FALSE, Not, EqualsOrIff, Implies, Iff, Symbol, BOOL, simplify
@@ -19,12 +22,15 @@ from pysmt.smtlib.printers import SmtPrinter, SmtDagPrinter
 
 from cosa.utils.logger import Logger
 from cosa.utils.formula_mngm import substitute, get_free_variables
-from cosa.utils.generic import status_bar
 from cosa.representation import TS, HTS
 from cosa.encoders.coreir import CoreIRParser, SEP
 
 from cosa.problem import VerificationStatus
-from cosa.analyzers.mcsolver import TraceSolver, BMCSolver, VerificationStrategy
+from cosa.analyzers.mcsolver import TraceSolver, BMCSolver, VerificationStrategy, PortfolioEngine
+from cosa.analyzers.pdr import PDR
+from cosa.utils.parallel import ProcessPool, TaskStatus
+
+POLLING = 0.01
 
 NL = "\n"
 
@@ -40,9 +46,15 @@ class BMCSafety(BMCSolver):
 
     total_time = 0.0
     tracefile = None
+    engine = None
+    invariant = None
+    verdict_times = None
 
     def __init__(self, hts, config):
         BMCSolver.__init__(self, hts, config)
+        self.engine = None
+        self.invariant = None
+        self.verdict_times = None
 
     def loop_free(self, vars_, k_end, k_start=0):
         Logger.log("Simple path from %s to %s"%(k_start, k_end), 2)
@@ -67,11 +79,16 @@ class BMCSafety(BMCSolver):
         return And(formula)
 
     def simulate(self, prop, k):
+        if self.config.random_sim > 0:
+            (t, model) = self.random_simulation(self.hts, prop, k, k if prop == TRUE() else 0)
+            if model is not None:
+                trace = self.print_trace(self.hts, model, t, get_free_variables(prop), map_function=self.config.map_function)
+                return (VerificationStatus.TRUE, trace)
+
+        self._init_at_time(self.hts.vars)
         if self.config.strategy == VerificationStrategy.NU:
-            self._init_at_time(self.hts.vars, 1)
             (t, model) = self.sim_no_unroll(self.hts, prop, k)
         else:
-            self._init_at_time(self.hts.vars, k)
             if prop == TRUE():
                 self.config.incremental = False
                 (t, model) = self.solve_safety_fwd(self.hts, Not(prop), k, False)
@@ -118,6 +135,9 @@ class BMCSafety(BMCSolver):
 
         if self.config.strategy == VerificationStrategy.INT:
             return self.solve_safety_int(hts, prop, k)
+
+        if self.config.strategy == VerificationStrategy.PDR:
+            return self.solve_safety_pdr(hts, prop, k)
         
         Logger.error("Invalid configuration strategy")
 
@@ -148,11 +168,12 @@ class BMCSafety(BMCSolver):
 
         if self.config.strategy == VerificationStrategy.ZZ:
             return self.solve_safety_inc_zz(hts, prop, k)
+
+        if self.config.strategy == VerificationStrategy.PDR:
+            return self.solve_safety_pdr(hts, prop, k)
             
-        # Redirecting strategy selection error
         if self.config.strategy == VerificationStrategy.INT:
-            Logger.warning("Interpolation is not available in incremental mode. Switching to not incremental")
-            return self.solve_safety_ninc(hts, prop, k)
+            return self.solve_safety_int(hts, prop, k)
             
         Logger.error("Invalid configuration strategy")
 
@@ -171,63 +192,125 @@ class BMCSafety(BMCSolver):
         itp = Interpolator(logic=get_logic(trans))
         init = And(init, invar)
         nprop = Not(prop)
+
+        # The unrolling is asserted once in a persistent solver, while
+        # the initial states (R), the negated property at each depth and
+        # the fixpoint checks are enabled by activation literals
+        self._reset_assertions(self.solver)
+        solver_fp = self.solver.copy("int_fp")
+        self._reset_assertions(solver_fp)
+
+        init_0 = self.at_time(init, 0)
+        self._add_assertion(self.solver, self.at_time(invar, 0), "invar")
+        act_init = self._activation_literal("init")
+        self._add_assertion(self.solver, Implies(act_init, init_0), "init")
+
+        trans_t = []
+        R = None
+        R_parts = None
+        act_R = None
+        act_fp = None
         
         t = 0
         while (t < k+1):
             Logger.log("\nSolving for k=%s"%t, 1)
-            int_c = 0
-            init_0 = self.at_time(init, 0)
-            R = init_0
 
-            trans_t = self.unroll(trans, invar, t, gen_list=True)
-            trans_tA = And(trans_t[0]) if t > 0 else TRUE()
-            trans_tB = And(trans_t[1:]) if t > 0 else TRUE()
+            if t > 0:
+                trans_t.append(And(self.at_time(trans, t-1), self.at_time(invar, t)))
+                Logger.log("Add trans, k=%s"%(t-1), 2)
+                self._add_assertion(self.solver, trans_t[-1])
+
+            npropt = self.at_time(nprop, t)
+            act_nprop = self._activation_literal("nprop")
+            Logger.log("Add property time %d"%t, 2)
+            self._add_assertion(self.solver, Implies(act_nprop, npropt))
+
+            if self._solve(self.solver, [act_init, act_nprop]):
+                Logger.log("Counterexample found with k=%s"%(t), 1)
+                model = self._get_model(self.solver)
+                return (t, model)
+
+            if t == 0:
+                Logger.log("No counterexample found with k=%s"%(t), 1)
+                Logger.msg(".", 0, not(Logger.level(1)))
+                t += 1
+                continue
+
+            # The over-approximation of the previous depth is reused
+            carried = R is not None
+            if not carried:
+                (R, R_parts, act_R, act_fp) = self._int_restart(init_0, act_init, solver_fp)
             
+            int_c = 0
+            sizes = []
             while True:
-                self._reset_assertions(self.solver)
-                Logger.log("Add init and invar", 2)
-                self._add_assertion(self.solver, R)
+                if self._solve(self.solver, [act_R, act_nprop]):
+                    if carried:
+                        Logger.log("Restarting from the initial states with k=%s"%(t), 1)
+                        (R, R_parts, act_R, act_fp) = self._int_restart(init_0, act_init, solver_fp)
+                        carried = False
+                        continue
+
+                    Logger.log("No counterexample or proof found with k=%s"%(t), 1)
+                    Logger.msg(".", 0, not(Logger.level(1)))
+                    break
 
-                self._add_assertion(self.solver, And(trans_tA, trans_tB))
+                trans_tA = trans_t[0]
+                trans_tB = And(trans_t[1:]) if t > 1 else TRUE()
 
-                npropt = self.at_time(nprop, t)
-                Logger.log("Add property time %d"%t, 2)
-                self._add_assertion(self.solver, npropt)
+                Ri = And(itp.sequence_interpolant([And(R, trans_tA), And(trans_tB, npropt)]))
+                Ri = substitute(Ri, map_10)
+                sizes.append(Ri.size())
+                Logger.log("Interpolant %s size: %s"%(int_c, sizes[-1]), 2)
 
-                if self._solve(self.solver):
-                    if R == init_0:
-                        Logger.log("Counterexample found with k=%s"%(t), 1)
-                        model = self._get_model(self.solver)
-                        return (t, model)
-                    else:
-                        Logger.log("No counterexample or proof found with k=%s"%(t), 1)
-                        Logger.msg(".", 0, not(Logger.level(1)))
-                        break
-                else:
-                    if len(trans_t) < 2:
-                        Logger.log("No counterexample found with k=%s"%(t), 1)
-                        Logger.msg(".", 0, not(Logger.level(1)))
-                        break
+                act_Ri = self._activation_literal("itp")
+                self._add_assertion(solver_fp, Implies(act_Ri, Ri))
 
-                    Ri = And(itp.sequence_interpolant([And(R, trans_tA), And(trans_tB, npropt)]))
-                    Ri = substitute(Ri, map_10)
-                    
-                    self._reset_assertions(self.solver)
-                    self._add_assertion(self.solver, And(Ri, Not(R)))
+                if not self._solve(solver_fp, [act_fp, act_Ri]):
+                    Logger.log("Proof found with k=%s"%(t), 1)
+                    Logger.log("Fixpoint iterations: %s, interpolant sizes: %s"%(int_c+1, sizes), 1)
+                    return (t, True)
 
-                    if not self._solve(self.solver):
-                        Logger.log("Proof found with k=%s"%(t), 1)
-                        return (t, True)
-                    else:
-                        R = Or(R, Ri)
-                        int_c += 1
+                self._add_assertion(solver_fp, Implies(act_fp, Not(Ri)))
+                R_parts.append(Ri)
+                R = Or(R_parts)
+                act_R = self._activation_literal("R")
+                self._add_assertion(self.solver, Implies(act_R, R))
+                int_c += 1
 
-                    Logger.log("Extending initial states (%s)"%int_c, 1)
+                Logger.log("Extending initial states (%s)"%int_c, 1)
 
+            Logger.log("Fixpoint iterations: %s, interpolant sizes: %s"%(int_c, sizes), 1)
             t += 1
 
         return (t-1, None)
+
+    def _int_restart(self, init_0, act_init, solver_fp):
+        act_fp = self._activation_literal("fp")
+        self._add_assertion(solver_fp, Implies(act_fp, Not(init_0)))
+        return (init_0, [init_0], act_init, act_fp)
     
+    def solve_safety_pdr(self, hts, prop, k):
+        if self.config.skip_solving:
+            Logger.warning("PDR requires solving, skipping")
+            return (0, None)
+
+        pdr = PDR(hts, self.config)
+        try:
+            (t, res) = pdr.solve(hts, prop, k)
+        finally:
+            pdr.close_traces()
+
+        if res == True:
+            self.invariant = pdr.invariant
+            return (t, True)
+
+        if res == False:
+            # The counterexample is rebuilt by BMC at its exact length
+            return self.solve_safety_inc_fwd(hts, prop, t, t)
+
+        return (t, None)
+
     def solve_safety_fwd(self, hts, prop, k, shortest=True):
 
         init = hts.single_init()
@@ -264,116 +347,15 @@ class BMCSafety(BMCSolver):
 
         return (t-1, None)
     
-    def _check_lemma(self, hts, lemma, init, trans):
-
-        def check_init():
-            self._reset_assertions(self.solver)
-            self._add_assertion(self.solver, self.at_time(And(init, Not(lemma)), 0), comment="Init check")
-            res = self._solve(self.solver)
+    def solve_safety_inc_fwd(self, hts, prop, k, k_min, all_vars=False, base=True, step=True, progress=None):
+        """Incremental FWD BMC, with k-induction if prove is set. The base
+        case (with the completeness check) and the inductive step can be
+        run separately, in which case progress is the last depth of the
+        base case without counterexamples.
+        """
 
-            prefix = None
-            if self.config.prefix is not None:
-                prefix = self.config.prefix+"-ind"
-
-            if res:
-                if Logger.level(2):
-                    Logger.log("Lemma \"%s\" failed for I -> L"%lemma, 2)
-                    (hr_trace, vcd_trace) = self.print_trace(hts, self._get_model(self.solver), 0, prefix=prefix, map_function=self.config.map_function)
-                    Logger.log("", 2)
-                    if hr_trace:
-                        Logger.log("Counterexample: \n%s"%(hr_trace), 2)
-                    else:
-                        Logger.log("", 2)
-                return False
-            else:
-                Logger.log("Lemma \"%s\" holds for I -> L"%lemma, 2)
-
-            return True
-
-        def check_step():
-            self._reset_assertions(self.solver)
-            self._add_assertion(self.solver, self.at_time(And(trans, lemma), 0))
-            self._add_assertion(self.solver, self.at_time(Not(lemma), 1))
-
-            if self._solve(self.solver):
-                if Logger.level(2):
-                    Logger.log("Lemma \"%s\" failed for L & T -> L'"%lemma, 2)
-                    if Logger.level(3):
-                        (hr_trace, vcd_trace) = self.print_trace(hts, self._get_model(self.solver), 1, prefix=prefix, map_function=self.config.map_function)
-                        if hr_trace or vcd_trace:
-                            vcd_msg = ""
-                            if vcd_trace:
-                                vcd_msg = " and in \"%s\""%(vcd_trace)
-                            Logger.log("Counterexample stored in \"%s\"%s"%(hr_trace, vcd_msg), 2)
-                        else:
-                            Logger.log("", 2)
-                return False
-            else:
-                Logger.log("Lemma \"%s\" holds for L & T -> L'"%lemma, 2)
-
-            return True
-
-
-        if not check_step():
-            return False
-        if not check_init():
-            return False
-                
-        return True
-
-    def _suff_lemmas(self, prop, lemmas):
-        self._reset_assertions(self.solver)
-
-        self._add_assertion(self.solver, And(And(lemmas), Not(prop)))
-        
-        if self._solve(self.solver):
-            return False
-
-        return True
-
-    def add_lemmas(self, hts, prop, lemmas):
-        if len(lemmas) == 0:
-            return (hts, False)
-
-        self._reset_assertions(self.solver)
-
-        h_init = hts.single_init()
-        h_trans = hts.single_trans()
-        
-        holding_lemmas = []
-        lindex = 1
-        nlemmas = len(lemmas)
-        tlemmas = 0
-        flemmas = 0
-        for lemma in lemmas:
-            Logger.log("\nChecking Lemma %s/%s"%(lindex,nlemmas), 1)
-            invar = hts.single_invar()
-            init = And(h_init, invar)
-            trans = And(invar, h_trans, TS.to_next(invar))
-            if self._check_lemma(hts, lemma, init, trans):
-                holding_lemmas.append(lemma)
-                hts.add_assumption(lemma)
-                hts.reset_formulae()
-                
-                Logger.log("Lemma %s holds"%(lindex), 1)
-                tlemmas += 1
-                if self._suff_lemmas(prop, holding_lemmas):
-                    return (hts, True)
-            else:
-                Logger.log("Lemma %s does not hold"%(lindex), 1)
-                flemmas += 1
-                
-            msg = "%s T:%s F:%s U:%s"%(status_bar((float(lindex)/float(nlemmas)), False), tlemmas, flemmas, (nlemmas-lindex))
-            Logger.inline(msg, 0, not(Logger.level(1))) 
-            lindex += 1
-            
-        Logger.clear_inline(0, not(Logger.level(1)))
-        
-        hts.assumptions = And(holding_lemmas)
-        return (hts, False)
-
-    def solve_safety_inc_fwd(self, hts, prop, k, k_min, all_vars=False):
         self._reset_assertions(self.solver)
+        step = step and self.config.prove
 
         if self.config.prove:
             self.solver_ind = self.solver.copy("ind")
@@ -388,9 +370,8 @@ class BMCSafety(BMCSolver):
         trans = hts.single_trans()
         invar = hts.single_invar()
 
-        acc_init = TRUE()
-        acc_prop = TRUE()
-        acc_loop_free = TRUE()
+        act_bad = FALSE()
+        act_ind = None
         trans_t = TRUE()
         
         if self.config.simplify:
@@ -404,102 +385,225 @@ class BMCSafety(BMCSolver):
             if Logger.level(2):
                 Logger.get_timer(timer)
 
-        n_prop_t = FALSE()
-        init_0 = self.at_time(And(init, invar), 0)
-        Logger.log("Add init and invar", 2)
-        self._add_assertion(self.solver, init_0)
+        if base:
+            init_0 = self.at_time(And(init, invar), 0)
+            Logger.log("Add init and invar", 2)
+            self._add_assertion(self.solver, init_0)
 
-        if self.config.prove:
+        if step:
             # add invariants at time 0, but not init
             self._add_assertion(self.solver_ind, self.at_time(invar, 0), "invar")
 
+        if self.config.prove:
+            # Enables the constraints !I & loopFree on the BMC solver
+            act_ind = self._activation_literal("ind")
+
         next_prop = TS.has_next(prop)
         if next_prop:
             if k < 1:
                 Logger.error("Invariant checking with next variables requires at least k=1")
             k_min = 1
 
+        # A depth that runs out of the budget is solved again in cubes, as
+        # are the following ones
+        split = False
+        cube_formula = And(trans, invar, Not(prop))
+
         t = 0
         while (t < k+1):
-            self._push(self.solver)
-
             t_prop = t-1 if next_prop else t
-            
-            if k_min > 0:
-                if (not next_prop) or (next_prop and t>0):
-                    n_prop_t = Or(n_prop_t, self.at_time(Not(prop), t_prop))
-            else:
-                n_prop_t = self.at_time(Not(prop), t)
 
-            Logger.log("Add not property at time %d"%t, 2)
-            self._add_assertion(self.solver, n_prop_t)
+            # The activation literal of depth t enables the violation of the
+            # property at t or, when skipped (k_min), at a previous depth
+            if base and ((not next_prop) or (t > 0)):
+                act_prop = self._activation_literal("prop_k%s"%t)
+                Logger.log("Add not property at time %d"%t, 2)
+                self._add_assertion(self.solver, Implies(act_prop, Or(act_bad, self.at_time(Not(prop), t_prop))), "not property")
+                act_bad = act_prop
 
-            if t >= k_min:
+            if base and (t >= k_min):
                 Logger.log("\nSolving for k=%s"%(t), 1)
 
-                if self._solve(self.solver):
+                if split:
+                    res = self._solve_cubes(self.solver, [act_bad], hts, cube_formula, t_prop)
+                elif self.config.cube_split > 0:
+                    res = self._solve_budget(self.solver, [act_bad], self.config.cube_split)
+                    if res is None:
+                        Logger.log("Solving time above %s sec, splitting in cubes"%(self.config.cube_split), 1)
+                        split = True
+                        res = self._solve_cubes(self.solver, [act_bad], hts, cube_formula, t_prop)
+                else:
+                    res = self._solve(self.solver, [act_bad])
+
+                if res:
                     Logger.log("Counterexample found with k=%s"%(t), 1)
                     model = self._get_model(self.solver)
                     return (t, model)
                 else:
                     Logger.log("No counterexample found with k=%s"%(t), 1)
                     Logger.msg(".", 0, not(Logger.level(1)))
-                    #self._add_assertion(self.solver, Not(n_prop_t))
-            else:
+                    self._add_assertion(self.solver, Not(act_bad))
+                    if progress is not None:
+                        progress.value = t
+            elif base:
                 Logger.log("\nSkipping solving for k=%s (k_min=%s)"%(t,k_min), 1)
                 Logger.msg(".", 0, not(Logger.level(1)))
-
-            self._pop(self.solver)
             
-            if self.config.prove:
-                if t > k_min:
-                    loop_free = self.loop_free(relevant_vars, t, t-1)
-
-                    # Checking I & T & loopFree
-                    acc_init = And(acc_init, self.at_time(Not(init), t))
-                    acc_loop_free = And(acc_loop_free, loop_free)
-                    
-                    self._push(self.solver)
+            if self.config.prove and (t > k_min):
+                loop_free = self.loop_free(relevant_vars, t, t-1)
 
-                    self._add_assertion(self.solver, acc_init)
-                    self._add_assertion(self.solver, acc_loop_free)
-                    
-                    if self._solve(self.solver):
-                        Logger.log("Induction (I & lF) failed with k=%s"%(t), 1)
-                    else:
-                        Logger.log("Induction (I & lF) holds with k=%s"%(t), 1)
-                        return (t, True)
+            if base and self.config.prove and (t > k_min):
+                # Checking I & T & loopFree
+                self._add_assertion(self.solver, Implies(act_ind, And(self.at_time(Not(init), t), loop_free)))
 
-                    self._pop(self.solver)
+                if self._solve(self.solver, [act_ind]):
+                    Logger.log("Induction (I & lF) failed with k=%s"%(t), 1)
+                else:
+                    Logger.log("Induction (I & lF) holds with k=%s"%(t), 1)
+                    return (t, True)
 
+            if step:
+                if t > k_min:
                     # Checking T & loopFree & !P
                     self._add_assertion(self.solver_ind, trans_t, comment="trans")
                     self._add_assertion(self.solver_ind, loop_free, comment="loop_free")
-                    
-                    self._push(self.solver_ind)
 
-                    self._add_assertion(self.solver_ind, self.at_time(Not(prop), t_prop))
+                    act_prop = self._activation_literal("ind_k%s"%t)
+                    self._add_assertion(self.solver_ind, Implies(act_prop, self.at_time(Not(prop), t_prop)))
 
-                    if self._solve(self.solver_ind):
+                    if self._solve(self.solver_ind, [act_prop]):
                         Logger.log("Induction (lF & !P) failed with k=%s"%(t), 1)
                     else:
                         Logger.log("Induction (lF & !P) holds with k=%s"%(t), 1)
+                        if progress is not None:
+                            # The proof requires the base case up to t
+                            while progress.value < t:
+                                time.sleep(POLLING)
                         return (t, True)
 
-                    self._pop(self.solver_ind)
-
+                    self._add_assertion(self.solver_ind, Not(act_prop))
                     self._add_assertion(self.solver_ind, self.at_time(prop, t_prop), "prop")
                 else:
                     if not next_prop:
                         self._add_assertion(self.solver_ind, self.at_time(prop, t_prop), "prop")
 
             trans_t = self.unroll(trans, invar, t+1, t)
-            self._add_assertion(self.solver, trans_t)
+            if base:
+                self._add_assertion(self.solver, trans_t)
                     
             t += 1
             
         return (t-1, None)
 
+    def solve_safety_multi(self, hts, props, k, k_min):
+        """Incremental FWD BMC of several invariants on a single unrolling.
+
+        Each property has its own chain of activation literals for the
+        violations, and is retired when falsified or proven. Returns
+        (t, model, time) for each property, where model is True if the
+        property holds, and None if unknown, and time is when the property
+        was retired.
+        """
+
+        start_time = time.time()
+        self._reset_assertions(self.solver)
+
+        init = hts.single_init()
+        trans = hts.single_trans()
+        invar = hts.single_invar()
+
+        if self.config.simplify:
+            init = simplify(init)
+            trans = simplify(trans)
+            invar = simplify(invar)
+
+        next_props = [TS.has_next(prop) for prop in props]
+        if (True in next_props) and (k < 1):
+            Logger.error("Invariant checking with next variables requires at least k=1")
+
+        k_mins = [max(k_min, 1) if next_prop else k_min for next_prop in next_props]
+        results = [None for prop in props]
+        act_bad = [FALSE() for prop in props]
+
+        self._add_assertion(self.solver, self.at_time(And(init, invar), 0), "init")
+
+        if self.config.prove:
+            self.solver_ind = self.solver.copy("ind")
+            self._reset_assertions(self.solver_ind)
+            self._add_assertion(self.solver_ind, self.at_time(invar, 0), "invar")
+
+            relevant_vars = hts.state_vars | hts.input_vars | hts.output_vars
+            act_ind = self._activation_literal("ind")
+            act_hold = [self._activation_literal("hold_%s"%i) for i in range(len(props))]
+            complete = False
+
+        trans_t = TRUE()
+        t = 0
+        while (t < k+1) and (None in results):
+            Logger.log("\nSolving for k=%s (%s properties)"%(t, results.count(None)), 1)
+
+            for i in [i for i in range(len(props)) if results[i] is None]:
+                t_prop = t-1 if next_props[i] else t
+
+                if (not next_props[i]) or (t > 0):
+                    act_prop = self._activation_literal("prop%s_k%s"%(i, t))
+                    self._add_assertion(self.solver, Implies(act_prop, Or(act_bad[i], self.at_time(Not(props[i]), t_prop))))
+                    act_bad[i] = act_prop
+
+                if t < k_mins[i]:
+                    continue
+
+                if self._solve(self.solver, [act_bad[i]]):
+                    Logger.log("Counterexample found for property %s with k=%s"%(i, t), 1)
+                    results[i] = (t, self._get_model(self.solver), time.time()-start_time)
+                else:
+                    self._add_assertion(self.solver, Not(act_bad[i]))
+
+            if self.config.prove and (None in results):
+                if t > min(k_mins):
+                    loop_free = self.loop_free(relevant_vars, t, t-1)
+
+                    # Checking I & T & loopFree, which is independent of the properties
+                    if not complete:
+                        self._add_assertion(self.solver, Implies(act_ind, And(self.at_time(Not(init), t), loop_free)))
+                        complete = not self._solve(self.solver, [act_ind])
+                        if complete:
+                            Logger.log("Induction (I & lF) holds with k=%s"%(t), 1)
+
+                    self._add_assertion(self.solver_ind, trans_t, comment="trans")
+                    self._add_assertion(self.solver_ind, loop_free, comment="loop_free")
+
+                for i in [i for i in range(len(props)) if results[i] is None]:
+                    t_prop = t-1 if next_props[i] else t
+
+                    if t > k_mins[i]:
+                        if complete:
+                            results[i] = (t, True, time.time()-start_time)
+                            continue
+
+                        # Checking T & loopFree & !P
+                        act_prop = self._activation_literal("ind%s_k%s"%(i, t))
+                        self._add_assertion(self.solver_ind, Implies(act_prop, self.at_time(Not(props[i]), t_prop)))
+
+                        if not self._solve(self.solver_ind, [act_hold[i], act_prop]):
+                            Logger.log("Induction (lF & !P) holds for property %s with k=%s"%(i, t), 1)
+                            results[i] = (t, True, time.time()-start_time)
+                            continue
+
+                        self._add_assertion(self.solver_ind, Not(act_prop))
+                        self._add_assertion(self.solver_ind, Implies(act_hold[i], self.at_time(props[i], t_prop)))
+                    elif not next_props[i]:
+                        self._add_assertion(self.solver_ind, Implies(act_hold[i], self.at_time(props[i], t_prop)))
+
+            Logger.msg(".", 0, not(Logger.level(1)))
+
+            trans_t = self.unroll(trans, invar, t+1, t)
+            self._add_assertion(self.solver, trans_t)
+
+            t += 1
+
+        return [res if res is not None else (t-1, None, time.time()-start_time) for res in results]
+
     def solve_safety_inc_bwd(self, hts, prop, k, assert_property=False):
         self._reset_assertions(self.solver)
 
@@ -516,13 +620,12 @@ class BMCSafety(BMCSolver):
 
         t = 0
         while (t < k+1):
-            self._push(self.solver)
-
+            act_init = self._activation_literal("init_k%s"%t)
             pinit = self.at_ptime(init, t-1)
             Logger.log("Add init at time %d"%t, 2)
-            self._add_assertion(self.solver, pinit)
+            self._add_assertion(self.solver, Implies(act_init, pinit))
 
-            if self._solve(self.solver):
+            if self._solve(self.solver, [act_init]):
                 Logger.log("Counterexample found with k=%s"%(t), 1)
                 model = self._get_model(self.solver)
                 return (t, model)
@@ -530,7 +633,7 @@ class BMCSafety(BMCSolver):
                 Logger.log("No counterexample found with k=%s"%(t), 1)
                 Logger.msg(".", 0, not(Logger.level(1)))
 
-            self._pop(self.solver)
+            self._add_assertion(self.solver, Not(act_init))
 
             trans_t = self.unroll(trans, invar, t, t+1)
             self._add_assertion(self.solver, trans_t)
@@ -564,7 +667,6 @@ class BMCSafety(BMCSolver):
 
         t = 0
         while (t < k+1):
-            self._push(self.solver)
             even = (t % 2) == 0
             th = int(t/2)
 
@@ -573,10 +675,11 @@ class BMCSafety(BMCSolver):
             else:
                 eq = And([EqualsOrIff(self.at_time(v, th+1), self.at_ptime(v, th-1)) for v in hts.vars])
 
+            act_eq = self._activation_literal("eq_k%s"%t)
             Logger.log("Add equivalence time %d"%t, 2)
-            self._add_assertion(self.solver, eq)
+            self._add_assertion(self.solver, Implies(act_eq, eq))
 
-            if self._solve(self.solver):
+            if self._solve(self.solver, [act_eq]):
                 Logger.log("Counterexample found with k=%s"%(t), 1)
                 model = self._get_model(self.solver)
                 return (t, model)
@@ -584,7 +687,7 @@ class BMCSafety(BMCSolver):
                 Logger.log("No counterexample found with k=%s"%(t), 1)
                 Logger.msg(".", 0, not(Logger.level(1)))
 
-            self._pop(self.solver)
+            self._add_assertion(self.solver, Not(act_eq))
 
             if even:
                 trans_t = self.unroll(trans, invar, th+1, th)
@@ -598,21 +701,221 @@ class BMCSafety(BMCSolver):
         return (t-1, None)
 
     
+    def portfolio_engines(self, prop):
+        if self.config.portfolio is not None:
+            return PortfolioEngine.parse(self.config.portfolio, self.config.solver_name)
+
+        strategies = [VerificationStrategy.FWD]
+        if self.config.prove and (not TS.has_next(prop)):
+            strategies += [VerificationStrategy.INT, VerificationStrategy.PDR]
+        if self.config.incremental:
+            strategies += [VerificationStrategy.BWD, VerificationStrategy.ZZ]
+
+        return [PortfolioEngine(strategy, self.config.solver_name) for strategy in strategies]
+
+    def _run_engine(self, engine, prop, k, k_min):
+        config = copy.copy(self.config)
+        config.strategy = engine.strategy
+        config.solver_name = engine.solver_name
+
+        if config.smt2file is not None:
+            (path, filename) = os.path.split(config.smt2file)
+            filename = filename.split(".")
+            filename[0] += "-%s_%s"%(engine.strategy.lower(), engine.solver_name)
+            config.smt2file = os.path.join(path, ".".join(filename))
+
+        # Lemmas, random simulation and mining are already done by the portfolio
+        self.hts.lemmas = None
+        config.random_sim = 0
+        config.mine_invariants = None
+
+        bmc_safety = BMCSafety(self.hts, config)
+        try:
+            return bmc_safety.safety(prop, k, k_min)
+        finally:
+            bmc_safety.close_traces()
+
+    def safety_portfolio(self, prop, k, k_min, lemmas):
+        if lemmas is not None:
+            (hts, res) = self.add_lemmas(self.hts, prop, lemmas)
+            if res:
+                Logger.log("Lemmas imply the property", 1)
+                Logger.log("", 0, not(Logger.level(1)))
+                return (VerificationStatus.TRUE, None, 0)
+            # The engines check the system with the inductive lemmas as assumptions
+            self.hts = hts
+
+        engines = self.portfolio_engines(prop)
+        Logger.log("Portfolio: %s"%(", ".join([engine.name for engine in engines])), 1)
+
+        pool = ProcessPool(len(engines))
+        for engine in engines:
+            pool.submit(engine.name, self._run_engine, (engine, prop, k, k_min), engine.budget)
+
+        result = (VerificationStatus.UNK, None, 0)
+        try:
+            for (name, status, res, elapsed) in pool.results():
+                if status != TaskStatus.OK:
+                    Logger.warning("Engine %s terminated with status %s"%(name, status))
+                    Logger.log(str(res), 2)
+                    continue
+
+                Logger.log("Engine %s returned %s in %.2f sec"%(name, res[0], elapsed), 1)
+
+                if res[0] in [VerificationStatus.TRUE, VerificationStatus.FALSE]:
+                    Logger.log("Portfolio winner: %s"%(name), 1)
+                    self.engine = name
+                    return res
+
+                result = (VerificationStatus.UNK, None, max(result[2], res[2]))
+        finally:
+            pool.terminate()
+
+        return result
+
+    def _run_kind_worker(self, hts, prop, k, k_min, base, progress):
+        (t, model) = self.solve_safety_inc_fwd(hts, prop, k, k_min, base=base, step=not base, progress=progress)
+
+        if model == True:
+            return (VerificationStatus.TRUE, None, t)
+        elif model is not None:
+            model = self._remap_model(hts.vars, model, t)
+            trace = self.print_trace(hts, model, t, get_free_variables(prop), map_function=self.config.map_function)
+            return (VerificationStatus.FALSE, trace, t)
+
+        return (VerificationStatus.UNK, None, t)
+
+    def safety_parallel(self, hts, prop, k, k_min):
+        """k-induction with the base case and the inductive step in two workers"""
+
+        self._init_at_time(hts.vars)
+
+        if hts.lemmas is not None:
+            (hts, res) = self.add_lemmas(hts, prop, hts.lemmas)
+            if res:
+                Logger.log("Lemmas imply the property", 1)
+                Logger.log("", 0, not(Logger.level(1)))
+                return (VerificationStatus.TRUE, None, 0)
+
+        hts.reset_formulae()
+
+        # Last depth of the base case without counterexamples, shared with the workers
+        progress = multiprocessing.get_context("fork").Value("i", -1)
+
+        pool = ProcessPool(2)
+        pool.submit("base", self._run_kind_worker, (hts, prop, k, k_min, True, progress))
+        pool.submit("step", self._run_kind_worker, (hts, prop, k, k_min, False, progress))
+
+        result = (VerificationStatus.UNK, None, k)
+        try:
+            for (name, status, res, elapsed) in pool.results():
+                if status != TaskStatus.OK:
+                    Logger.warning("k-induction %s terminated with status %s"%(name, status))
+                    Logger.log(str(res), 2)
+                    if name == "base":
+                        # Without the base case the step cannot conclude
+                        break
+                    continue
+
+                Logger.log("k-induction %s returned %s with k=%s in %.2f sec"%(name, res[0], res[2], elapsed), 1)
+
+                if res[0] in [VerificationStatus.TRUE, VerificationStatus.FALSE]:
+                    return res
+        finally:
+            pool.terminate()
+
+        return result
+
     def safety(self, prop, k, k_min):
-        lemmas = self.hts.lemmas
-        self._init_at_time(self.hts.vars, k)
-        (t, model) = self.solve_safety(self.hts, prop, k, k_min, lemmas)
+        hts = self.preprocess(self.hts, [prop])
+
+        if self.config.random_sim > 0:
+            (t, model) = self.random_simulation(hts, Not(prop), k, k_min)
+            if model is not None:
+                trace = self.print_trace(hts, model, t, get_free_variables(prop), map_function=self.config.map_function)
+                return (VerificationStatus.FALSE, trace, t)
+
+        if self.config.prove and (self.config.mine_invariants is not None):
+            hts = self.mine_invariants(hts, k)
+
+        if self.config.strategy == VerificationStrategy.ALL:
+            return self.safety_portfolio(prop, k, k_min, hts.lemmas)
+
+        if self.config.prove and self.config.parallel_prove and self.config.incremental and \
+           (self.config.strategy in [VerificationStrategy.FWD, VerificationStrategy.AUTO]):
+            return self.safety_parallel(hts, prop, k, k_min)
+
+        lemmas = hts.lemmas
+        self._init_at_time(hts.vars)
+
+        (t, model) = self.solve_safety(hts, prop, k, k_min, lemmas)
 
         if model == True:
             return (VerificationStatus.TRUE, None, t)
         elif model is not None:
-            model = self._remap_model(self.hts.vars, model, t)
-            trace = self.print_trace(self.hts, model, t, get_free_variables(prop), map_function=self.config.map_function)
+            model = self._remap_model(hts.vars, model, t)
+            trace = self.print_trace(hts, model, t, get_free_variables(prop), map_function=self.config.map_function)
             return (VerificationStatus.FALSE, trace, t)
         else:
             return (VerificationStatus.UNK, None, t)
 
-    def sim_no_unroll(self, hts, cover, k, all_vars=True, inc=False):
+    def safety_multi(self, props, k, k_min):
+        """Checks several invariants, and returns (res, trace, t) for each of them.
+        The time at which each verdict is reached is stored in verdict_times"""
+
+        start_time = time.time()
+        self.verdict_times = [None for prop in props]
+
+        lemmas = self.hts.lemmas
+        if (not self.config.incremental) or \
+           (self.config.strategy not in [VerificationStrategy.FWD, VerificationStrategy.AUTO]) or \
+           ((lemmas is not None) and (len(lemmas) > 0)):
+            Logger.log("Multi-property checking requires the incremental FWD strategy, without lemmas", 1)
+            results = []
+            for i in range(len(props)):
+                results.append(self.safety(props[i], k, k_min))
+                self.verdict_times[i] = time.time()-start_time
+            return results
+
+        hts = self.preprocess(self.hts, props)
+        results = [None for prop in props]
+
+        if self.config.random_sim > 0:
+            for i in range(len(props)):
+                (t, model) = self.random_simulation(hts, Not(props[i]), k, k_min)
+                if model is not None:
+                    trace = self.print_trace(hts, model, t, get_free_variables(props[i]), map_function=self.config.map_function)
+                    results[i] = (VerificationStatus.FALSE, trace, t)
+                    self.verdict_times[i] = time.time()-start_time
+
+        unsolved = [i for i in range(len(props)) if results[i] is None]
+        if len(unsolved) == 0:
+            return results
+
+        hts.reset_formulae()
+        self._init_at_time(hts.vars)
+
+        solve_time = time.time()-start_time
+        outcomes = self.solve_safety_multi(hts, [props[i] for i in unsolved], k, k_min)
+
+        for (i, (t, model, verdict_time)) in zip(unsolved, outcomes):
+            self.verdict_times[i] = solve_time + verdict_time
+            if model == True:
+                results[i] = (VerificationStatus.TRUE, None, t)
+            elif model is not None:
+                model = self._remap_model(hts.vars, model, t)
+                trace = self.print_trace(hts, model, t, get_free_variables(props[i]), map_function=self.config.map_function)
+                results[i] = (VerificationStatus.FALSE, trace, t)
+            else:
+                results[i] = (VerificationStatus.UNK, None, t)
+
+        return results
+
+    def sim_no_unroll(self, hts, cover, k, all_vars=True):
+        """Picks a successor state at each step, on a single solver where the
+        current state is pinned by an activation literal
+        """
+
         init = hts.single_init()
         invar = hts.single_invar()
         trans = hts.single_trans()
@@ -635,14 +938,16 @@ class BMCSafety(BMCSolver):
         relevant_vars_01 = [(TS.get_timed(v, 0), TS.get_timed(v, 1), v) for v in relevant_vars]
         
         self._reset_assertions(self.solver)
+        self._add_assertion(self.solver, invar_0)
         
         # Picking Initial State
         Logger.log("\nSolving for k=0", 1)
-        self._add_assertion(self.solver, And(init_0, invar_0))
+        act_state = self._activation_literal("state")
+        self._add_assertion(self.solver, Implies(act_state, init_0))
 
-        if self._solve(self.solver):
+        if self._solve(self.solver, [act_state]):
             init_model =  self._get_model(self.solver, relevant_vars_0)
-            init_0 = And([EqualsOrIff(v, init_model[v]) for v in relevant_vars_0])
+            state_0 = And([EqualsOrIff(v, init_model[v]) for v in relevant_vars_0])
 
             for v in relevant_vars_0:
                 full_model[v] = init_model[v]
@@ -651,72 +956,57 @@ class BMCSafety(BMCSolver):
         else:
             return (0, None)
 
-        self._reset_assertions(self.solver)
-        
-        if inc:
-            self._add_assertion(self.solver, trans_01)
-            self._add_assertion(self.solver, invar_0)
+        # The retired activation literals are asserted false, hence the
+        # solver keeps a constant set of active constraints
+        self._add_assertion(self.solver, Not(act_state))
+        self._add_assertion(self.solver, trans_01)
 
         init_model = None
         for t in range(1, k + 1):
             Logger.log("\nSolving for k=%s"%(t), 1)
 
-            if not inc:
-                self._reset_assertions(self.solver, True)
+            act_state = self._activation_literal("state")
+            self._add_assertion(self.solver, Implies(act_state, state_0))
 
-                formula = And(init_0, invar_0)
-                self._add_assertion(self.solver, trans_01)
-            else:
-                formula = init_0
-                self._push(self.solver)
-                
-            self._add_assertion(self.solver, formula)
-
-            res_step = self._solve(self.solver)
+            res_step = self._solve(self.solver, [act_state])
 
             if res_step:
                 Logger.msg(".", 0, not(Logger.level(1)))
                 Logger.log("Able to step forward at k=%s"%(t), 2)
-                if all_vars:
-                    init_model = self._get_model(self.solver)
-                else:
-                    init_model = self._get_model(self.solver, relevant_vars_1)
-                model = init_model
+                # The full model would include all the activation literals
+                init_model = self._get_model(self.solver, relevant_vars_1)
             else:
                 Logger.log("System deadlocked at k=%s"%(t), 2)
                 return (-1, full_model)
 
             # Use previous model as initial state for next sat call
-            init_0 = []
-            init_1 = []
+            state_0 = []
+            state_1 = []
             
             for v in relevant_vars_01:
                 if v[1] not in init_model:
                     continue
                 val = init_model[v[1]]
                 full_model[TS.get_timed(v[2], t)] = val
-                init_0.append(EqualsOrIff(v[0], val))
-                init_1.append(EqualsOrIff(v[1], val))
+                state_0.append(EqualsOrIff(v[0], val))
+                state_1.append(EqualsOrIff(v[1], val))
 
-            init_0 = And(init_0)
+            state_0 = And(state_0)
 
             if cover != TRUE():
-                init_1 = And(init_1)
-
-                self._add_assertion(self.solver, init_1)
-                self._add_assertion(self.solver, cover_1)
+                act_cover = self._activation_literal("cover")
+                self._add_assertion(self.solver, Implies(act_cover, And(And(state_1), cover_1)))
 
-                res_cont = self._solve(self.solver)
+                res_cont = self._solve(self.solver, [act_state, act_cover])
+                self._add_assertion(self.solver, Not(act_cover))
 
                 if res_cont:
                     Logger.log('Reached cover in no unroll simulation at k=%s'%(t), 2)
-                    model = init_model
                     return (t, full_model)
                 else:
                     Logger.log('Cover not reached at k=%s'%t, 2)
 
-            if inc:
-                self._pop(self.solver)
+            self._add_assertion(self.solver, Not(act_state))
                 
         return (t, full_model)
 
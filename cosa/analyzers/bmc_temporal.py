@@ -11,7 +11,7 @@
 import re
 import math
 
-from pysmt.shortcuts import BV, And, Or, Solver, TRUE, FALSE, Not, EqualsOrIff, Implies, Iff, Symbol, BOOL, simplify, BVAdd, BVUGE
+from pysmt.shortcuts import BV, And, Or, Solver, TRUE, FALSE, Not, EqualsOrIff, Implies, Iff, Symbol, BOOL, simplify, BVAdd, BVUGE, Ite
 from pysmt.smtlib.printers import SmtPrinter, SmtDagPrinter
 from pysmt.typing import BOOL
 
@@ -31,6 +31,11 @@ NL = "\n"
 EQVAR = HIDDEN+"eq_var"+HIDDEN
 HEQVAR = HIDDEN+"heq_var"+HIDDEN
 
+L2S_SAVE = HIDDEN+"l2s_save"+HIDDEN
+L2S_SAVED = HIDDEN+"l2s_saved"+HIDDEN
+L2S_LIVE = HIDDEN+"l2s_live"+HIDDEN
+L2S_SHADOW = HIDDEN+"l2s"+HIDDEN
+
 class BMCTemporal(BMCSolver):
 
     hts = None
@@ -86,7 +91,7 @@ class BMCTemporal(BMCSolver):
         heqvar = None
         if not eventually:
             heqvar = Symbol(HEQVAR, BOOL)
-            self._init_at_time(hts.vars.union(set([heqvar])), k)
+            self._init_at_time(hts.vars.union(set([heqvar])))
 
         if self.config.prove:
             self.solver_klive = self.solver.copy("klive")
@@ -111,20 +116,19 @@ class BMCTemporal(BMCSolver):
         
         t = 0 
         while (t < k+1):
-            self._push(self.solver)
-
             loopback = FALSE()
             if t > 0:
-                loopback = self.all_loopbacks(self.hts.vars, t, heqvar)
-                
+                loopback = self.all_loopbacks(hts.vars, t, heqvar)
+
+            act_loop = self._activation_literal("loop_k%s"%t)
             Logger.log("Add loopbacks at time %d"%t, 2)
-            self._add_assertion(self.solver, loopback)
+            self._add_assertion(self.solver, Implies(act_loop, loopback))
 
             if t >= k_min:
                 self._write_smt2_comment(self.solver, "Solving for k=%s"%(t))
                 Logger.log("\nSolving for k=%s"%(t), 1)
                 
-                if self._solve(self.solver):
+                if self._solve(self.solver, [act_loop]):
                     Logger.log("Counterexample found with k=%s"%(t), 1)
                     model = self._get_model(self.solver)
                     return (t, model)
@@ -134,8 +138,8 @@ class BMCTemporal(BMCSolver):
             else:
                 Logger.log("Skipping solving for k=%s (k_min=%s)"%(t,k_min), 1)
                 Logger.msg(".", 0, not(Logger.level(1)))
-                    
-            self._pop(self.solver)
+
+            self._add_assertion(self.solver, Not(act_loop))
 
             n_prop = Not(prop)
             if not eventually:
@@ -225,32 +229,90 @@ class BMCTemporal(BMCSolver):
             
         return loopback
     
+    def liveness_to_safety_hts(self, hts, prop, eventually=False):
+        """Returns the system extended with the liveness to safety monitor, and its
+        safety property (Biere, Artho, Schuppan, Liveness Checking as Safety Checking).
+
+        The oracle input save copies the state in the shadow registers, and
+        the property is violated when the current state is equal to the
+        saved one and prop did not hold since then (or since the initial
+        state, for eventually).
+        """
+
+        trans = hts.single_trans()
+        state_vars = set(hts.state_vars)
+        for var in get_free_variables(trans):
+            if TS.is_prime(var):
+                state_vars.add(TS.get_ref_var(var))
+        state_vars = sorted(state_vars, key=lambda v: v.symbol_name())
+
+        save = Symbol(L2S_SAVE, BOOL)
+        saved = Symbol(L2S_SAVED, BOOL)
+        live = Symbol(L2S_LIVE, BOOL)
+
+        ts = TS("Liveness to safety")
+        ts.add_input_var(save)
+        ts.add_state_var(saved)
+        ts.add_state_var(live)
+
+        do_save = And(save, Not(saved))
+
+        trans = []
+        trans.append(EqualsOrIff(TS.get_prime(saved), Or(saved, save)))
+
+        if eventually:
+            trans.append(EqualsOrIff(TS.get_prime(live), Or(live, prop)))
+        else:
+            trans.append(EqualsOrIff(TS.get_prime(live), Or(live, And(prop, Or(saved, save)))))
+
+        eq_shadow = []
+        for var in state_vars:
+            shadow = TS.get_prefix(var, L2S_SHADOW)
+            ts.add_state_var(shadow)
+            trans.append(EqualsOrIff(TS.get_prime(shadow), Ite(do_save, var, shadow)))
+            eq_shadow.append(EqualsOrIff(var, shadow))
+
+        ts.init = And(Not(saved), Not(live))
+        ts.trans = And(trans)
+        ts.invar = TRUE()
+
+        Logger.log("Liveness to safety with %s shadow variables"%(len(state_vars)), 1)
+
+        l2s_hts = HTS(hts.name)
+        l2s_hts.combine(hts)
+        l2s_hts.add_ts(ts)
+        l2s_hts.definitions = hts.definitions
+
+        return (l2s_hts, Not(And(saved, Not(live), And(eq_shadow))))
+
     def liveness(self, prop, k, k_min):
-        lemmas = self.hts.lemmas
-        self._init_at_time(self.hts.vars, k)
-        (t, model) = self.solve_liveness(self.hts, prop, k, k_min, False, lemmas)
+        hts = self.preprocess(self.hts, [prop])
+        lemmas = hts.lemmas
+        self._init_at_time(hts.vars)
+        (t, model) = self.solve_liveness(hts, prop, k, k_min, False, lemmas)
 
-        model = self._remap_model(self.hts.vars, model, t)
+        model = self._remap_model(hts.vars, model, t)
 
         if model == True:
             return (VerificationStatus.TRUE, None, t)
         elif model is not None:
-            trace = self.print_trace(self.hts, model, t, get_free_variables(prop), map_function=self.config.map_function, find_loop=True)
+            trace = self.print_trace(hts, model, t, get_free_variables(prop), map_function=self.config.map_function, find_loop=True)
             return (VerificationStatus.FALSE, trace, t)
         else:
             return (VerificationStatus.UNK, None, t)
 
     def eventually(self, prop, k, k_min):
-        lemmas = self.hts.lemmas
-        self._init_at_time(self.hts.vars, k)
-        (t, model) = self.solve_liveness(self.hts, prop, k, k_min, True, lemmas)
+        hts = self.preprocess(self.hts, [prop])
+        lemmas = hts.lemmas
+        self._init_at_time(hts.vars)
+        (t, model) = self.solve_liveness(hts, prop, k, k_min, True, lemmas)
 
-        model = self._remap_model(self.hts.vars, model, t)
+        model = self._remap_model(hts.vars, model, t)
 
         if model == True:
             return (VerificationStatus.TRUE, None, t)
         elif model is not None:
-            trace = self.print_trace(self.hts, model, t, get_free_variables(prop), map_function=self.config.map_function, find_loop=True)
+            trace = self.print_trace(hts, model, t, get_free_variables(prop), map_function=self.config.map_function, find_loop=True)
             return (VerificationStatus.FALSE, trace, t)
         else:
             return (VerificationStatus.UNK, None, t)
@@ -0,0 +1,366 @@
+# Copyright 2018 Cristian Mattarei
+#
+# Licensed under the modified BSD (3-clause BSD) License.
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from pysmt.shortcuts import And, Not, TRUE
+
+from cosa.utils.logger import Logger
+from cosa.utils.formula_mngm import get_free_variables
+from cosa.representation import TS, HTS
+
+INIT = 0
+TRANS = 1
+INVAR = 2
+
+class ConeOfInfluence(object):
+    """Cone of influence reduction of an HTS.
+
+    The init, trans and invar of each TS are split into conjuncts. A
+    conjunct that defines a variable (i.e., x' = f(...) in trans, or x = f(...)
+    in init and invar, with x not in f, possibly under a guard) makes the
+    variable depend on the others, while any other conjunct is a
+    constraint among its variables. A variable with more than one
+    definition in the same frame (other than g -> ... and !g -> ...) is
+    not defined, since its definitions also constrain the other
+    variables, and they are kept as constraints. The same holds for
+    definitions that depend on each other in the same frame (e.g., x = !y
+    and y = x), which are cyclic and can restrict the other variables in
+    their support. The cone of a set of formulae
+    contains the definitions of the variables in their support and,
+    transitively, of their dependencies, and the constraints that can
+    affect them.
+
+    The analysis is built once per HTS, and the reduced systems are
+    cached on the support of the formulae.
+    """
+
+    tss = None
+    conjuncts = None
+    definitions = None
+    constraints = None
+    closures = None
+    cones = None
+
+    def __init__(self, hts):
+        self.tss = frozenset(hts.tss)
+        self.conjuncts = []
+        self.definitions = {}
+        self.constraints = {}
+        self.closures = {}
+        self.cones = {}
+
+        conjuncts = []
+        for ts in hts.tss:
+            for (kind, formula) in [(INIT, ts.init), (TRANS, ts.trans), (INVAR, ts.invar)]:
+                if formula is not None:
+                    for conjunct in self._split(formula):
+                        conjuncts.append((ts, kind, conjunct, self._defined_vars(kind, conjunct)))
+
+        multiple = self._multiply_defined(conjuncts) | self._cyclically_defined(conjuncts)
+        for (ts, kind, conjunct, outputs) in conjuncts:
+            if not outputs.isdisjoint(multiple):
+                outputs = set([])
+            self._add_conjunct(ts, kind, conjunct, outputs)
+
+    @staticmethod
+    def get(hts):
+        """Returns the analysis of hts, which is kept until its TSs change"""
+
+        if (hts.coi is None) or (hts.coi.tss != frozenset(hts.tss)):
+            hts.coi = ConeOfInfluence(hts)
+        return hts.coi
+
+    def _split(self, formula):
+        conjuncts = []
+        to_visit = [formula]
+        while len(to_visit) > 0:
+            formula = to_visit.pop()
+            if formula.is_and():
+                to_visit += list(formula.args())
+            elif not formula.is_true():
+                conjuncts.append(formula)
+        return conjuncts
+
+    def _definition(self, kind, formula):
+        """Returns the symbol defined by formula, i.e., x = f(...) with x not in f"""
+
+        if formula.is_equals() or formula.is_iff():
+            for (lhs, rhs) in [formula.args(), reversed(formula.args())]:
+                if (not lhs.is_symbol()) or (TS.is_prime(lhs) != (kind == TRANS)) or TS.is_prev(lhs):
+                    continue
+                if lhs not in get_free_variables(rhs):
+                    return lhs
+
+        return None
+
+    def _complementary(self, formula1, formula2):
+        """True if formula1 and formula2 are g -> A and !g -> B"""
+
+        if not (formula1.is_implies() and formula2.is_implies()):
+            return False
+        (guard1, guard2) = (formula1.args()[0], formula2.args()[0])
+        return (guard1 == Not(guard2)) or (guard2 == Not(guard1))
+
+    def _defined_symbols(self, kind, formula):
+        """Returns the symbols defined by formula, which is a definition, a guarded
+        definition (g -> ...), a conjunction of definitions of independent symbols,
+        or a pair of complementary guarded definitions (g -> ...) & (!g -> ...).
+        Returns None if formula also constrains the other symbols"""
+
+        if formula.is_implies():
+            (guard, body) = formula.args()
+            symbols = self._defined_symbols(kind, body)
+            if (symbols is None) or (not symbols.isdisjoint(get_free_variables(guard))):
+                return None
+            return symbols
+
+        if formula.is_and():
+            args = formula.args()
+            defined = [self._defined_symbols(kind, arg) for arg in args]
+            if None in defined:
+                return None
+
+            if (len(args) == 2) and (defined[0] == defined[1]) and self._complementary(args[0], args[1]):
+                return defined[0]
+
+            symbols = set([])
+            for (arg, arg_symbols) in zip(args, defined):
+                if not symbols.isdisjoint(arg_symbols):
+                    return None
+                symbols |= arg_symbols
+            for (arg, arg_symbols) in zip(args, defined):
+                if not (symbols - arg_symbols).isdisjoint(get_free_variables(arg)):
+                    return None
+            return symbols
+
+        symbol = self._definition(kind, formula)
+        return set([symbol]) if symbol is not None else None
+
+    def _defined_vars(self, kind, conjunct):
+        symbols = self._defined_symbols(kind, conjunct)
+        if symbols is None:
+            return set([])
+        return set([TS.get_ref_var(symbol) for symbol in symbols])
+
+    def _multiply_defined(self, conjuncts):
+        """Returns the variables with more than one definition in the same frame,
+        except for a pair of complementary guarded definitions. The definitions in
+        init and trans are in different frames, while the ones in invar hold in all
+        of them"""
+
+        definitions = {}
+        for (ts, kind, conjunct, outputs) in conjuncts:
+            for var in outputs:
+                definitions.setdefault(var, ([], [], []))[kind].append((conjunct, outputs))
+
+        multiple = set([])
+        for (var, (init, trans, invar)) in definitions.items():
+            if (len(invar) > 0) and (len(init) + len(trans) + len(invar) > 1):
+                multiple.add(var)
+                continue
+            for frame in [init, trans]:
+                if len(frame) == 2:
+                    ((conjunct1, outputs1), (conjunct2, outputs2)) = frame
+                    if (outputs1 == outputs2) and self._complementary(conjunct1, conjunct2):
+                        continue
+                if len(frame) > 1:
+                    multiple.add(var)
+
+        return multiple
+
+    def _cyclically_defined(self, conjuncts):
+        """Returns the variables whose definitions depend on themselves in the same
+        frame. A definition in trans depends on the next values in its support,
+        while one in init or invar on all of its support"""
+
+        dependencies = {}
+        for (ts, kind, conjunct, outputs) in conjuncts:
+            if len(outputs) == 0:
+                continue
+            fvars = get_free_variables(conjunct)
+            if kind == TRANS:
+                fvars = [v for v in fvars if TS.is_prime(v)]
+            support = set([TS.get_ref_var(v) for v in fvars])
+            for var in outputs:
+                dependencies.setdefault(var, set([])).update(support - set([var]))
+
+        # Tarjan's strongly connected components, iteratively
+        cyclic = set([])
+        indexes = {}
+        lowlinks = {}
+        stack = []
+        on_stack = set([])
+        for root in dependencies:
+            if root in indexes:
+                continue
+            to_visit = [(root, iter(dependencies[root]))]
+            indexes[root] = lowlinks[root] = len(indexes)
+            stack.append(root)
+            on_stack.add(root)
+            while len(to_visit) > 0:
+                (var, successors) = to_visit[-1]
+                descended = False
+                for succ in successors:
+                    if succ not in dependencies:
+                        continue
+                    if succ not in indexes:
+                        indexes[succ] = lowlinks[succ] = len(indexes)
+                        stack.append(succ)
+                        on_stack.add(succ)
+                        to_visit.append((succ, iter(dependencies[succ])))
+                        descended = True
+                        break
+                    if succ in on_stack:
+                        lowlinks[var] = min(lowlinks[var], indexes[succ])
+                if descended:
+                    continue
+
+                to_visit.pop()
+                if len(to_visit) > 0:
+                    parent = to_visit[-1][0]
+                    lowlinks[parent] = min(lowlinks[parent], lowlinks[var])
+
+                if lowlinks[var] == indexes[var]:
+                    component = []
+                    while True:
+                        member = stack.pop()
+                        on_stack.discard(member)
+                        component.append(member)
+                        if member == var:
+                            break
+                    if len(component) > 1:
+                        cyclic.update(component)
+
+        return cyclic
+
+    def _add_conjunct(self, ts, kind, conjunct, outputs):
+        fvars = get_free_variables(conjunct)
+        support = set([TS.get_ref_var(v) for v in fvars])
+
+        index = len(self.conjuncts)
+        self.conjuncts.append((ts, kind, conjunct, outputs, support))
+
+        if len(outputs) > 0:
+            for var in outputs:
+                self.definitions.setdefault(var, []).append(index)
+        else:
+            for var in support:
+                self.constraints.setdefault(var, []).append(index)
+
+    def _dependencies(self, var):
+        return set([v for index in self.definitions.get(var, []) for v in self.conjuncts[index][4]])
+
+    def _closure(self, index):
+        """Returns the variables that the conjunct depends on, through the definitions"""
+
+        if index not in self.closures:
+            visited = set([])
+            to_visit = list(self.conjuncts[index][4])
+            while len(to_visit) > 0:
+                var = to_visit.pop()
+                if var in visited:
+                    continue
+                visited.add(var)
+                to_visit += list(self._dependencies(var))
+            self.closures[index] = frozenset(visited)
+
+        return self.closures[index]
+
+    def cone(self, variables):
+        """Returns the variables and the indexes of the conjuncts in the cone"""
+
+        cone_vars = set([])
+        kept = set([])
+        to_visit = list(variables)
+
+        pending = set([index for indexes in self.constraints.values() for index in indexes])
+
+        while True:
+            while len(to_visit) > 0:
+                var = to_visit.pop()
+                if var in cone_vars:
+                    continue
+                cone_vars.add(var)
+
+                for index in self.definitions.get(var, []) + self.constraints.get(var, []):
+                    if index not in kept:
+                        kept.add(index)
+                        pending.discard(index)
+                        to_visit += list(self.conjuncts[index][4])
+
+            # Constraints on the removed variables can restrict the inputs of the cone
+            affecting = [index for index in pending if not self._closure(index).isdisjoint(cone_vars)]
+            if len(affecting) == 0:
+                break
+
+            for index in affecting:
+                kept.add(index)
+                pending.discard(index)
+                to_visit += list(self.conjuncts[index][4])
+
+        return (cone_vars, kept)
+
+    def reduce(self, hts, formulae):
+        """Returns the HTS restricted to the cone of formulae, assumptions and lemmas"""
+
+        assumptions = list(hts.assumptions) if hts.assumptions is not None else []
+        lemmas = list(hts.lemmas) if hts.lemmas is not None else []
+
+        variables = set([])
+        for formula in list(formulae) + assumptions + lemmas:
+            variables.update([TS.get_ref_var(v) for v in get_free_variables(formula)])
+
+        key = (frozenset(variables), frozenset(assumptions), frozenset(lemmas))
+        if key in self.cones:
+            Logger.log("Cone of influence cached", 1)
+            return self.cones[key]
+
+        (cone_vars, kept) = self.cone(variables)
+
+        reduced = HTS(hts.name)
+        for ts in hts.tss:
+            conjuncts = [[], [], []]
+            for index in sorted(kept):
+                (c_ts, kind, conjunct, _, _) = self.conjuncts[index]
+                if c_ts == ts:
+                    conjuncts[kind].append(conjunct)
+
+            ts_vars = ts.vars & cone_vars
+            if (len(ts_vars) == 0) and (sum([len(c) for c in conjuncts]) == 0):
+                continue
+
+            c_ts = TS(ts.comment)
+            c_ts.logic = ts.logic
+            c_ts.vars = ts_vars
+            c_ts.state_vars = ts.state_vars & cone_vars
+            c_ts.input_vars = ts.input_vars & cone_vars
+            c_ts.output_vars = ts.output_vars & cone_vars
+            c_ts.set_behavior(And(conjuncts[INIT]) if conjuncts[INIT] else TRUE(), \
+                              And(conjuncts[TRANS]) if conjuncts[TRANS] else TRUE(), \
+                              And(conjuncts[INVAR]) if conjuncts[INVAR] else TRUE())
+            reduced.add_ts(c_ts)
+
+        # Variables that are not declared by any TS (e.g., only in the property)
+        for var in (hts.vars & cone_vars) - reduced.vars:
+            reduced.vars.add(var)
+        reduced.input_vars.update(hts.input_vars & cone_vars)
+        reduced.output_vars.update(hts.output_vars & cone_vars)
+        reduced.state_vars.update(hts.state_vars & cone_vars)
+
+        for assumption in assumptions:
+            reduced.add_assumption(assumption)
+        for lemma in lemmas:
+            reduced.add_lemma(lemma)
+        reduced.definitions = hts.definitions
+
+        Logger.log("Cone of influence: %s/%s variables, %s/%s constraints"%(len(reduced.vars), len(hts.vars), \
+                                                                          len(kept), len(self.conjuncts)), 1)
+
+        self.cones[key] = reduced
+        return reduced
@@ -9,6 +9,7 @@
 # limitations under the License.
 
 import os
+import time
 
 from cosa.problem import VerificationType
 from cosa.encoders.formulae import StringParser
@@ -25,6 +26,7 @@ from cosa.encoders.symbolic_transition_system import SymbolicTSParser, SymbolicS
 from cosa.encoders.btor2 import BTOR2Parser
 from cosa.encoders.ltl import ltl_reset_env, LTLParser
 from cosa.encoders.monitors import MonitorsFactory
+from cosa.utils.parallel import ProcessPool, TaskStatus
 
 FLAG_SR = "["
 FLAG_ST = "]"
@@ -34,16 +36,74 @@ MODEL_SP = ","
 
 class ProblemSolver(object):
     parser = None
+    model_cache = None
+    result_cache = None
+    model_files = None
+    model_hash = None
 
     def __init__(self):
-        pass
+        self.model_cache = None
+        self.result_cache = None
+        self.model_files = []
+        self.model_hash = None
+
+    def mc_config_options(self, mc_config):
+        return [mc_config.strategy, \
+                mc_config.portfolio, \
+                mc_config.solver_name, \
+                mc_config.incremental, \
+                mc_config.prove, \
+                mc_config.parallel_prove, \
+                mc_config.cube_split, \
+                mc_config.liveness_to_safety, \
+                mc_config.coi, \
+                mc_config.sweep, \
+                mc_config.functional, \
+                mc_config.random_sim, \
+                mc_config.mine_invariants, \
+                mc_config.full_trace, \
+                mc_config.trace_vars_change, \
+                mc_config.trace_all_vars, \
+                mc_config.vcd_trace]
+
+    def result_key(self, problem, mc_config, prop, assumps, lemmas, bmc_length_min):
+        serialize = lambda formulae: sorted([f.serialize() for f in formulae]) if formulae is not None else None
+        
+        return self.result_cache.key([self.model_hash, \
+                                      problem.verification, \
+                                      problem.symbolic_init, \
+                                      problem.monitors, \
+                                      prop.serialize(), \
+                                      serialize(assumps), \
+                                      serialize(lemmas), \
+                                      bmc_length_min] + \
+                                     self.mc_config_options(mc_config))
+
+    def load_definitions(self, problem, mc_config):
+        parsing_defs = [mc_config.properties, mc_config.lemmas, mc_config.assumptions]
+        for i in range(len(parsing_defs)):
+            if parsing_defs[i] is not None:
+                pdef_file = problem.relative_path+parsing_defs[i]
+                if os.path.isfile(pdef_file):
+                    with open(pdef_file) as f:
+                        parsing_defs[i] = [p.strip() for p in f.read().strip().split("\n")]
+                else:
+                    parsing_defs[i] = [p.strip() for p in parsing_defs[i].split(MODEL_SP)]
+            else:
+                parsing_defs[i] = None
+
+        [mc_config.properties, mc_config.lemmas, mc_config.assumptions] = parsing_defs
 
     def solve_problem(self, problem, config):
         Logger.log("\n*** Analyzing problem \"%s\" ***"%(problem), 1)
         Logger.msg("Solving \"%s\" "%problem.name, 0, not(Logger.level(1)))
         
         sparser = StringParser()
+        sparser.remap_or2an = self.parser.remap_or2an
         lparser = LTLParser()
+        lparser.remap_or2an = self.parser.remap_or2an
+
+        start_time = time.time()
 
         mc_config = self.problem2mc_config(problem, config)
         bmc_safety = BMCSafety(problem.hts, mc_config)
@@ -52,22 +112,12 @@ class ProblemSolver(object):
         bmc_length = max(problem.bmc_length, config.bmc_length)
         bmc_length_min = max(problem.bmc_length_min, config.bmc_length_min)
 
-        parsing_defs = [mc_config.properties, mc_config.lemmas, mc_config.assumptions]
-        for i in range(len(parsing_defs)):
-            if parsing_defs[i] is not None:
-                pdef_file = problem.relative_path+parsing_defs[i]
-                if os.path.isfile(pdef_file):
-                    with open(pdef_file) as f:
-                        parsing_defs[i] = [p.strip() for p in f.read().strip().split("\n")]
-                else:
-                    parsing_defs[i] = [p.strip() for p in parsing_defs[i].split(MODEL_SP)]
-            else:
-                parsing_defs[i] = None
-
-        [mc_config.properties, mc_config.lemmas, mc_config.assumptions] = parsing_defs
+        self.load_definitions(problem, mc_config)
 
         assumps = None
         lemmas = None
+        # The lemmas of the problem are removed from the shared system at the end
+        hts_lemmas = set(problem.hts.lemmas) if problem.hts.lemmas is not None else None
 
         accepted_ver = False
 
@@ -101,13 +151,45 @@ class ProblemSolver(object):
             else:
                 (strprop, prop, types) = lparser.parse_formulae(mc_config.properties)[0]
 
-        if problem.verification == VerificationType.SAFETY:
+        result_key = None
+        cached = None
+        if (self.result_cache is not None) and (problem.verification in [VerificationType.SAFETY, VerificationType.LTL]):
+            result_key = self.result_key(problem, mc_config, prop, assumps, lemmas, bmc_length_min)
+            cached = self.result_cache.load(result_key)
+
+        if cached is not None:
+            (c_res, c_depth, c_trace, _) = cached
+            if (c_res == VerificationStatus.TRUE) or \
+               ((c_res == VerificationStatus.FALSE) and (c_depth <= bmc_length)) or \
+               ((c_res == VerificationStatus.UNK) and (c_depth >= bmc_length)):
+                Logger.log("Using cached result", 1)
+                accepted_ver = True
+                problem.cached = True
+                (res, trace, t) = (c_res, c_trace, c_depth)
+            elif (c_res == VerificationStatus.UNK) and (problem.verification == VerificationType.SAFETY):
+                Logger.log("No counterexample up to k=%s (cached)"%c_depth, 1)
+                bmc_length_min = max(bmc_length_min, c_depth+1)
+
+        if (problem.verification == VerificationType.SAFETY) and (not problem.cached):
+            accepted_ver = True
+            res, trace, t = bmc_safety.safety(prop, bmc_length, bmc_length_min)
+            problem.engine = bmc_safety.engine
+            if bmc_safety.invariant is not None:
+                problem.invariant = [lemma.serialize() for lemma in bmc_safety.invariant]
+
+        if (problem.verification == VerificationType.LTL) and (not problem.cached):
+            accepted_ver = True
+            res, trace, t = bmc_ltl.ltl(prop, bmc_length, bmc_length_min)
+
+        if problem.verification == VerificationType.LIVENESS:
             accepted_ver = True
-            res, trace, _ = bmc_safety.safety(prop, bmc_length, bmc_length_min)
+            res, trace, t = bmc_ltl.liveness(prop, bmc_length, bmc_length_min)
+            problem.engine = bmc_ltl.engine
 
-        if problem.verification == VerificationType.LTL:
+        if problem.verification == VerificationType.EVENTUALLY:
             accepted_ver = True
-            res, trace, _ = bmc_ltl.ltl(prop, bmc_length, bmc_length_min)
+            res, trace, t = bmc_ltl.eventually(prop, bmc_length, bmc_length_min)
+            problem.engine = bmc_ltl.engine
 
         if problem.verification == VerificationType.SIMULATION:
             accepted_ver = True
@@ -146,6 +228,7 @@ class ProblemSolver(object):
 
             bmcseq = BMCSafety(htseq, mc_config)
             res, trace, t = bmcseq.safety(miter_out, bmc_length, bmc_length_min)
+            problem.engine = bmcseq.engine
 
         if not accepted_ver:
             Logger.error("Invalid verification type")
@@ -153,11 +236,130 @@ class ProblemSolver(object):
         problem.status = res
         problem.trace = trace
 
+        if (result_key is not None) and (not problem.cached):
+            # Conclusive results and deeper unknown results are more informative
+            if (cached is None) or (res != VerificationStatus.UNK) or \
+               ((cached[0] == VerificationStatus.UNK) and (cached[1] < bmc_length)):
+                depth = bmc_length if res == VerificationStatus.UNK else t
+                self.result_cache.store(result_key, res, depth, trace, time.time()-start_time)
+
         if problem.assumptions is not None:
             problem.hts.assumptions = None
+        if problem.lemmas is not None:
+            problem.hts.lemmas = hts_lemmas
 
         Logger.log("\n*** Problem \"%s\" is %s ***"%(problem, res), 1)
 
+    def solve_problems_multi(self, problems, config):
+        """Solves a group of safety problems, on the same system and with the
+        same options, on a single unrolling"""
+
+        names = ", ".join(["\"%s\""%problem for problem in problems])
+        Logger.log("\n*** Analyzing problems %s ***"%(names), 1)
+        Logger.msg("Solving %s "%names, 0, not(Logger.level(1)))
+
+        sparser = StringParser()
+        sparser.remap_or2an = self.parser.remap_or2an
+
+        start_time = time.time()
+
+        problem = problems[0]
+        mc_config = self.problem2mc_config(problem, config)
+        self.load_definitions(problem, mc_config)
+        bmc_length = max(problem.bmc_length, config.bmc_length)
+        bmc_length_min = max(problem.bmc_length_min, config.bmc_length_min)
+
+        assumps = [t[1] for t in sparser.parse_formulae(mc_config.assumptions)]
+        lemmas = []
+        for ass in assumps:
+            problem.hts.add_assumption(ass)
+
+        times = {}
+        unsolved = []
+        for problem in problems:
+            p_config = self.problem2mc_config(problem, config)
+            self.load_definitions(problem, p_config)
+            prop = sparser.parse_formulae(p_config.properties)[0][1]
+
+            result_key = None
+            if self.result_cache is not None:
+                result_key = self.result_key(problem, p_config, prop, assumps, lemmas, bmc_length_min)
+                cached = self.result_cache.load(result_key)
+                if cached is not None:
+                    (c_res, c_depth, c_trace, _) = cached
+                    if (c_res == VerificationStatus.TRUE) or \
+                       ((c_res == VerificationStatus.FALSE) and (c_depth <= bmc_length)) or \
+                       ((c_res == VerificationStatus.UNK) and (c_depth >= bmc_length)):
+                        Logger.log("Using cached result for \"%s\""%problem, 1)
+                        problem.cached = True
+                        (problem.status, problem.trace) = (c_res, c_trace)
+                        times[problem.name] = time.time()-start_time
+                        continue
+
+            unsolved.append((problem, prop, result_key))
+
+        if len(unsolved) > 0:
+            bmc_safety = BMCSafety(problems[0].hts, mc_config)
+            solve_time = time.time()-start_time
+            results = bmc_safety.safety_multi([prop for (_, prop, _) in unsolved], bmc_length, bmc_length_min)
+
+            for ((problem, prop, result_key), (res, trace, t), verdict_time) in zip(unsolved, results, bmc_safety.verdict_times):
+                problem.status = res
+                problem.trace = trace
+                times[problem.name] = solve_time + verdict_time
+                if result_key is not None:
+                    depth = bmc_length if res == VerificationStatus.UNK else t
+                    self.result_cache.store(result_key, res, depth, trace, times[problem.name])
+
+        if problems[0].assumptions is not None:
+            problems[0].hts.assumptions = None
+
+        for problem in problems:
+            Logger.log("\n*** Problem \"%s\" is %s ***"%(problem, problem.status), 1)
+
+        return [times[problem.name] for problem in problems]
+
+    def multi_property_groups(self, problems, config):
+        """Groups the safety problems that can share the unrolling, i.e., on the
+        same system with the same options, assumptions and bounds, and without
+        monitors and lemmas"""
+
+        groups = []
+        keys = {}
+        for problem in problems:
+            mc_config = self.problem2mc_config(problem, config)
+            if (problem.verification != VerificationType.SAFETY) or \
+               (problem.monitors is not None) or (problem.lemmas is not None):
+                groups.append([problem])
+                continue
+
+            key = tuple([id(problem.hts), \
+                         problem.relative_path, \
+                         problem.assumptions, \
+                         max(problem.bmc_length, config.bmc_length), \
+                         max(problem.bmc_length_min, config.bmc_length_min), \
+                         mc_config.smt2file, \
+                         mc_config.skip_solving, \
+                         problem.trace_prefix] + \
+                        self.mc_config_options(mc_config))
+
+            if key not in keys:
+                keys[key] = len(groups)
+                groups.append([])
+            groups[keys[key]].append(problem)
+
+        return groups
+
+    def solve_group(self, group, config):
+        """Solves a group of problems, and returns the solving time of each of them"""
+
+        if len(group) > 1:
+            return self.solve_problems_multi(group, config)
+
+        start_time = time.time()
+        self.solve_problem(group[0], config)
+        return [time.time()-start_time]
+
     def get_file_flags(self, strfile):
         if FLAG_SR not in strfile:
             return (strfile, None)
@@ -190,6 +392,27 @@ class ProblemSolver(object):
                 strfile = relative_path+strfile
             parser = None
 
+            if os.path.isfile(strfile):
+                self.model_files.append((strfile, flags))
+
+            model_key = None
+            if self.model_cache is not None:
+                options = [filetype, abstract_clock, symbolic_init, deterministic, boolean, no_clock, run_passes]
+                model_key = self.model_cache.key(strfile, flags, options)
+                cached = self.model_cache.load(model_key)
+                if cached is not None:
+                    Logger.msg("Parsing file \"%s\"... "%(strfile), 0)
+                    ((hts_a, inv_a, ltl_a), parser) = cached
+                    if (filetype in CoreIRParser.get_extensions()) or (not self.parser):
+                        self.parser = parser
+                    hts.combine(hts_a)
+
+                    invar_props += inv_a
+                    ltl_props += ltl_a
+
+                    Logger.log("DONE (cached)", 0)
+                    continue
+
             if filetype in CoreIRParser.get_extensions():
                 parser = CoreIRParser(abstract_clock, symbolic_init, no_clock, run_passes)
                 parser.boolean = boolean
@@ -225,7 +448,10 @@ class ProblemSolver(object):
                     Logger.error("File \"%s\" does not exist"%strfile)
 
                 Logger.msg("Parsing file \"%s\"... "%(strfile), 0)
+                parse_time = time.time()
                 (hts_a, inv_a, ltl_a) = parser.parse_file(strfile, flags)
+                if self.model_cache is not None:
+                    self.model_cache.store(model_key, (hts_a, inv_a, ltl_a), parser, time.time()-parse_time)
                 hts.combine(hts_a)
 
                 invar_props += inv_a
@@ -236,6 +462,9 @@ class ProblemSolver(object):
 
             Logger.error("Filetype \"%s\" unsupported"%filetype)
 
+        if (self.model_cache is not None) and (self.model_cache.hits > 0):
+            Logger.log("Model cache: %s hits, %.2f sec saved"%(self.model_cache.hits, self.model_cache.time_saved), 0)
+
         if Logger.level(1):
             print(hts.print_statistics(name, Logger.level(2)))
 
@@ -268,6 +497,10 @@ class ProblemSolver(object):
         else:
             systems[('hts2', si)] = None
 
+        if self.result_cache is not None:
+            options = [problems.abstract_clock, problems.boolean, problems.no_clock, problems.run_coreir_passes]
+            self.model_hash = self.result_cache.model_hash(self.model_files, options)
+
         for problem in problems.problems:
             problem.hts = systems[('hts', problem.symbolic_init)]
             problem.hts2 = systems[('hts2', problem.symbolic_init)]
@@ -276,18 +509,77 @@ class ProblemSolver(object):
             problem.run_coreir_passes = problems.run_coreir_passes
             problem.relative_path = problems.relative_path
 
-            if config.time or problems.time:
-                timer_solve = Logger.start_timer("Problem %s"%problem.name, False)
+        if config.multi_property or problems.multi_property:
+            groups = self.multi_property_groups(problems.problems, config)
+        else:
+            groups = [[problem] for problem in problems.problems]
+
+        if (config.jobs > 1) or (config.timeout is not None) or (config.memory_limit is not None):
+            self.solve_problems_parallel(problems, groups, config)
+            return
+
+        for group in groups:
             try:
-                self.solve_problem(problem, config)
-                Logger.msg(" %s\n"%problem.status, 0, not(Logger.level(1)))
+                times = self.solve_group(group, config)
+                Logger.msg(" %s\n"%(", ".join([problem.status for problem in group])), 0, not(Logger.level(1)))
                 
                 if config.time or problems.time:
-                    problem.time = Logger.get_timer(timer_solve, False)
+                    for (problem, elapsed) in zip(group, times):
+                        problem.time = elapsed
                 
             except KeyboardInterrupt as e:
                 Logger.msg("\b\b Skipped!\n", 0)
 
+    def _solve_group_worker(self, group, config):
+        # The inline status is printed by the parent process
+        if not Logger.level(1):
+            Logger.verbosity = 0
+
+        times = self.solve_group(group, config)
+        return [(problem.status, problem.trace, problem.engine, problem.cached, problem.invariant, elapsed) \
+                for (problem, elapsed) in zip(group, times)]
+
+    def solve_problems_parallel(self, problems, groups, config):
+        """Solves each group of problems in a forked worker process.
+
+        The workers inherit the parsed systems (and a private copy of the
+        pysmt environment) from the parent, hence the models are parsed
+        only once.
+        """
+
+        memory = None
+        if config.memory_limit is not None:
+            memory = config.memory_limit*(1<<20)
+
+        pool = ProcessPool(config.jobs)
+        groups_dict = {}
+        for group in groups:
+            groups_dict[group[0].name] = group
+            pool.submit(group[0].name, self._solve_group_worker, (group, config), config.timeout, memory)
+
+        try:
+            for (name, status, results, elapsed) in pool.results():
+                for (index, problem) in enumerate(groups_dict[name]):
+                    if status == TaskStatus.OK:
+                        (problem.status, problem.trace, problem.engine, problem.cached, problem.invariant, problem_time) = results[index]
+                    else:
+                        problem_time = elapsed
+                        problem.status = VerificationStatus.UNK
+                        if status == TaskStatus.ERROR:
+                            Logger.warning("Problem \"%s\" failed:\n%s"%(problem.name, results))
+
+                    if config.time or problems.time:
+                        problem.time = problem_time
+
+                    outcome = problem.status if status == TaskStatus.OK else "%s (%s)"%(problem.status, status)
+                    Logger.msg("Solving \"%s\" %s\n"%(problem.name, outcome), 0, not(Logger.level(1)))
+                    Logger.log("\n*** Problem \"%s\" is %s ***"%(problem.name, outcome), 1)
+
+        except KeyboardInterrupt as e:
+            Logger.msg("\b\b Skipped!\n", 0)
+        finally:
+            pool.terminate()
+
     def problem2mc_config(self, problem, config):
         mc_config = MCConfig()
 
@@ -305,6 +597,15 @@ class ProblemSolver(object):
         mc_config.solver_name = config_selection(problem.solver_name, config.solver_name)
         mc_config.vcd_trace = problem.vcd or config.vcd
         mc_config.prove = config_selection(problem.prove, config.prove)
+        mc_config.parallel_prove = config_selection(problem.parallel_prove, config.parallel_prove)
+        mc_config.cube_split = config_selection(problem.cube_split, config.cube_split)
+        mc_config.portfolio = config_selection(problem.portfolio, config.portfolio)
+        mc_config.liveness_to_safety = config_selection(problem.liveness_to_safety, config.liveness_to_safety)
+        mc_config.coi = config_selection(problem.coi, config.coi)
+        mc_config.sweep = config_selection(problem.sweep, config.sweep)
+        mc_config.functional = config_selection(problem.functional, config.functional)
+        mc_config.random_sim = config_selection(problem.random_sim, config.random_sim)
+        mc_config.mine_invariants = config_selection(problem.mine_invariants, config.mine_invariants)
         mc_config.properties = problem.formula
         mc_config.assumptions = problem.assumptions
         mc_config.lemmas = problem.lemmas
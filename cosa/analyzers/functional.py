@@ -0,0 +1,195 @@
+# Copyright 2018 Cristian Mattarei
+#
+# Licensed under the modified BSD (3-clause BSD) License.
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from pysmt.shortcuts import And, TRUE
+
+from cosa.utils.logger import Logger
+from cosa.utils.formula_mngm import get_free_variables
+from cosa.representation import TS, HTS
+
+INIT = 0
+TRANS = 1
+INVAR = 2
+
+class FunctionalForm(object):
+    """Functional form of an HTS.
+
+    The combinational signals (i.e., defined by w = f(...) in invar) are
+    replaced by their definition, expanded over the inputs and state
+    variables. Hence, the unrolling only creates fresh symbols for the
+    inputs and the state variables. The transition relation is kept
+    relational (s' = g(...) in trans), with the combinational signals
+    substituted in g.
+
+    The values of the eliminated signals are recovered from the
+    definitions, and the signals in the support of the properties,
+    assumptions and lemmas are kept.
+    """
+
+    tss = None
+    conjuncts = None
+    definitions = None
+    order = None
+    reduced = None
+
+    def __init__(self, hts):
+        self.tss = frozenset(hts.tss)
+        self.conjuncts = []
+        self.definitions = {}
+        self.reduced = {}
+
+        for ts in hts.tss:
+            for (kind, formula) in [(INIT, ts.init), (TRANS, ts.trans), (INVAR, ts.invar)]:
+                if formula is not None:
+                    for conjunct in self._split(formula):
+                        self.conjuncts.append((ts, kind, conjunct))
+
+        free_vars = hts.input_vars | hts.state_vars
+        for (index, (ts, kind, conjunct)) in enumerate(self.conjuncts):
+            definition = self._definition(kind, conjunct, free_vars)
+            if (definition is not None) and (definition[0] not in self.definitions):
+                self.definitions[definition[0]] = (definition[1], index)
+
+        self.order = self._topological_order()
+
+    @staticmethod
+    def get(hts):
+        """Returns the functional form of hts, which is kept until its TSs change"""
+
+        if (hts.functional is None) or (hts.functional.tss != frozenset(hts.tss)):
+            hts.functional = FunctionalForm(hts)
+        return hts.functional
+
+    def _split(self, formula):
+        conjuncts = []
+        to_visit = [formula]
+        while len(to_visit) > 0:
+            formula = to_visit.pop()
+            if formula.is_and():
+                to_visit += list(formula.args())
+            elif not formula.is_true():
+                conjuncts.append(formula)
+        return conjuncts
+
+    def _definition(self, kind, conjunct, free_vars):
+        if (kind != INVAR) or not (conjunct.is_equals() or conjunct.is_iff()):
+            return None
+
+        for (lhs, rhs) in [conjunct.args(), reversed(conjunct.args())]:
+            if (not lhs.is_symbol()) or (lhs in free_vars) or TS.is_prime(lhs) or TS.is_prev(lhs):
+                continue
+            fvars = get_free_variables(rhs)
+            if (lhs not in fvars) and (len([v for v in fvars if TS.is_prime(v) or TS.is_prev(v)]) == 0):
+                return (lhs, rhs)
+
+        return None
+
+    def _topological_order(self):
+        """Returns the defined signals in dependency order, dropping the cyclic definitions"""
+
+        order = []
+        status = {}
+        for root in sorted(self.definitions, key=lambda v: v.symbol_name()):
+            to_visit = [(root, False)]
+            while len(to_visit) > 0:
+                (var, expanded) = to_visit.pop()
+                if expanded:
+                    status[var] = True
+                    order.append(var)
+                    continue
+                if var in status:
+                    continue
+                status[var] = False
+                to_visit.append((var, True))
+                for dep in get_free_variables(self.definitions[var][0]):
+                    if dep not in self.definitions:
+                        continue
+                    if status.get(dep, None) == False:
+                        # Combinational loop, the definition is kept as a constraint
+                        Logger.log("Cyclic definition of \"%s\""%dep, 2)
+                        del(self.definitions[dep])
+                    elif dep not in status:
+                        to_visit.append((dep, False))
+
+        return [var for var in order if var in self.definitions]
+
+    def _expansions(self, eliminated):
+        """Returns the substitution of the eliminated signals, in the current, next and previous frames"""
+
+        subs = {}
+        for (rename, symbol) in [(lambda f: f, lambda v: v), \
+                                 (TS.to_next, TS.get_prime), \
+                                 (TS.to_prev, TS.get_prev)]:
+            expansions = {}
+            for var in self.order:
+                if var in eliminated:
+                    expansions[symbol(var)] = rename(self.definitions[var][0]).substitute(expansions)
+            subs.update(expansions)
+
+        return subs
+
+    def reduce(self, hts, formulae):
+        """Returns the HTS where the signals not in the support of formulae are eliminated"""
+
+        assumptions = list(hts.assumptions) if hts.assumptions is not None else []
+        lemmas = list(hts.lemmas) if hts.lemmas is not None else []
+
+        observed = set([])
+        for formula in list(formulae) + assumptions + lemmas:
+            observed.update([TS.get_ref_var(v) for v in get_free_variables(formula)])
+
+        eliminated = frozenset([var for var in self.definitions if var not in observed])
+
+        key = (eliminated, frozenset(assumptions), frozenset(lemmas))
+        if key in self.reduced:
+            Logger.log("Functional form cached", 1)
+            return self.reduced[key]
+
+        subs = self._expansions(eliminated)
+        removed = set([self.definitions[var][1] for var in eliminated])
+
+        reduced = HTS(hts.name)
+        for ts in hts.tss:
+            conjuncts = [[], [], []]
+            for (index, (c_ts, kind, conjunct)) in enumerate(self.conjuncts):
+                if (c_ts == ts) and (index not in removed):
+                    conjuncts[kind].append(conjunct.substitute(subs))
+
+            f_ts = TS(ts.comment)
+            f_ts.logic = ts.logic
+            f_ts.vars = ts.vars - eliminated
+            f_ts.state_vars = set(ts.state_vars)
+            f_ts.input_vars = set(ts.input_vars)
+            f_ts.output_vars = ts.output_vars - eliminated
+            f_ts.set_behavior(And(conjuncts[INIT]) if conjuncts[INIT] else TRUE(), \
+                              And(conjuncts[TRANS]) if conjuncts[TRANS] else TRUE(), \
+                              And(conjuncts[INVAR]) if conjuncts[INVAR] else TRUE())
+            reduced.add_ts(f_ts)
+
+        reduced.vars.update(hts.vars - eliminated)
+        reduced.input_vars.update(hts.input_vars)
+        # The eliminated outputs are recovered in the traces
+        reduced.output_vars.update(hts.output_vars)
+        reduced.state_vars.update(hts.state_vars)
+
+        for assumption in assumptions:
+            reduced.add_assumption(assumption)
+        for lemma in lemmas:
+            reduced.add_lemma(lemma)
+
+        reduced.definitions = dict([(var, term.substitute(subs)) for (var, term) in hts.definitions.items()]) \
+                              if hts.definitions is not None else {}
+        reduced.definitions.update([(var, subs[var]) for var in eliminated])
+
+        Logger.log("Functional form: %s/%s variables, %s signals eliminated"% \
+                   (len(reduced.vars), len(hts.vars), len(eliminated)), 1)
+
+        self.reduced[key] = reduced
+        return reduced
@@ -8,17 +8,43 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import gzip
+import copy
+import math
+import atexit
+import weakref
+import multiprocessing
+
 from six.moves import cStringIO
 
-from pysmt.shortcuts import BV, And, Or, Solver, TRUE, FALSE, Not, EqualsOrIff, Implies, Iff, Symbol, BOOL, simplify, BVAdd, BVUGE
+from pysmt.shortcuts import BV, And, Or, Solver, TRUE, FALSE, Not, EqualsOrIff, Implies, Iff, Symbol, BOOL, simplify, BVAdd, BVUGE, BVExtract
 from pysmt.rewritings import conjunctive_partition
-from pysmt.smtlib.printers import SmtPrinter, SmtDagPrinter
+from pysmt.smtlib.printers import SmtPrinter, SmtDagPrinter, quote
 from pysmt.logics import QF_ABV
 
 from cosa.utils.logger import Logger
-from cosa.representation import TS, HTS
+from cosa.representation import TS, HTS, TIMED, PTIMED
 from cosa.utils.formula_mngm import substitute, get_free_variables
-from cosa.printers import TextTracePrinter, VCDTracePrinter
+from cosa.printers import TextTracePrinter, VCDTracePrinter, HIDDEN
+from cosa.analyzers.unroller import Unroller
+from cosa.analyzers.coi import ConeOfInfluence
+from cosa.analyzers.sweeping import Sweeper
+from cosa.analyzers.functional import FunctionalForm
+from cosa.analyzers.simulator import RandomSimulator, UnsupportedFormula, NUMPY, BATCH
+from cosa.analyzers.miner import InvariantMiner, BMC_SAMPLES
+from cosa.utils.parallel import ProcessPool, TaskStatus
+
+MAX_CUBE_BITS = 4
+LOOKAHEAD_CANDIDATES = 32
+
+# Writers with an open stream, flushed and closed once at exit
+open_traces = weakref.WeakSet()
+
+def close_open_traces():
+    for trace in list(open_traces):
+        trace.close()
+
+atexit.register(close_open_traces)
 
 
 class VerificationStrategy(object):
@@ -27,6 +53,7 @@ class VerificationStrategy(object):
     ZZ  = "ZZ"
     NU  = "NU"
     INT  = "INT"
+    PDR  = "PDR"
     LTL  = "LTL"
     AUTO = "AUTO"
     ALL = "ALL"
@@ -46,6 +73,15 @@ class MCConfig(object):
     full_trace = False
     trace_vars_change = False
     trace_all_vars = False
+    portfolio = None
+    liveness_to_safety = False
+    coi = False
+    sweep = False
+    functional = False
+    random_sim = 0
+    mine_invariants = None
+    parallel_prove = False
+    cube_split = 0
 
     def __init__(self):
         self.incremental = True
@@ -60,6 +96,15 @@ class MCConfig(object):
         self.full_trace = False
         self.trace_vars_change = False
         self.trace_all_vars = False
+        self.portfolio = None
+        self.liveness_to_safety = False
+        self.coi = False
+        self.sweep = False
+        self.functional = False
+        self.random_sim = 0
+        self.mine_invariants = None
+        self.parallel_prove = False
+        self.cube_split = 0
 
         self.strategies = MCConfig.get_strategies()
 
@@ -70,42 +115,265 @@ class MCConfig(object):
         strategies.append((VerificationStrategy.FWD,  "Forward reachability"))
         strategies.append((VerificationStrategy.BWD,  "Backward reachability"))
         strategies.append((VerificationStrategy.ZZ,   "Mixed Forward and Backward reachability (Zig-Zag)"))
-        strategies.append((VerificationStrategy.INT,  "Interpolation (not incremental only)"))
+        strategies.append((VerificationStrategy.INT,  "Interpolation"))
+        strategies.append((VerificationStrategy.PDR,  "Property Directed Reachability (IC3)"))
         strategies.append((VerificationStrategy.NU,   "States picking without unrolling (only for simulation)"))
         strategies.append((VerificationStrategy.LTL,  "Pure LTL verification (without optimizations)"))
-        strategies.append((VerificationStrategy.ALL,  "Use all techniques"))
+        strategies.append((VerificationStrategy.ALL,  "Use all techniques (in parallel for safety)"))
 
         return strategies
 
+class SmtDefinePrinter(SmtDagPrinter):
+    """DAG printer shared by the assertions of a trace.
+
+    Each subterm is printed once as a define-fun, and referred by name in
+    the following assertions. The definitions are scoped by push/pop.
+    """
+
+    LET = "(let (("
+    TEMPLATE = "__def_%d"
+
+    buffer = None
+    segments = None
+    defined_inc = None
+
+    def __init__(self):
+        self.buffer = cStringIO()
+        SmtDagPrinter.__init__(self, self.buffer, template=self.TEMPLATE)
+        self.invalidate_memoization = False
+        self.names = set([])
+        self.segments = []
+        self.defined_inc = []
+
+    def _new_symbol(self):
+        # Each let binding is written right after the creation of its name
+        self._end_segment()
+        sym = SmtDagPrinter._new_symbol(self)
+        self.segments.append([sym, None])
+        return sym
+
+    def _end_segment(self):
+        if (len(self.segments) == 0) or (self.segments[-1][1] is not None):
+            return
+        sym = self.segments[-1][0]
+        segment = self.buffer.getvalue()
+        self.buffer.seek(0)
+        self.buffer.truncate()
+        # "(let ((sym body)) " -> "body"
+        self.segments[-1][1] = segment[len(self.LET)+len(sym)+1:-len(")) ")]
+
+    def define(self, formula):
+        self.names.update([quote(v.symbol_name()) for v in formula.get_free_variables()])
+        self.segments = []
+        term = self.walk(formula)
+        self._end_segment()
+
+        new_syms = set([sym for (sym, body) in self.segments])
+        defined = dict([(sym, f) for (f, sym) in self.memoization.items() if sym in new_syms])
+
+        if len(self.defined_inc) > 0:
+            self.defined_inc[-1].update(defined.values())
+
+        definitions = []
+        for (sym, body) in self.segments:
+            definitions.append("(define-fun %s %s %s)"%(sym, defined[sym].get_type().as_smtlib(), body))
+
+        return (definitions, term)
+
+    def push(self):
+        self.defined_inc.append(set([]))
+
+    def pop(self):
+        for formula in self.defined_inc.pop():
+            del(self.memoization[formula])
+
+class SMT2TraceWriter(object):
+    """Buffered SMT-LIB2 trace writer.
+
+    The file is kept open, optionally gzip compressed, the subterms are
+    shared across the assertions as define-fun, and the declarations are
+    tracked incrementally (and scoped by push/pop).
+    """
+
+    filename = None
+    compress = False
+    stream = None
+    declared = None
+    declared_inc = None
+    printer = None
+
+    BUFFER_SIZE = 1 << 20
+
+    def __init__(self, filename, compress=False):
+        self.filename = filename
+        self.compress = compress
+        self.stream = None
+        self.declared = set([])
+        self.declared_inc = []
+        self.printer = SmtDefinePrinter()
+
+    def _open(self, mode):
+        open_traces.add(self)
+        if self.compress:
+            return gzip.open(self.filename, mode+"t")
+        return open(self.filename, mode, self.BUFFER_SIZE)
+
+    def write(self, line):
+        if self.stream is None:
+            self.stream = self._open("a")
+        self.stream.write(line+"\n")
+
+    def comment(self, line):
+        self.write(";; %s"%line)
+
+    def reset(self, logic):
+        self.close()
+        self.declared = set([])
+        self.declared_inc = []
+        self.printer = SmtDefinePrinter()
+        self.stream = self._open("w")
+        self.write("(set-logic %s)"%logic)
+
+    def declare(self, formula):
+        for v in formula.get_free_variables():
+            if v in self.declared:
+                continue
+
+            vtype = v.symbol_type()
+            if vtype.is_array_type():
+                assert vtype.index_type.is_bv_type(), "Expecting BV indices"
+                assert vtype.elem_type.is_bv_type(), "Expecting BV elements"
+            elif not (vtype.is_bool_type() or vtype.is_bv_type()):
+                Logger.error("Unhandled type in smt2 translation")
+
+            self.write("(declare-fun %s %s)"%(quote(v.symbol_name()), vtype.as_smtlib()))
+            self.declared.add(v)
+
+    def assertion(self, formula):
+        self.declare(formula)
+        self.write("")
+        (definitions, term) = self.printer.define(formula)
+        for definition in definitions:
+            self.write(definition)
+        self.write("(assert %s)"%term)
+
+    def push(self):
+        self.declared_inc.append(set(self.declared))
+        self.printer.push()
+        self.write("(push 1)")
+
+    def pop(self):
+        self.declared = self.declared_inc.pop()
+        self.printer.pop()
+        self.write("(pop 1)")
+
+    def check_sat(self, assumptions=None):
+        if assumptions is None:
+            self.write("(check-sat)")
+        else:
+            literals = []
+            for assumption in assumptions:
+                self.declare(assumption)
+                buf = cStringIO()
+                SmtPrinter(buf).printer(assumption)
+                literals.append(buf.getvalue())
+            self.write("(check-sat-assuming (%s))"%(" ".join(literals)))
+        self.write("")
+        self.flush()
+
+    def flush(self):
+        if self.stream is not None:
+            self.stream.flush()
+
+    def close(self):
+        open_traces.discard(self)
+        if self.stream is not None:
+            self.stream.close()
+            self.stream = None
+
+class PortfolioEngine(object):
+    """Portfolio engine, described as STRATEGY[@solver_name][:time budget]"""
+
+    STRATEGIES = [VerificationStrategy.FWD, VerificationStrategy.BWD, VerificationStrategy.ZZ, \
+                  VerificationStrategy.INT, VerificationStrategy.PDR]
+
+    strategy = None
+    solver_name = None
+    budget = None
+
+    def __init__(self, strategy, solver_name, budget=None):
+        self.strategy = strategy
+        self.solver_name = solver_name
+        self.budget = budget
+
+    @property
+    def name(self):
+        return "%s@%s"%(self.strategy, self.solver_name)
+
+    @staticmethod
+    def parse(strengines, solver_name):
+        engines = []
+        for strengine in strengines.replace(" ","").split(","):
+            if strengine == "":
+                continue
+            budget = None
+            if ":" in strengine:
+                (strengine, budget) = strengine.split(":")
+                budget = float(budget)
+            e_solver_name = solver_name
+            if "@" in strengine:
+                (strengine, e_solver_name) = strengine.split("@")
+            strategy = strengine.upper()
+            if strategy not in PortfolioEngine.STRATEGIES:
+                Logger.error("Strategy \"%s\" not supported by the portfolio (%s)"%(strategy, ", ".join(PortfolioEngine.STRATEGIES)))
+            engines.append(PortfolioEngine(strategy, e_solver_name, budget))
+
+        return engines
+
 class TraceSolver(object):
 
     solver_name = None
     name = None
     basename = None
+    compress = False
     trace_file = None
+    trace = None
     solver = None
-    smt2vars = None
-    smt2vars_inc = None
+    unsat_cores = False
     
-    def __init__(self, solver_name, name, basename=None):
+    def __init__(self, solver_name, name, basename=None, compress=False, unsat_cores=False):
         self.solver_name = solver_name
         self.name = name
         self.basename = basename
-        self.smt2vars = set([])
-        self.solver = Solver(name=solver_name, logic=QF_ABV)
-        self.smt2vars_inc = []
+        self.compress = compress
+        self.unsat_cores = unsat_cores
+        self.solver = self._new_solver()
         if basename is not None:
-            self.trace_file = "%s-%s.smt2"%(basename, name)
+            self.trace_file = "%s-%s.smt2%s"%(basename, name, ".gz" if compress else "")
+            self.trace = SMT2TraceWriter(self.trace_file, compress)
+
+    def _new_solver(self):
+        if self.unsat_cores:
+            return Solver(name=self.solver_name, logic=QF_ABV, unsat_cores_mode="named")
+        return Solver(name=self.solver_name, logic=QF_ABV)
 
     def clear(self):
+        self.exit()
+        self.solver = self._new_solver()
+
+    def exit(self):
         self.solver.exit()
-        self.solver = Solver(name=self.solver_name, logic=QF_ABV)
+        if self.trace is not None:
+            self.trace.close()
 
-    def copy(self, name=None):
-        return TraceSolver(self.solver_name, self.name if name is None else name, self.basename)
+    def copy(self, name=None, unsat_cores=None):
+        unsat_cores = self.unsat_cores if unsat_cores is None else unsat_cores
+        return TraceSolver(self.solver_name, self.name if name is None else name, self.basename, self.compress, unsat_cores)
         
 class BMCSolver(object):
 
+    act_id = 0
+
     def __init__(self, hts, config):
         self.hts = hts
         self.config = config
@@ -116,12 +384,21 @@ class BMCSolver(object):
         self.total_time = 0.0
 
         basename = None
+        compress = False
         if self.config.smt2file is not None:
-            basename = ".".join(self.config.smt2file.split(".")[:-1])
-        self.solver = TraceSolver(config.solver_name, "main", basename)
+            smt2file = self.config.smt2file
+            compress = smt2file.endswith(".gz")
+            if compress:
+                smt2file = smt2file[:-len(".gz")]
+            basename = ".".join(smt2file.split(".")[:-1])
+        self.solver = TraceSolver(config.solver_name, "main", basename, compress)
+
+        self.unroller = Unroller()
 
-        self.varmapf_t = None
-        self.varmapb_t = None
+    def close_traces(self):
+        for solver in vars(self).values():
+            if isinstance(solver, TraceSolver) and (solver.trace is not None):
+                solver.trace.close()
 
     def unroll(self, trans, invar, k_end, k_start=0, gen_list=False):
         Logger.log("Unroll from %s to %s"%(k_start, k_end), 2)
@@ -134,11 +411,18 @@ class BMCSolver(object):
         t = k_start
         while t < k_end:
             to_t = t+1 if fwd else t
+            timer = Logger.start_timer("Unroll frame %s"%t, Logger.level(3))
             formula.append(time_function(trans, t))
             formula.append(time_function(invar, to_t))
+            self.unroller.total_time += Logger.get_timer(timer, Logger.level(3))
             Logger.log("Add trans, k=%s"%t, 2)
             t += 1
 
+        Logger.log("Total time unroll: %.2f sec"%self.unroller.total_time, 2)
+        if Logger.level(2):
+            timed_mem = (TIMED.memory_usage() + PTIMED.memory_usage())/1024.0
+            Logger.log("Timed symbols: %s (%.2f KB)"%(len(TIMED) + len(PTIMED), timed_mem), 2)
+
         if gen_list:
             return formula
             
@@ -158,6 +442,7 @@ class BMCSolver(object):
                                     VerificationStrategy.FWD, \
                                     VerificationStrategy.NU, \
                                     VerificationStrategy.INT, \
+                                    VerificationStrategy.PDR, \
                                     VerificationStrategy.LTL,
                                     VerificationStrategy.ALL]:
             return self._remap_model_fwd(vars, model, k)
@@ -165,62 +450,141 @@ class BMCSolver(object):
         Logger.error("Invalid configuration strategy")
         return None
         
-    def _init_at_time(self, vars, maxtime):
+    def cone_of_influence(self, hts, formulae):
+        if not self.config.coi:
+            return hts
 
-        previous = self.config.strategy != VerificationStrategy.FWD
+        return ConeOfInfluence.get(hts).reduce(hts, formulae)
 
-        if self.varmapf_t is not None:
-            del(self.varmapf_t)
+    def sweep(self, hts):
+        if not self.config.sweep:
+            return hts
 
-        if self.varmapb_t is not None:
-            del(self.varmapb_t)
-            
-        self.varmapf_t = {}
-        self.varmapb_t = {}
+        return Sweeper.get(hts).reduce(hts, self.config.solver_name)
+
+    def functional_form(self, hts, formulae):
+        if not self.config.functional:
+            return hts
+
+        return FunctionalForm.get(hts).reduce(hts, formulae)
+
+    def random_simulation(self, hts, bad, k, k_min=0):
+        """Returns (t, model) of a random execution reaching bad, or (-1, None)"""
+
+        try:
+            simulator = RandomSimulator(hts, bad)
+        except UnsupportedFormula as e:
+            Logger.log("Random simulation not supported: %s"%(e), 1)
+            return (-1, None)
+
+        return simulator.simulate(self.config.random_sim, k, k_min)
+
+    def _bmc_states(self, hts, k, vars):
+        """Returns the states in the BMC models, picking a few distinct states at each depth"""
+
+        init = And(hts.single_init(), hts.single_invar())
+        trans = hts.single_trans()
+        invar = hts.single_invar()
+
+        self._init_at_time(hts.vars)
+        self._reset_assertions(self.solver)
+        self._add_assertion(self.solver, self.at_time(init, 0))
+
+        states = []
+        for t in range(k+1):
+            if t > 0:
+                self._add_assertion(self.solver, self.unroll(trans, invar, t, t-1))
+
+            act = self._activation_literal("sample_%s"%t)
+            for i in range(BMC_SAMPLES):
+                if not self._solve(self.solver, [act]):
+                    break
+
+                model = self._get_model(self.solver, [TS.get_timed(v, j) for v in vars for j in range(t+1)])
+                for j in range(t+1):
+                    state = dict([(v, model[TS.get_timed(v, j)].constant_value()) for v in vars])
+                    if state not in states:
+                        states.append(state)
+
+                # The next model reaches a different state at depth t
+                last = [EqualsOrIff(TS.get_timed(v, t), model[TS.get_timed(v, t)]) for v in vars]
+                self._add_assertion(self.solver, Implies(act, Not(And(last))))
+
+            self._add_assertion(self.solver, Not(act))
+
+        self._reset_assertions(self.solver)
+        Logger.log("BMC sampling: %s distinct states"%(len(states)), 1)
+        return states
+
+    def _sample_states(self, hts, k, vars):
+        """Returns reachable states, from the random simulation or from the BMC models"""
+
+        if NUMPY:
+            try:
+                simulator = RandomSimulator(hts, FALSE())
+                return simulator.states(max(self.config.random_sim, BATCH), k, vars)
+            except UnsupportedFormula as e:
+                Logger.log("Random simulation not supported: %s"%(e), 1)
 
-        timed = TS.get_timed_name
-        ptimed = TS.get_ptimed_name
-        prime = TS.get_prime_name
-        prev = TS.get_prev_name
+        return self._bmc_states(hts, k, vars)
 
-        varsstr = [v.symbol_name() for v in vars]
+    def mine_invariants(self, hts, k):
+        """Returns hts with the inductive invariants mined from the states reachable within
+        k steps as lemmas. The invariants are cached on the TSs, assumptions and lemmas of
+        hts, and each mining run stores them in the mine_invariants file
+        """
 
-        for t in range(maxtime+2):
-            varmapf = []
-            varmapb = []
+        assumptions = frozenset(hts.assumptions) if hts.assumptions is not None else frozenset([])
+        lemmas = frozenset(hts.lemmas) if hts.lemmas is not None else frozenset([])
+        key = (frozenset(hts.tss), assumptions, lemmas)
 
-            for sname in varsstr:
-                psname = prime(sname)
-                rsname = prev(sname)
+        if hts.mined_lemmas is None:
+            hts.mined_lemmas = {}
 
-                varmapf.append((sname, timed(sname, t)))
-                varmapf.append((psname, timed(sname, t+1)))
-                varmapf.append((rsname, timed(sname, t-1)))
+        if key in hts.mined_lemmas:
+            Logger.log("Mined invariants cached", 1)
+        else:
+            miner = InvariantMiner(hts.state_vars)
+            candidates = miner.candidates(self._sample_states(hts, k, miner.vars))
+            hts.mined_lemmas[key] = self._inductive_lemmas(hts, candidates)
 
-                if previous:
-                    varmapb.append((sname, ptimed(sname, t)))
-                    varmapb.append((psname, ptimed(sname, t-1)))
-                    varmapb.append((rsname, ptimed(sname, t+1)))
+            # The invariants can be given as lemmas to the next runs
+            with open(self.config.mine_invariants, "w") as f:
+                f.write("".join(["%s\n"%(lemma.serialize()) for lemma in hts.mined_lemmas[key]]))
+            Logger.log("Mined invariants (%s) stored in \"%s\""%(len(hts.mined_lemmas[key]), self.config.mine_invariants), 1)
 
-            self.varmapf_t[t] = dict(varmapf)
+        # The system can be shared with other problems
+        mined = hts.mined_lemmas[key]
+        hts = copy.copy(hts)
+        hts.lemmas = set(hts.lemmas) if hts.lemmas is not None else None
+        for lemma in mined:
+            hts.add_lemma(lemma)
 
-            if previous:
-                self.varmapb_t[t-1] = dict(varmapb)
+        return hts
+
+    def preprocess(self, hts, formulae):
+        return self.functional_form(self.sweep(self.cone_of_influence(hts, formulae)), formulae)
+
+    def _init_at_time(self, vars):
+        self.unroller.set_vars(vars)
+
+    def _activation_literal(self, name):
+        BMCSolver.act_id += 1
+        return Symbol("%sact_%s_%s%s"%(HIDDEN, name, BMCSolver.act_id, HIDDEN), BOOL)
 
     def at_time(self, formula, t):
-        return substitute(formula, self.varmapf_t[t])
+        return self.unroller.at_time(formula, t)
 
     def at_ptime(self, formula, t):
-        return substitute(formula, self.varmapb_t[t])
+        return self.unroller.at_ptime(formula, t)
     
     def _write_smt2_log(self, solver, line):
-        tracefile = solver.trace_file
-        if tracefile is not None:
-            with open(tracefile, "a") as f:
-                f.write(line+"\n")
+        if solver.trace is not None:
+            solver.trace.write(line)
 
     def _write_smt2_comment(self, solver, line):
-        return self._write_smt2_log(solver, ";; %s"%line)
+        if solver.trace is not None:
+            solver.trace.comment(line)
 
     def _add_assertion(self, solver, formula, comment=None):
         if not self.config.skip_solving:
@@ -232,62 +596,28 @@ class BMCSolver(object):
             printer.printer(formula)
             print(buf.getvalue()+"\n")
 
-        if solver.trace_file is not None:
+        if solver.trace is not None:
             if comment:
-                self._write_smt2_comment(solver, "%s: START"%comment)
+                solver.trace.comment("%s: START"%comment)
 
-            formula_fv = get_free_variables(formula)
-                
-            for v in formula_fv:
-                if v in solver.smt2vars:
-                    continue
-                
-                if v.symbol_type() == BOOL:
-                    self._write_smt2_log(solver, "(declare-fun %s () Bool)" % (v.symbol_name()))
-                elif v.symbol_type().is_array_type():
-                    st = v.symbol_type()
-                    assert st.index_type.is_bv_type(), "Expecting BV indices"
-                    assert st.elem_type.is_bv_type(), "Expecting BV elements"
-                    self._write_smt2_log(solver, "(declare-fun %s () (Array (_ BitVec %s) (_ BitVec %s)))"%(v.symbol_name(), st.index_type.width, st.elem_type.width))
-                elif v.symbol_type().is_bv_type():
-                    self._write_smt2_log(solver, "(declare-fun %s () (_ BitVec %s))" % (v.symbol_name(), v.symbol_type().width))
-                else:
-                    Logger.error("Unhandled type in smt2 translation")
-
-            self._write_smt2_log(solver, "")
-
-            for v in formula_fv:
-                solver.smt2vars.add(v)
-
-            if formula.is_and():
-                for f in conjunctive_partition(formula):
-                    buf = cStringIO()
-                    printer = SmtPrinter(buf)
-                    printer.printer(f)
-                    self._write_smt2_log(solver, "(assert %s)"%buf.getvalue())
-            else:
-                buf = cStringIO()
-                printer = SmtPrinter(buf)
-                printer.printer(formula)
-                self._write_smt2_log(solver, "(assert %s)"%buf.getvalue())
+            solver.trace.assertion(formula)
 
             if comment:
-                self._write_smt2_comment(solver, "%s: END"%comment)
-                                
+                solver.trace.comment("%s: END"%comment)
 
     def _push(self, solver):
         if not self.config.skip_solving:
             solver.solver.push()
 
-        solver.smt2vars_inc.append(solver.smt2vars)
-        self._write_smt2_log(solver, "(push 1)")
+        if solver.trace is not None:
+            solver.trace.push()
 
     def _pop(self, solver):
         if not self.config.skip_solving:
             solver.solver.pop()
 
-        solver.smt2vars = solver.smt2vars_inc.pop()
-        self._write_smt2_log(solver, "(pop 1)")
+        if solver.trace is not None:
+            solver.trace.pop()
 
     def _get_model(self, solver, relevant_vars=None):
         if relevant_vars is None:
@@ -301,14 +631,12 @@ class BMCSolver(object):
         if not self.config.skip_solving:
             solver.solver.reset_assertions()
 
-        if solver.trace_file is not None:
-            solver.smt2vars = set([])
-            with open(solver.trace_file, "w") as f:
-                f.write("(set-logic %s)\n"%self.hts.logic)
+        if solver.trace is not None:
+            solver.trace.reset(self.hts.logic)
 
-    def _solve(self, solver):
-        self._write_smt2_log(solver, "(check-sat)")
-        self._write_smt2_log(solver, "")
+    def _solve(self, solver, assumptions=None):
+        if solver.trace is not None:
+            solver.trace.check_sat(assumptions)
 
         if self.config.skip_solving:
             return None
@@ -316,42 +644,228 @@ class BMCSolver(object):
         if Logger.level(2):
             timer = Logger.start_timer("Solve")
 
-        r = solver.solver.solve()
+        r = solver.solver.solve(assumptions)
 
         if Logger.level(2):
             self.total_time += Logger.get_timer(timer)
             Logger.log("Total time solve: %.2f sec"%self.total_time, 1)
 
         return r
-                
 
-    def _check_lemma(self, hts, lemma, init, trans):
+    def _solve_cube(self, solver, assumptions):
+        # Runs in a worker, the trace of the solver is kept by the parent
+        return solver.solver.solve(assumptions)
+
+    def _solve_budget(self, solver, assumptions, budget):
+        """Solves the query in a worker with a time budget (in seconds), and
+        returns None when it runs out. A satisfiable query is solved again on
+        solver, which then has the model.
+        """
+
+        if self.config.skip_solving:
+            return self._solve(solver, assumptions)
+
+        pool = ProcessPool(1)
+        pool.submit("query", self._solve_cube, (solver, assumptions), timeout=budget)
+
+        try:
+            for (name, status, res, elapsed) in pool.results():
+                if status == TaskStatus.TIMEOUT:
+                    return None
+
+                if status != TaskStatus.OK:
+                    Logger.warning("%s terminated with status %s"%(name, status))
+                    Logger.log(str(res), 2)
+                    return self._solve(solver, assumptions)
+        finally:
+            pool.terminate()
+
+        if res:
+            return self._solve(solver, assumptions)
+
+        if solver.trace is not None:
+            solver.trace.check_sat(assumptions)
+
+        return False
+
+    def _dag_size(self, formula):
+        visited = set([])
+        to_visit = [formula]
+        while len(to_visit) > 0:
+            node = to_visit.pop()
+            if node not in visited:
+                visited.add(node)
+                to_visit += list(node.args())
+        return len(visited)
+
+    def _split_vars(self, hts, formula, n):
+        """Returns the n variables whose assignment most simplifies formula
+        (lookahead on both polarities), among the ones with the largest fan-out
+        """
+
+        fanout = {}
+        for var in hts.state_vars | hts.input_vars:
+            if var.symbol_type().is_bool_type() or var.symbol_type().is_bv_type():
+                fanout[var] = 0
+
+        visited = set([])
+        to_visit = [formula]
+        while len(to_visit) > 0:
+            node = to_visit.pop()
+            if node in visited:
+                continue
+            visited.add(node)
+            for arg in node.args():
+                if arg in fanout:
+                    fanout[arg] += 1
+                to_visit.append(arg)
+
+        candidates = [v for v in sorted(fanout, key=lambda v: (-fanout[v], v.symbol_name())) if fanout[v] > 0]
+        size = len(visited)
+
+        scores = {}
+        for var in candidates[:LOOKAHEAD_CANDIDATES]:
+            if var.symbol_type().is_bool_type():
+                values = [FALSE(), TRUE()]
+            else:
+                width = var.symbol_type().width
+                values = [BV(0, width), BV((2**width)-1, width)]
+            reductions = [size - self._dag_size(simplify(formula.substitute({var: value}))) for value in values]
+            scores[var] = (reductions[0]+1)*(reductions[1]+1)
+
+        return sorted(scores, key=lambda v: (-scores[v], v.symbol_name()))[:n]
+
+    def _solve_cubes(self, solver, assumptions, hts, formula, t):
+        """Solves the query split in cubes over the (most significant) bits of the
+        variables at time t, in parallel. The satisfiable cube is solved again on
+        solver, which then has the model.
+        """
+
+        bits = min(MAX_CUBE_BITS, max(1, int(math.ceil(math.log(multiprocessing.cpu_count(), 2)))))
+
+        literals = []
+        for var in self._split_vars(hts, formula, bits):
+            var_t = self.at_time(var, t)
+            if var.symbol_type().is_bool_type():
+                bit = var_t
+            else:
+                width = var.symbol_type().width
+                bit = EqualsOrIff(BVExtract(var_t, width-1, width-1), BV(1, 1))
+            act = self._activation_literal("cube")
+            self._add_assertion(solver, Iff(act, bit))
+            literals.append(act)
+
+        if len(literals) == 0:
+            return self._solve(solver, assumptions)
+
+        Logger.log("Splitting on %s"%(", ".join([str(l) for l in literals])), 2)
+
+        cubes = {}
+        pool = ProcessPool()
+        for i in range(2**len(literals)):
+            name = "cube_%s"%i
+            cubes[name] = [l if (i >> j) & 1 else Not(l) for (j, l) in enumerate(literals)]
+            pool.submit(name, self._solve_cube, (solver, assumptions + cubes[name]))
+
+        sat_cube = None
+        complete = True
+        try:
+            for (name, status, res, elapsed) in pool.results():
+                if status != TaskStatus.OK:
+                    Logger.warning("%s terminated with status %s"%(name, status))
+                    Logger.log(str(res), 2)
+                    complete = False
+                    continue
+
+                Logger.log("%s is %s (%.2f sec)"%(name, "SAT" if res else "UNSAT", elapsed), 1)
+                if res:
+                    sat_cube = cubes[name]
+                    break
+        finally:
+            pool.terminate()
 
-        def check_init():
-            self._reset_assertions(self.solver)
-            self._add_assertion(self.solver, self.at_time(And(init, Not(lemma)), 0), comment="Init check")
-            res = self._solve(self.solver)
+        if sat_cube is not None:
+            return self._solve(solver, assumptions + sat_cube)
 
-            prefix = None
-            if self.config.prefix is not None:
-                prefix = self.config.prefix+"-ind"
+        if not complete:
+            # Without all the cubes, the query is solved as a whole
+            return self._solve(solver, assumptions)
+
+        return False
+
+    def _drop_failing(self, solver, candidates, t, acts=None):
+        """Removes from candidates the lemmas violated at time t, until no more is violated"""
+
+        dropped = []
+        while len(candidates) > 0:
+            timed = [self.at_time(lemma, t) for lemma in candidates]
+            act = self._activation_literal("houdini")
+            self._add_assertion(solver, Implies(act, Or([Not(lemma) for lemma in timed])))
+
+            assumptions = [act] + ([acts[lemma] for lemma in candidates] if acts is not None else [])
+            res = self._solve(solver, assumptions)
 
             if res:
-                if Logger.level(2):
-                    Logger.log("Lemma \"%s\" failed for I -> L"%lemma, 2)
-                    (hr_trace, vcd_trace) = self.print_trace(hts, self._get_model(self.solver), 0, prefix=prefix, map_function=self.config.map_function)
-                    Logger.log("", 2)
-                    if hr_trace:
-                        Logger.log("Counterexample: \n%s"%(hr_trace), 2)
-                    else:
-                        Logger.log("", 2)
-                return False
-            else:
-                Logger.log("Lemma \"%s\" holds for I -> L"%lemma, 2)
+                values = self._get_model(solver, timed)
+                failing = [candidates[i] for i in range(len(candidates)) if values[timed[i]].is_false()]
+                dropped += failing
+                candidates = [lemma for lemma in candidates if lemma not in failing]
 
-            return True
+            self._add_assertion(solver, Not(act))
+
+            if not res:
+                break
+
+        return (candidates, dropped)
+
+    def _inductive_lemmas(self, hts, lemmas):
+        """Returns the largest subset of lemmas that is inductive (Houdini)"""
+
+        lemmas = set(lemmas)
+        assumptions = set(hts.assumptions) - lemmas if hts.assumptions is not None else set([])
+        key = (frozenset(hts.tss), frozenset(assumptions), frozenset(lemmas))
+
+        if hts.inductive_lemmas is None:
+            hts.inductive_lemmas = {}
+        if key in hts.inductive_lemmas:
+            Logger.log("Inductive lemmas cached", 1)
+            return hts.inductive_lemmas[key]
+
+        self._init_at_time(hts.vars)
+        hts.reset_formulae()
+        h_init = hts.single_init()
+        h_trans = hts.single_trans()
+        # The lemmas already assumed in hts are checked again
+        hts.single_invar()
+        invar = And(hts.invar, And(assumptions)) if len(assumptions) > 0 else hts.invar
+
+        candidates = sorted(lemmas, key=lambda lemma: lemma.serialize())
+
+        # Initiation, I -> L
+        self._reset_assertions(self.solver)
+        self._add_assertion(self.solver, self.at_time(And(h_init, invar), 0), comment="Init check")
+        (candidates, dropped) = self._drop_failing(self.solver, candidates, 0)
+        for lemma in dropped:
+            Logger.log("Lemma \"%s\" failed for I -> L"%lemma, 2)
+
+        # Consecution, L & T -> L', where each lemma is enabled by its own literal
+        acts = dict([(lemma, self._activation_literal("lemma")) for lemma in candidates])
+        self._reset_assertions(self.solver)
+        self._add_assertion(self.solver, self.at_time(And(invar, h_trans, TS.to_next(invar)), 0), comment="Step check")
+        for lemma in candidates:
+            self._add_assertion(self.solver, Implies(acts[lemma], self.at_time(lemma, 0)))
+        (candidates, dropped) = self._drop_failing(self.solver, candidates, 1, acts)
+        for lemma in dropped:
+            Logger.log("Lemma \"%s\" failed for L & T -> L'"%lemma, 2)
+
+        for lemma in candidates:
+            Logger.log("Lemma \"%s\" holds"%lemma, 2)
+        Logger.log("Inductive lemmas: %s/%s"%(len(candidates), len(lemmas)), 1)
+
+        self._reset_assertions(self.solver)
+        hts.inductive_lemmas[key] = candidates
+        return candidates
 
-    
     def _suff_lemmas(self, prop, lemmas):
         self._reset_assertions(self.solver)
 
@@ -366,41 +880,18 @@ class BMCSolver(object):
         if len(lemmas) == 0:
             return (hts, False)
 
-        self._reset_assertions(self.solver)
+        holding_lemmas = self._inductive_lemmas(hts, lemmas)
+
+        # The system can be shared with other problems
+        hts = copy.copy(hts)
+        hts.assumptions = set(hts.assumptions) if hts.assumptions is not None else None
+        for lemma in holding_lemmas:
+            hts.add_assumption(lemma)
+        hts.reset_formulae()
+
+        if (len(holding_lemmas) > 0) and self._suff_lemmas(prop, holding_lemmas):
+            return (hts, True)
 
-        h_init = hts.single_init()
-        h_trans = hts.single_trans()
-        
-        holding_lemmas = []
-        lindex = 1
-        nlemmas = len(lemmas)
-        tlemmas = 0
-        flemmas = 0
-        for lemma in lemmas:
-            Logger.log("\nChecking Lemma %s/%s"%(lindex,nlemmas), 1)
-            invar = hts.single_invar()
-            init = And(h_init, invar)
-            trans = And(invar, h_trans, TS.to_next(invar))
-            if self._check_lemma(hts, lemma, init, trans):
-                holding_lemmas.append(lemma)
-                hts.add_assumption(lemma)
-                hts.reset_formulae()
-                
-                Logger.log("Lemma %s holds"%(lindex), 1)
-                tlemmas += 1
-                if self._suff_lemmas(prop, holding_lemmas):
-                    return (hts, True)
-            else:
-                Logger.log("Lemma %s does not hold"%(lindex), 1)
-                flemmas += 1
-                
-            msg = "%s T:%s F:%s U:%s"%(status_bar((float(lindex)/float(nlemmas)), False), tlemmas, flemmas, (nlemmas-lindex))
-            Logger.inline(msg, 0, not(Logger.level(1))) 
-            lindex += 1
-            
-        Logger.clear_inline(0, not(Logger.level(1)))
-        
-        hts.assumptions = And(holding_lemmas)
         return (hts, False)
     
     def _remap_model_fwd(self, vars, model, k):
@@ -424,6 +915,25 @@ class BMCSolver(object):
 
         return retmodel
 
+    def _complete_model(self, hts, model, length):
+        """Recovers the values of the signals eliminated by the functional form or collapsed as aliases"""
+
+        fvars = set([])
+        for term in hts.definitions.values():
+            fvars.update(get_free_variables(term))
+
+        model = dict(model)
+        for t in range(length+1):
+            values = dict([(v, model[TS.get_timed(v, t)]) for v in fvars if TS.get_timed(v, t) in model])
+            for (var, term) in hts.definitions.items():
+                value = simplify(term.substitute(values))
+                if value.is_constant():
+                    model[TS.get_timed(var, t)] = value
+
+        hts = copy.copy(hts)
+        hts.vars = hts.vars | set(hts.definitions)
+        return (hts, model)
+
     def print_trace(self, hts, model, length, \
                     xvars=None, \
                     diff_only=True, \
@@ -443,6 +953,9 @@ class BMCSolver(object):
         if self.config.full_trace:
             diff_only = False
             all_vars = True
+
+        if hts.definitions is not None:
+            (hts, model) = self._complete_model(hts, model, length)
         
         # Human Readable Format
         hr_printer = TextTracePrinter()
@@ -0,0 +1,89 @@
+# Copyright 2018 Cristian Mattarei
+#
+# Licensed under the modified BSD (3-clause BSD) License.
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from pysmt.shortcuts import And, Not, BV, EqualsOrIff, BVULE, BVUGE, BVAnd, BVSub
+
+from cosa.utils.logger import Logger
+
+BMC_SAMPLES = 4
+MAX_EXCLUSIONS = 32
+
+class InvariantMiner(object):
+    """Candidate invariants from a sample of reachable states.
+
+    The candidates are the facts that hold in all the sampled states:
+    constant signals, equal signals, one-hot (or zero-hot) bit-vectors,
+    mutually exclusive Booleans, and the unsigned ranges of the
+    bit-vectors. They are not invariants in general, and have to be
+    filtered by an inductive check.
+    """
+
+    vars = None
+
+    def __init__(self, vars):
+        self.vars = sorted([v for v in vars if v.symbol_type().is_bool_type() or v.symbol_type().is_bv_type()], \
+                           key=lambda v: v.symbol_name())
+
+    def _value(self, var, value):
+        if var.symbol_type().is_bool_type():
+            return var if value else Not(var)
+        return EqualsOrIff(var, BV(value, var.symbol_type().width))
+
+    def candidates(self, states):
+        if len(states) == 0:
+            return []
+
+        columns = dict([(var, [state[var] for state in states]) for var in self.vars])
+
+        constants = []
+        classes = {}
+        for var in self.vars:
+            values = set(columns[var])
+            if len(values) == 1:
+                constants.append(self._value(var, values.pop()))
+            else:
+                classes.setdefault((var.symbol_type(), tuple(columns[var])), []).append(var)
+
+        equalities = []
+        for signals in classes.values():
+            equalities += [EqualsOrIff(signals[0], var) for var in signals[1:]]
+
+        # Only the representative of each class is used for the other patterns
+        signals = [vars[0] for vars in classes.values()]
+
+        onehots = []
+        ranges = []
+        for var in [v for v in signals if v.symbol_type().is_bv_type()]:
+            width = var.symbol_type().width
+            values = columns[var]
+
+            if width > 1 and all([(value & (value-1)) == 0 for value in values]):
+                onehot = EqualsOrIff(BVAnd(var, BVSub(var, BV(1, width))), BV(0, width))
+                if 0 not in values:
+                    onehot = And(onehot, Not(EqualsOrIff(var, BV(0, width))))
+                onehots.append(onehot)
+
+            (minimum, maximum) = (min(values), max(values))
+            if minimum > 0:
+                ranges.append(BVUGE(var, BV(minimum, width)))
+            if maximum < (2**width)-1:
+                ranges.append(BVULE(var, BV(maximum, width)))
+
+        booleans = [v for v in signals if v.symbol_type().is_bool_type()][:MAX_EXCLUSIONS]
+        for i in range(len(booleans)):
+            for j in range(i+1, len(booleans)):
+                (vi, vj) = (columns[booleans[i]], columns[booleans[j]])
+                if not any([vi[s] and vj[s] for s in range(len(states))]):
+                    onehots.append(Not(And(booleans[i], booleans[j])))
+
+        Logger.log("Candidate invariants: %s constants, %s equalities, %s one-hot, %s ranges, from %s states"% \
+                   (len(constants), len(equalities), len(onehots), len(ranges), len(states)), 1)
+
+        return constants + equalities + onehots + ranges
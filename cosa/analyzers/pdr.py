@@ -0,0 +1,386 @@
+# Copyright 2018 Cristian Mattarei
+#
+# Licensed under the modified BSD (3-clause BSD) License.
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import heapq
+
+from pysmt.shortcuts import And, Not, EqualsOrIff, Implies, BVAnd, BV, BOOL
+from pysmt.rewritings import conjunctive_partition
+
+from cosa.utils.logger import Logger
+from cosa.utils.formula_mngm import get_free_variables
+from cosa.representation import TS
+from cosa.analyzers.mcsolver import BMCSolver
+
+class PDR(BMCSolver):
+    """Property Directed Reachability (IC3) on the word-level HTS.
+
+    Cubes are conjunctions of assignments to the bits of the state
+    variables, and frames are delta encoded, i.e., frames[i] contains the cubes blocked
+    up to level i. Each level has its own incremental solver, where the
+    transition relation is guarded by an activation literal. The blocked
+    cubes are reduced to the unsat core of the relative induction query
+    before dropping the literals one by one, and the predecessors are
+    lifted to the unsat core of their transition to the blocked cube.
+    """
+
+    state_vars = None
+    input_vars = None
+    timed_vars = None
+    init_values = None
+    cube_formulas = None
+    frames = None
+    solvers = None
+    solver_lift = None
+    act_trans = None
+    invariant = None
+
+    def __init__(self, hts, config):
+        BMCSolver.__init__(self, hts, config)
+        self.state_vars = None
+        self.input_vars = None
+        self.timed_vars = None
+        self.init_values = None
+        self.cube_formulas = None
+        self.frames = None
+        self.solvers = None
+        self.solver_lift = None
+        self.act_trans = self._activation_literal("trans")
+        self.invariant = None
+
+    def close_traces(self):
+        BMCSolver.close_traces(self)
+        for solver in (self.solvers if self.solvers is not None else []) + [self.solver_lift]:
+            if (solver is not None) and (solver.trace is not None):
+                solver.trace.close()
+
+    def _get_state_vars(self, hts, trans):
+        state_vars = set(hts.state_vars)
+        for var in get_free_variables(trans):
+            if TS.is_prime(var):
+                state_vars.add(TS.get_ref_var(var))
+        return sorted(state_vars, key=lambda v: v.symbol_name())
+
+    def _get_init_values(self, init):
+        """Returns the constant initial values of the state variables"""
+
+        values = {}
+        for formula in conjunctive_partition(init):
+            if formula.is_symbol() and (formula in self.timed_vars[None]):
+                values[formula] = True
+            elif formula.is_not() and formula.arg(0).is_symbol() and (formula.arg(0) in self.timed_vars[None]):
+                values[formula.arg(0)] = False
+            elif formula.is_equals() or formula.is_iff():
+                (left, right) = formula.args()
+                if right.is_symbol():
+                    (left, right) = (right, left)
+                if (left in self.timed_vars[None]) and right.is_constant():
+                    values[left] = right.constant_value()
+        return values
+
+    def _cube_formula(self, cube, t=None):
+        """Returns the formula of cube, at time t if not None"""
+
+        key = (cube, t)
+        if key in self.cube_formulas:
+            return self.cube_formulas[key]
+
+        timed_vars = self.timed_vars[t]
+        literals = []
+        masks = {}
+
+        for (var, index, value) in cube:
+            if var.symbol_type() == BOOL:
+                literals.append(timed_vars[var] if value else Not(timed_vars[var]))
+            elif index is not None:
+                (mask, bits) = masks.get(var, (0, 0))
+                masks[var] = (mask | (1 << index), bits | (value << index))
+            else:
+                literals.append(EqualsOrIff(timed_vars[var], value))
+
+        # The bits of each variable are grouped in a masked equality
+        for var in sorted(masks, key=lambda v: v.symbol_name()):
+            (mask, bits) = masks[var]
+            width = var.symbol_type().width
+            if mask == (1 << width)-1:
+                literals.append(EqualsOrIff(timed_vars[var], BV(bits, width)))
+            else:
+                literals.append(EqualsOrIff(BVAnd(timed_vars[var], BV(mask, width)), BV(bits, width)))
+
+        self.cube_formulas[key] = And(literals)
+        return self.cube_formulas[key]
+
+    def _get_cube(self, solver, t):
+        timed_vars = [self.timed_vars[t][var] for var in self.state_vars]
+        model = self._get_model(solver, timed_vars)
+
+        cube = []
+        for (var, timed_var) in zip(self.state_vars, timed_vars):
+            value = model[timed_var]
+            vtype = var.symbol_type()
+            if vtype == BOOL:
+                cube.append((var, None, value.is_true()))
+            elif vtype.is_bv_type():
+                # Bit-level literals allow the generalization of ranges of values
+                ivalue = value.bv_unsigned_value()
+                for index in range(vtype.width-1, -1, -1):
+                    cube.append((var, index, (ivalue >> index) & 1))
+            else:
+                cube.append((var, None, value))
+
+        return tuple(cube)
+
+    def _lift(self, pred, inputs, cube):
+        """Reduces pred to the unsat core of pred & inputs & T & !cube', i.e., to
+        the states that reach cube with the same inputs
+        """
+
+        solver = self.solver_lift
+        self._push(solver)
+        self._add_assertion(solver, And(inputs))
+        self._add_assertion(solver, Not(self._cube_formula(cube, 1)))
+        literals = [self._cube_formula((literal,), 0) for literal in pred]
+        for literal in literals:
+            self._add_assertion(solver, literal)
+        if not self._solve(solver):
+            core = set(solver.solver.get_unsat_core())
+            lifted = tuple([l for (l, f) in zip(pred, literals) if f in core])
+            if len(lifted) > 0:
+                pred = lifted
+        self._pop(solver)
+        return pred
+
+    def _new_frame(self):
+        level = len(self.solvers)
+        solver = self.solver.copy("pdr%s"%level, unsat_cores=True)
+        self._reset_assertions(solver)
+
+        self._add_assertion(solver, self.at_time(self.invar, 0), "invar")
+        self._add_assertion(solver, Implies(self.act_trans, And(self.at_time(self.trans, 0), self.at_time(self.invar, 1))), "trans")
+        if level == 0:
+            self._add_assertion(solver, self.at_time(self.init, 0), "init")
+        else:
+            for cube in [c for frame in self.frames[level:] for c in frame]:
+                self._add_assertion(solver, Not(self._cube_formula(cube, 0)))
+
+        self.solvers.append(solver)
+        self.frames.append([])
+
+    def _add_blocked(self, cube, level):
+        self.frames[level].append(cube)
+        lemma = Not(self._cube_formula(cube, 0))
+        for i in range(1, level+1):
+            self._add_assertion(self.solvers[i], lemma)
+
+    def _is_blocked(self, cube, level):
+        cube = set(cube)
+        for frame in self.frames[level:]:
+            for blocked in frame:
+                if set(blocked).issubset(cube):
+                    return True
+        return False
+
+    def _intersects_init(self, cube):
+        # Quick check on the constant initial values
+        for (var, index, value) in cube:
+            if (var not in self.init_values) or ((index is None) and (var.symbol_type() != BOOL)):
+                continue
+            init_value = self.init_values[var]
+            if index is not None:
+                init_value = (init_value >> index) & 1
+            if init_value != value:
+                return False
+
+        solver = self.solvers[0]
+        self._push(solver)
+        self._add_assertion(solver, self._cube_formula(cube, 0))
+        res = self._solve(solver)
+        self._pop(solver)
+        return res
+
+    def _get_bad(self, prop, level):
+        solver = self.solvers[level]
+        self._push(solver)
+        self._add_assertion(solver, self.at_time(Not(prop), 0), "not property")
+        cube = None
+        if self._solve(solver):
+            cube = self._get_cube(solver, 0)
+        self._pop(solver)
+        return cube
+
+    def _relative_induction(self, cube, level, get_pred=False, get_core=False):
+        """Checks F[level-1] & !cube & T & cube', and returns (sat, predecessor) if
+        sat, and (sat, core) if unsat, where core is the subset of cube in the unsat core
+        """
+
+        solver = self.solvers[level-1]
+        self._push(solver)
+        self._add_assertion(solver, Not(self._cube_formula(cube, 0)))
+        if get_core:
+            # The literals of cube' are asserted one by one to be tracked in the unsat core
+            literals = [self._cube_formula((literal,), 1) for literal in cube]
+            for literal in literals:
+                self._add_assertion(solver, literal)
+        else:
+            self._add_assertion(solver, self._cube_formula(cube, 1))
+        res = self._solve(solver, [self.act_trans])
+        ret = None
+        if res and get_pred:
+            timed_inputs = [self.at_time(var, 0) for var in self.input_vars]
+            model = self._get_model(solver, timed_inputs)
+            inputs = [EqualsOrIff(timed, model[timed]) for timed in timed_inputs]
+            ret = self._lift(self._get_cube(solver, 0), inputs, cube)
+        if (not res) and get_core:
+            core = set(solver.solver.get_unsat_core())
+            ret = tuple([l for (l, f) in zip(cube, literals) if f in core])
+        self._pop(solver)
+        return (res, ret)
+
+    def _reduce(self, cube, core):
+        """Returns core if it can replace cube, i.e., when it is not empty and it does not
+        intersect the initial states. Since core is a subset of cube, F & !core & T & core'
+        is unsat when F & !cube & T & core' is unsat.
+        """
+
+        if (len(core) == 0) or (len(core) == len(cube)) or self._intersects_init(core):
+            return cube
+        return core
+
+    def _generalize(self, cube, level, core):
+        cube = list(self._reduce(cube, core))
+        for literal in list(cube):
+            if len(cube) == 1:
+                break
+            if literal not in cube:
+                continue
+            candidate = tuple([l for l in cube if l != literal])
+            if self._intersects_init(candidate):
+                continue
+            if not self._relative_induction(candidate, level)[0]:
+                cube = list(candidate)
+
+        return tuple(cube)
+
+    def _push_forward(self, cube, level, k):
+        while (level < k) and (not self._relative_induction(cube, level+1)[0]):
+            level += 1
+        return level
+
+    def _block(self, cube, k):
+        """Returns the length of the counterexample, or None if blocked"""
+
+        # Proof obligations are (level, id, cube, distance from the bad states)
+        count = 0
+        obligations = [(k, count, cube, 0)]
+
+        while len(obligations) > 0:
+            (level, _, cube, dist) = obligations[0]
+
+            if self._is_blocked(cube, level):
+                heapq.heappop(obligations)
+                continue
+
+            (res, ret) = self._relative_induction(cube, level, True, True)
+
+            if res:
+                pred = ret
+                if (level == 1) or self._intersects_init(pred):
+                    return dist+1
+                count += 1
+                heapq.heappush(obligations, (level-1, count, pred, dist+1))
+            else:
+                heapq.heappop(obligations)
+                gcube = self._generalize(cube, level, ret)
+                glevel = self._push_forward(gcube, level, k)
+                Logger.log("Blocked cube of size %s at level %s"%(len(gcube), glevel), 2)
+                self._add_blocked(gcube, glevel)
+                if glevel < k:
+                    count += 1
+                    heapq.heappush(obligations, (glevel+1, count, cube, dist))
+
+        return None
+
+    def _propagate(self, k):
+        """Returns the level of the fixpoint, if any"""
+
+        for level in range(1, k+1):
+            for cube in list(self.frames[level]):
+                if not self._relative_induction(cube, level+1)[0]:
+                    self.frames[level].remove(cube)
+                    self._add_blocked(cube, level+1)
+
+            if len(self.frames[level]) == 0:
+                return level+1
+
+        return None
+
+    def solve(self, hts, prop, k):
+        """Returns (k, None) if unknown, (k, True) if the property holds,
+        and (depth, False) if a counterexample exists
+        """
+
+        if TS.has_next(prop):
+            Logger.error("Invariant checking with next variables is not supported by PDR")
+
+        self._init_at_time(hts.vars)
+
+        self.init = hts.single_init()
+        self.trans = hts.single_trans()
+        self.invar = hts.single_invar()
+
+        self.state_vars = self._get_state_vars(hts, self.trans)
+        self.input_vars = sorted(hts.input_vars, key=lambda v: v.symbol_name())
+        self.timed_vars = {None: dict([(var, var) for var in self.state_vars])}
+        for t in [0, 1]:
+            self.timed_vars[t] = dict([(var, self.at_time(var, t)) for var in self.state_vars])
+        self.init_values = self._get_init_values(self.init)
+        self.cube_formulas = {}
+        self.frames = []
+        self.solvers = []
+        self.invariant = None
+
+        self.solver_lift = self.solver.copy("pdr_lift", unsat_cores=True)
+        self._reset_assertions(self.solver_lift)
+        self._add_assertion(self.solver_lift, And(self.at_time(self.invar, 0), self.at_time(self.trans, 0), self.at_time(self.invar, 1)))
+
+        self._new_frame()
+
+        if self._get_bad(prop, 0) is not None:
+            return (0, False)
+
+        self._new_frame()
+
+        level = 1
+        while level <= k:
+            Logger.log("\nPDR frame %s"%level, 1)
+
+            cube = self._get_bad(prop, level)
+            while cube is not None:
+                depth = self._block(cube, level)
+                if depth is not None:
+                    Logger.log("Counterexample found with k=%s"%(depth), 1)
+                    return (depth, False)
+                cube = self._get_bad(prop, level)
+
+            self._new_frame()
+
+            fixpoint = self._propagate(level)
+            sizes = [len(frame) for frame in self.frames[1:]]
+            Logger.log("Frames: %s"%(" ".join([str(s) for s in sizes])), 1)
+            Logger.msg(".", 0, not(Logger.level(1)))
+
+            if fixpoint is not None:
+                lemmas = [cube for frame in self.frames[fixpoint:] for cube in frame]
+                self.invariant = [Not(self._cube_formula(cube)) for cube in lemmas]
+                Logger.log("Inductive invariant found at frame %s (%s lemmas)"%(fixpoint, len(lemmas)), 1)
+                return (level, True)
+
+            level += 1
+
+        return (k, None)
@@ -0,0 +1,555 @@
+# Copyright 2018 Cristian Mattarei
+#
+# Licensed under the modified BSD (3-clause BSD) License.
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import time
+
+NUMPY = True
+
+try:
+    import numpy as np
+except ImportError:
+    NUMPY = False
+
+from pysmt.shortcuts import And, Not, TRUE, FALSE, BV, Array
+import pysmt.operators as op
+
+from cosa.utils.logger import Logger
+from cosa.utils.formula_mngm import get_free_variables
+from cosa.representation import TS
+
+BATCH = 1024
+MAX_WIDTH = 64
+MAX_ARRAY_INDEX = 12
+
+class UnsupportedFormula(Exception):
+    pass
+
+class Program(object):
+    """Straight-line program over vectors of values, one entry per run"""
+
+    instructions = None
+    slots = None
+    targets = None
+    filters = None
+    bad = None
+
+    def __init__(self):
+        self.instructions = []
+        self.slots = {}
+        self.targets = {}
+        self.filters = []
+        self.bad = None
+
+    def emit(self, node, fun, args=[]):
+        self.instructions.append((fun, [self.slots[arg] for arg in args]))
+        self.slots[node] = len(self.instructions)-1
+        return self.slots[node]
+
+    def execute(self, previous, rng, n):
+        values = []
+        for (fun, args) in self.instructions:
+            values.append(fun([values[a] for a in args], previous, rng, n))
+        return values
+
+class RandomSimulator(object):
+    """Batched random simulation of an HTS.
+
+    The HTS is compiled into two straight-line programs over NumPy
+    vectors (one entry per run), computing the initial states and the
+    successor states. Each variable is computed from its definition
+    (x = f(...) in init or invar, x' = g(...) in trans, or a set of
+    guarded assignments in trans, e.g., the clock and register
+    encodings), or picked at random. All the other constraints, and the
+    assumptions, filter the runs, hence the surviving runs are
+    executions of the HTS, and the first one reaching a bad state is a
+    counterexample.
+
+    Booleans, bit-vectors up to 64 bits and arrays with small indexes
+    are supported.
+    """
+
+    hts = None
+    vars = None
+    init_program = None
+    step_program = None
+    seed = 0
+
+    def __init__(self, hts, bad, seed=0):
+        if not NUMPY:
+            Logger.error("NumPy is required by the random simulation")
+
+        self.hts = hts
+        self.seed = seed
+
+        assumptions = list(hts.assumptions) if hts.assumptions is not None else []
+
+        self.vars = set(hts.vars)
+        for formula in [hts.single_init(), hts.single_trans(), hts.single_invar(), bad] + assumptions:
+            self.vars.update([TS.get_ref_var(v) for v in get_free_variables(formula)])
+        self.vars = sorted(self.vars, key=lambda v: v.symbol_name())
+
+        for var in self.vars:
+            self._check_type(var.symbol_type())
+
+        init = self._split(hts.single_init())
+        trans = self._split(hts.single_trans())
+        invar = self._split(And([hts.single_invar()] + assumptions))
+
+        if len([v for f in init + trans + invar + [bad] for v in get_free_variables(f) if TS.is_prev(v)]) > 0:
+            raise UnsupportedFormula("previous variables")
+
+        # Initial states, the variables are the current ones
+        targets = dict([(v, v) for v in self.vars])
+        definitions = self._equations(init, targets)
+        for (var, definition) in self._equations(invar, targets).items():
+            definitions.setdefault(var, definition)
+        self.init_program = self._compile(targets, definitions, init + invar, None if TS.has_next(bad) else bad)
+
+        # Successor states, from the current (given) to the next variables
+        targets = dict([(TS.get_prime(v), v) for v in self.vars])
+        n_invar = [TS.to_next(f) for f in invar]
+        definitions = self._equations(trans, targets)
+        for (var, definition) in list(self._equations(n_invar, targets).items()) + \
+                                 list(self._guarded_equations(trans, targets).items()):
+            definitions.setdefault(var, definition)
+        self.step_program = self._compile(targets, definitions, trans + n_invar, \
+                                          bad if TS.has_next(bad) else TS.to_next(bad))
+
+    def _check_type(self, vtype):
+        if vtype.is_bool_type():
+            return
+        if vtype.is_bv_type() and (vtype.width <= MAX_WIDTH):
+            return
+        if vtype.is_array_type() and vtype.index_type.is_bv_type() and (vtype.index_type.width <= MAX_ARRAY_INDEX):
+            self._check_type(vtype.elem_type)
+            if not vtype.elem_type.is_array_type():
+                return
+
+        raise UnsupportedFormula("type %s"%vtype)
+
+    def _split(self, formula):
+        conjuncts = []
+        to_visit = [formula]
+        while len(to_visit) > 0:
+            formula = to_visit.pop()
+            if formula.is_and():
+                to_visit += list(formula.args())
+            elif not formula.is_true():
+                conjuncts.append(formula)
+        return conjuncts
+
+    def _assignment(self, formula, targets):
+        """Returns (var, value) if formula assigns one of the targets"""
+
+        if formula.is_symbol() and (formula in targets):
+            return (formula, TRUE())
+        if formula.is_not() and (formula.arg(0) in targets):
+            return (formula.arg(0), FALSE())
+        if formula.is_equals() or formula.is_iff():
+            for (lhs, rhs) in [formula.args(), reversed(formula.args())]:
+                if (lhs in targets) and (lhs not in get_free_variables(rhs)):
+                    return (lhs, rhs)
+        return None
+
+    def _equations(self, conjuncts, targets):
+        definitions = {}
+        for conjunct in conjuncts:
+            assignment = self._assignment(conjunct, targets)
+            if (assignment is not None) and (assignment[0] not in definitions):
+                definitions[assignment[0]] = assignment[1]
+        return definitions
+
+    def _guarded_equations(self, conjuncts, targets):
+        """Collects the assignments guarded by implications (e.g., g -> (x' = f)),
+        a variable takes the value of its first enabled assignment, or a random one
+        """
+
+        assignments = {}
+        to_visit = [(conjunct, []) for conjunct in conjuncts]
+        while len(to_visit) > 0:
+            (formula, guards) = to_visit.pop(0)
+            if formula.is_implies():
+                to_visit.append((formula.arg(1), guards + [formula.arg(0)]))
+            elif formula.is_and():
+                to_visit += [(arg, guards) for arg in formula.args()]
+            elif formula.is_or():
+                for arg in formula.args():
+                    others = [Not(o) for o in formula.args() if o != arg]
+                    to_visit.append((arg, guards + others))
+            else:
+                assignment = self._assignment(formula, targets)
+                if assignment is not None:
+                    assignments.setdefault(assignment[0], []).append((And(guards), assignment[1]))
+
+        return assignments
+
+    def _break_cycles(self, targets, definitions):
+        """Removes the definitions that lead to combinational cycles"""
+
+        def dependencies(var):
+            definition = definitions.get(var, None)
+            if definition is None:
+                return []
+            if isinstance(definition, list):
+                formulae = [f for case in definition for f in case]
+            else:
+                formulae = [definition]
+            return [v for f in formulae for v in get_free_variables(f) if (v in targets) and (v in definitions)]
+
+        done = set([])
+        visiting = set([])
+        for root in sorted(definitions, key=lambda v: v.symbol_name()):
+            if root not in targets:
+                continue
+            to_visit = [(root, False)]
+            while len(to_visit) > 0:
+                (var, expanded) = to_visit.pop()
+                if expanded:
+                    visiting.discard(var)
+                    done.add(var)
+                    continue
+                if var in done:
+                    continue
+                if var in visiting:
+                    Logger.log("Cyclic definition of \"%s\""%var, 2)
+                    definitions[var] = None
+                    continue
+                visiting.add(var)
+                to_visit.append((var, True))
+                to_visit += [(dep, False) for dep in dependencies(var) if dep not in done]
+
+    def _compile(self, targets, definitions, filters, bad):
+        """Compiles the targets (i.e., var -> ref var), the filters and the bad states"""
+
+        program = Program()
+        definitions = dict([(k, v) for (k, v) in definitions.items() if k in targets])
+        self._break_cycles(targets, definitions)
+
+        def children(node):
+            if node in targets:
+                definition = definitions.get(node, None)
+                if definition is None:
+                    return []
+                if isinstance(definition, list):
+                    return [f for case in definition for f in case]
+                return [definition]
+            if node.is_symbol():
+                return []
+            return list(node.args())
+
+        roots = list(targets) + filters + ([bad] if bad is not None else [])
+        for root in roots:
+            to_visit = [(root, False)]
+            while len(to_visit) > 0:
+                (node, expanded) = to_visit.pop()
+                if node in program.slots:
+                    continue
+                if expanded:
+                    self._emit(program, node, targets, definitions)
+                    continue
+                to_visit.append((node, True))
+                to_visit += [(c, False) for c in children(node) if c not in program.slots]
+
+        for (var, ref) in targets.items():
+            program.targets[ref] = program.slots[var]
+        program.filters = [program.slots[f] for f in filters]
+        if bad is not None:
+            program.bad = program.slots[bad]
+
+        return program
+
+    def _emit(self, program, node, targets, definitions):
+        if node in targets:
+            definition = definitions.get(node, None)
+            vtype = node.symbol_type()
+            if definition is None:
+                return program.emit(node, lambda a, p, rng, n: self._random(vtype, rng, n))
+            if isinstance(definition, list):
+                args = [f for case in definition for f in case]
+                return program.emit(node, lambda a, p, rng, n: self._select_cases(vtype, a, rng, n), args)
+            return program.emit(node, lambda a, p, rng, n: a[0], [definition])
+
+        if node.is_symbol():
+            return program.emit(node, lambda a, p, rng, n: p[node])
+
+        return program.emit(node, self._operator(node), node.args())
+
+    def _select_cases(self, vtype, args, rng, n):
+        value = self._random(vtype, rng, n)
+        for i in range(len(args)-2, -1, -2):
+            value = self._ite(args[i], args[i+1], value)
+        return value
+
+    def _mask(self, width):
+        return np.uint64((1 << width)-1)
+
+    def _random(self, vtype, rng, n):
+        if vtype.is_bool_type():
+            return rng.random(n) < 0.5
+        if vtype.is_bv_type():
+            mask = self._mask(vtype.width)
+            value = rng.integers(0, 1 << 64, size=n, dtype=np.uint64) & mask
+            # Corner values are more likely than in a uniform distribution
+            choice = rng.integers(0, 8, size=n)
+            value = np.where(choice == 0, np.uint64(0), value)
+            value = np.where(choice == 1, np.uint64(1) & mask, value)
+            return np.where(choice == 2, mask, value)
+        if vtype.is_array_type():
+            size = 1 << vtype.index_type.width
+            return np.stack([self._random(vtype.elem_type, rng, n) for i in range(size)], axis=1)
+
+        raise UnsupportedFormula("type %s"%vtype)
+
+    def _constant(self, vtype, value, n):
+        if vtype.is_bool_type():
+            return np.full(n, value)
+        if vtype.is_bv_type():
+            return np.full(n, np.uint64(value))
+        raise UnsupportedFormula("constant of type %s"%vtype)
+
+    def _ite(self, cond, then_, else_):
+        if then_.ndim > 1:
+            cond = cond[:, None]
+        return np.where(cond, then_, else_)
+
+    def _signed(self, value, width):
+        # Signed comparisons as unsigned ones, with the sign bit flipped
+        return value ^ np.uint64(1 << (width-1))
+
+    def _shift(self, value, amount, width, left):
+        amount_c = np.minimum(amount, np.uint64(MAX_WIDTH-1))
+        shifted = (value << amount_c) if left else (value >> amount_c)
+        return np.where(amount >= np.uint64(width), np.uint64(0), shifted & self._mask(width))
+
+    def _ashr(self, value, amount, width):
+        mask = self._mask(width)
+        amount_c = np.minimum(amount, np.uint64(width))
+        shifted = self._shift(value, amount, width, False)
+        fill = np.where(amount >= np.uint64(width), mask, ~(mask >> amount_c) & mask)
+        sign = ((value >> np.uint64(width-1)) & np.uint64(1)) == np.uint64(1)
+        return np.where(sign, shifted | fill, shifted)
+
+    def _operator(self, node):
+        ntype = node.node_type()
+
+        if ntype == op.BOOL_CONSTANT:
+            value = node.constant_value()
+            return lambda a, p, rng, n: self._constant(node.get_type(), value, n)
+        if ntype == op.BV_CONSTANT:
+            if node.bv_width() > MAX_WIDTH:
+                raise UnsupportedFormula("constant width %s"%node.bv_width())
+            value = node.constant_value()
+            return lambda a, p, rng, n: self._constant(node.get_type(), value, n)
+        if ntype == op.ARRAY_VALUE:
+            vtype = node.get_type()
+            self._check_type(vtype)
+            size = 1 << vtype.index_type.width
+            default = node.array_value_default()
+            assigned = list(node.array_value_assigned_values_map().items())
+            def array_value(a, p, rng, n):
+                value = np.stack([self._constant(vtype.elem_type, default.constant_value(), n)]*size, axis=1)
+                for (index, elem) in assigned:
+                    value[:, index.constant_value()] = elem.constant_value()
+                return value
+            return array_value
+
+        if ntype == op.AND:
+            return lambda a, p, rng, n: np.logical_and.reduce(a)
+        if ntype == op.OR:
+            return lambda a, p, rng, n: np.logical_or.reduce(a)
+        if ntype == op.NOT:
+            return lambda a, p, rng, n: ~a[0]
+        if ntype == op.IMPLIES:
+            return lambda a, p, rng, n: (~a[0]) | a[1]
+        if ntype == op.IFF:
+            return lambda a, p, rng, n: a[0] == a[1]
+        if ntype == op.ITE:
+            return lambda a, p, rng, n: self._ite(a[0], a[1], a[2])
+        if ntype == op.EQUALS:
+            if node.arg(0).get_type().is_array_type():
+                return lambda a, p, rng, n: np.all(a[0] == a[1], axis=1)
+            return lambda a, p, rng, n: a[0] == a[1]
+
+        if ntype == op.ARRAY_SELECT:
+            return lambda a, p, rng, n: a[0][np.arange(n), a[1].astype(np.intp)]
+        if ntype == op.ARRAY_STORE:
+            def store(a, p, rng, n):
+                value = a[0].copy()
+                value[np.arange(n), a[1].astype(np.intp)] = a[2]
+                return value
+            return store
+
+        if not node.get_type().is_bv_type():
+            if ntype in [op.BV_ULT, op.BV_ULE, op.BV_SLT, op.BV_SLE]:
+                width = node.arg(0).bv_width()
+                if ntype == op.BV_ULT:
+                    return lambda a, p, rng, n: a[0] < a[1]
+                if ntype == op.BV_ULE:
+                    return lambda a, p, rng, n: a[0] <= a[1]
+                if ntype == op.BV_SLT:
+                    return lambda a, p, rng, n: self._signed(a[0], width) < self._signed(a[1], width)
+                return lambda a, p, rng, n: self._signed(a[0], width) <= self._signed(a[1], width)
+            raise UnsupportedFormula(op.op_to_str(ntype))
+
+        width = node.bv_width()
+        if width > MAX_WIDTH:
+            raise UnsupportedFormula("width %s"%width)
+        mask = self._mask(width)
+
+        if ntype == op.BV_ADD:
+            return lambda a, p, rng, n: (a[0] + a[1]) & mask
+        if ntype == op.BV_SUB:
+            return lambda a, p, rng, n: (a[0] - a[1]) & mask
+        if ntype == op.BV_MUL:
+            return lambda a, p, rng, n: (a[0] * a[1]) & mask
+        if ntype == op.BV_NEG:
+            return lambda a, p, rng, n: (np.uint64(0) - a[0]) & mask
+        if ntype == op.BV_NOT:
+            return lambda a, p, rng, n: (~a[0]) & mask
+        if ntype == op.BV_AND:
+            return lambda a, p, rng, n: a[0] & a[1]
+        if ntype == op.BV_OR:
+            return lambda a, p, rng, n: a[0] | a[1]
+        if ntype == op.BV_XOR:
+            return lambda a, p, rng, n: a[0] ^ a[1]
+        if ntype == op.BV_UDIV:
+            return lambda a, p, rng, n: np.where(a[1] == np.uint64(0), mask, a[0] // np.maximum(a[1], np.uint64(1)))
+        if ntype == op.BV_UREM:
+            return lambda a, p, rng, n: np.where(a[1] == np.uint64(0), a[0], a[0] % np.maximum(a[1], np.uint64(1)))
+        if ntype == op.BV_LSHL:
+            return lambda a, p, rng, n: self._shift(a[0], a[1], width, True)
+        if ntype == op.BV_LSHR:
+            return lambda a, p, rng, n: self._shift(a[0], a[1], width, False)
+        if ntype == op.BV_ASHR:
+            return lambda a, p, rng, n: self._ashr(a[0], a[1], width)
+        if ntype == op.BV_COMP:
+            return lambda a, p, rng, n: (a[0] == a[1]).astype(np.uint64)
+        if ntype == op.BV_CONCAT:
+            low = np.uint64(node.arg(1).bv_width())
+            return lambda a, p, rng, n: (a[0] << low) | a[1]
+        if ntype == op.BV_EXTRACT:
+            start = np.uint64(node.bv_extract_start())
+            return lambda a, p, rng, n: (a[0] >> start) & mask
+        if ntype == op.BV_ZEXT:
+            return lambda a, p, rng, n: a[0]
+        if ntype == op.BV_SEXT:
+            a_width = node.arg(0).bv_width()
+            ext = mask ^ self._mask(a_width)
+            return lambda a, p, rng, n: np.where((a[0] >> np.uint64(a_width-1)) & np.uint64(1), a[0] | ext, a[0])
+        if ntype in [op.BV_ROL, op.BV_ROR]:
+            step = node.bv_rotation_step() % width
+            if ntype == op.BV_ROR:
+                step = (width - step) % width
+            if step == 0:
+                return lambda a, p, rng, n: a[0]
+            return lambda a, p, rng, n: ((a[0] << np.uint64(step)) | (a[0] >> np.uint64(width-step))) & mask
+
+        raise UnsupportedFormula(op.op_to_str(ntype))
+
+    def _frame(self, program, values):
+        return dict([(var, values[slot]) for (var, slot) in program.targets.items()])
+
+    def _alive(self, program, values, alive):
+        for slot in program.filters:
+            alive = alive & values[slot]
+        return alive
+
+    def _run(self, seed, n, k, k_min, record=None, frames=None):
+        """Returns (alive runs, the first bad (cycle, run), and the trace of the recorded run)"""
+
+        rng = np.random.default_rng(seed)
+        history = []
+
+        values = self.init_program.execute({}, rng, n)
+        frame = self._frame(self.init_program, values)
+        alive = self._alive(self.init_program, values, np.full(n, True))
+        if record is not None:
+            history.append(dict([(v, value[record]) for (v, value) in frame.items()]))
+        if frames is not None:
+            frames.append((frame, alive))
+
+        if (self.init_program.bad is not None) and (k_min == 0):
+            bad = alive & values[self.init_program.bad]
+            if bad.any():
+                return (alive, (0, int(np.argmax(bad))), history)
+
+        for t in range(1, k+1):
+            if not alive.any():
+                break
+            values = self.step_program.execute(frame, rng, n)
+            frame = self._frame(self.step_program, values)
+            alive = self._alive(self.step_program, values, alive)
+            if record is not None:
+                history.append(dict([(v, value[record]) for (v, value) in frame.items()]))
+            if frames is not None:
+                frames.append((frame, alive))
+
+            if (self.step_program.bad is not None) and (t >= k_min):
+                bad = alive & values[self.step_program.bad]
+                if bad.any():
+                    return (alive, (t, int(np.argmax(bad))), history)
+
+        return (alive, None, history)
+
+    def _to_constant(self, vtype, value):
+        if vtype.is_bool_type():
+            return TRUE() if value else FALSE()
+        if vtype.is_bv_type():
+            return BV(int(value), vtype.width)
+
+        default = self._to_constant(vtype.elem_type, value[0])
+        assigned = {}
+        for index in range(1, len(value)):
+            if value[index] != value[0]:
+                assigned[BV(index, vtype.index_type.width)] = self._to_constant(vtype.elem_type, value[index])
+        return Array(vtype.index_type, default, assigned)
+
+    def simulate(self, runs, k, k_min=0):
+        """Returns (t, model) of the first run reaching a bad state, or (-1, None)"""
+
+        start = time.time()
+        alive = 0
+        for batch in range(0, runs, BATCH):
+            n = min(BATCH, runs-batch)
+            seed = self.seed + batch
+            (b_alive, bad, _) = self._run(seed, n, k, k_min)
+            alive += int(b_alive.sum())
+
+            if bad is not None:
+                (t, index) = bad
+                (_, _, history) = self._run(seed, n, t, k_min, index)
+
+                model = {}
+                for (i, frame) in enumerate(history):
+                    for (var, value) in frame.items():
+                        model[TS.get_timed(var, i)] = self._to_constant(var.symbol_type(), value)
+
+                Logger.log("Random simulation: bad state at cycle %s of run %s, %.2f sec"%(t, batch+index, time.time()-start), 1)
+                return (t, model)
+
+        Logger.log("Random simulation: %s runs, %s cycles, %s valid runs, %.2f sec"%(runs, k, alive, time.time()-start), 1)
+        return (-1, None)
+
+    def states(self, runs, k, vars):
+        """Returns the distinct values of vars in the states visited by the runs"""
+
+        start = time.time()
+        states = set([])
+        for batch in range(0, runs, BATCH):
+            n = min(BATCH, runs-batch)
+            frames = []
+            self._run(self.seed + batch, n, k, 0, frames=frames)
+
+            for (frame, alive) in frames:
+                columns = [frame[var][alive].tolist() for var in vars]
+                states.update(zip(*columns))
+
+        Logger.log("Random simulation: %s distinct states in %s runs, %.2f sec"%(len(states), runs, time.time()-start), 1)
+        return [dict(zip(vars, state)) for state in states]
@@ -0,0 +1,392 @@
+# Copyright 2018 Cristian Mattarei
+#
+# Licensed under the modified BSD (3-clause BSD) License.
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import time
+import random
+
+from pysmt.shortcuts import And, Not, TRUE, BV, Bool, EqualsOrIff, Solver, simplify
+from pysmt.logics import QF_ABV
+
+from cosa.utils.logger import Logger
+from cosa.utils.formula_mngm import get_free_variables
+from cosa.representation import TS, HTS
+from cosa.analyzers.unroller import Unroller
+
+COMB = "C"
+REG = "R"
+
+class Sweeper(object):
+    """Merging of equivalent signals of an HTS.
+
+    Signals with the same definition (i.e., x = f(...) in invar, or x' =
+    f(...) in trans with the same initial value) are merged by structural
+    hashing, up to a fixpoint. The remaining signals are then simulated,
+    and the candidate equivalences (and constants) are proved by induction
+    with the SMT solver, refining the candidates on each counterexample.
+
+    Merged signals are replaced by their representative, and kept as
+    aliases, hence properties and traces are unchanged.
+    """
+
+    SIM_DEPTH = 8
+    SIM_ROUNDS = 8
+
+    tss = None
+    reduced = None
+
+    def __init__(self, hts):
+        self.tss = frozenset(hts.tss)
+        self.reduced = {}
+
+    @staticmethod
+    def get(hts):
+        """Returns the sweeper of hts, which is kept until its TSs change"""
+
+        if (hts.sweeper is None) or (hts.sweeper.tss != frozenset(hts.tss)):
+            hts.sweeper = Sweeper(hts)
+        return hts.sweeper
+
+    def _split(self, formula):
+        conjuncts = []
+        to_visit = [formula]
+        while len(to_visit) > 0:
+            formula = to_visit.pop()
+            if formula.is_and():
+                to_visit += list(formula.args())
+            elif not formula.is_true():
+                conjuncts.append(formula)
+        return conjuncts
+
+    def _priority(self, hts, var):
+        return (not hts.is_input(var), var not in hts.state_vars, len(var.symbol_name()), var.symbol_name())
+
+    def _find(self, merges, term):
+        while term in merges:
+            term = merges[term]
+        return term
+
+    def _merge(self, hts, merges, term1, term2):
+        (term1, term2) = (self._find(merges, term1), self._find(merges, term2))
+        if term1 == term2:
+            return False
+
+        if term2.is_constant() or ((not term1.is_constant()) and (self._priority(hts, term2) < self._priority(hts, term1))):
+            (term1, term2) = (term2, term1)
+
+        if term2.is_constant():
+            # Different constants can only be equal in unreachable states
+            return False
+
+        merges[term2] = term1
+        return True
+
+    def _substitution(self, merges):
+        subs = {}
+        for var in merges:
+            term = self._find(merges, var)
+            subs[var] = term
+            subs[TS.get_prime(var)] = term if term.is_constant() else TS.get_prime(term)
+            subs[TS.get_prev(var)] = term if term.is_constant() else TS.get_prev(term)
+        return subs
+
+    def _definitions(self, hts):
+        """Returns the list of (var, kind, function, initial value)"""
+
+        inits = {}
+        definitions = []
+
+        for ts in hts.tss:
+            for (formula, kind) in [(ts.invar, COMB), (ts.trans, REG), (ts.init, None)]:
+                if formula is None:
+                    continue
+
+                for conjunct in self._split(formula):
+                    if not (conjunct.is_equals() or conjunct.is_iff()):
+                        continue
+                    for (lhs, rhs) in [conjunct.args(), reversed(conjunct.args())]:
+                        if not lhs.is_symbol():
+                            continue
+                        fvars = get_free_variables(rhs)
+                        if kind == REG:
+                            if (not TS.is_prime(lhs)) or (len([v for v in fvars if TS.is_prime(v)]) > 0):
+                                continue
+                            definitions.append((TS.get_ref_var(lhs), REG, rhs))
+                        elif kind == COMB:
+                            if TS.is_prime(lhs) or (lhs in fvars):
+                                continue
+                            definitions.append((lhs, COMB, rhs))
+                        elif rhs.is_constant():
+                            inits[lhs] = rhs
+                        break
+
+        return [(var, kind, rhs, inits.get(var, None)) for (var, kind, rhs) in definitions \
+                if (kind == COMB) or (var in inits)]
+
+    def _strash(self, hts, definitions, merges):
+        """Merges the signals with the same definition, up to a fixpoint"""
+
+        merged = 0
+        changed = True
+
+        while changed:
+            changed = False
+            subs = self._substitution(merges)
+            table = {}
+
+            for (var, kind, rhs, init) in definitions:
+                rhs = simplify(rhs.substitute(subs))
+
+                if kind == COMB:
+                    key = (kind, rhs)
+                    if rhs.is_constant():
+                        if self._merge(hts, merges, var, rhs):
+                            (merged, changed) = (merged+1, True)
+                        continue
+                else:
+                    init = simplify(init.substitute(subs))
+                    key = (kind, rhs, init)
+                    # Registers keeping their initial value
+                    if rhs in [init, self._find(merges, var)]:
+                        if self._merge(hts, merges, var, init):
+                            (merged, changed) = (merged+1, True)
+                        continue
+
+                if key in table:
+                    if self._merge(hts, merges, table[key], var):
+                        (merged, changed) = (merged+1, True)
+                else:
+                    table[key] = var
+
+        return merged
+
+    def _random_value(self, rand, var):
+        vtype = var.symbol_type()
+        if vtype.is_bool_type():
+            return Bool(rand.random() < 0.5)
+        return BV(rand.getrandbits(vtype.width), vtype.width)
+
+    def _simulate(self, hts, unroller, solver_name, candidates):
+        """Returns the values of the candidates in random executions"""
+
+        init = hts.single_init()
+        trans = hts.single_trans()
+        invar = hts.single_invar()
+
+        solver = Solver(name=solver_name, logic=QF_ABV)
+        solver.add_assertion(unroller.at_time(And(init, invar), 0))
+        for t in range(self.SIM_DEPTH):
+            solver.add_assertion(unroller.at_time(trans, t))
+            solver.add_assertion(unroller.at_time(invar, t+1))
+
+        timed = [unroller.at_time(var, t) for t in range(self.SIM_DEPTH+1) for var in candidates]
+
+        rand = random.Random(0)
+        inputs = [v for v in sorted(hts.input_vars, key=lambda v: v.symbol_name()) if v.symbol_type().is_bool_type() or v.symbol_type().is_bv_type()]
+        states = [v for v in sorted(hts.state_vars, key=lambda v: v.symbol_name()) if v.symbol_type().is_bool_type() or v.symbol_type().is_bv_type()]
+
+        samples = []
+        for r in range(self.SIM_ROUNDS):
+            stimuli = [[EqualsOrIff(unroller.at_time(var, t), self._random_value(rand, var)) \
+                        for var in inputs for t in range(self.SIM_DEPTH+1)]]
+            stimuli.append(stimuli[0] + [EqualsOrIff(unroller.at_time(var, 0), self._random_value(rand, var)) for var in states])
+
+            # Random values might violate the constraints of the system
+            for stimulus in [stimuli[1], stimuli[0], []]:
+                solver.push()
+                solver.add_assertion(And(stimulus))
+                if solver.solve():
+                    values = solver.get_values(timed)
+                    samples.append(tuple([values[v] for v in timed]))
+                    solver.pop()
+                    break
+                solver.pop()
+            else:
+                break
+
+        solver.exit()
+
+        return [[sample[i::len(candidates)] for sample in samples] for i in range(len(candidates))]
+
+    def _classes(self, hts, candidates, signatures):
+        groups = {}
+        for (var, signature) in zip(candidates, signatures):
+            key = (var.symbol_type(), tuple([value for sample in signature for value in sample]))
+            groups.setdefault(key, []).append(var)
+
+        classes = []
+        for ((_, values), group) in groups.items():
+            if len(values) == 0:
+                continue
+            if len(set(values)) == 1:
+                group = [values[0]] + group
+            if len(group) > 1:
+                classes.append(self._sort_class(hts, group))
+
+        return classes
+
+    def _sort_class(self, hts, terms):
+        constants = [term for term in terms if term.is_constant()]
+        variables = sorted([term for term in terms if not term.is_constant()], key=lambda v: self._priority(hts, v))
+        return constants + variables
+
+    def _equalities(self, classes):
+        return [EqualsOrIff(term, cls[0]) for cls in classes for term in cls[1:]]
+
+    def _refine(self, hts, classes, value):
+        refined = []
+        for cls in classes:
+            groups = {}
+            for term in cls:
+                groups.setdefault(term if term.is_constant() else value(term), []).append(term)
+            refined += [group for group in groups.values() if len(group) > 1]
+        return refined
+
+    def _prove(self, hts, unroller, solver_name, classes):
+        """Returns the classes of signals that are equivalent in all reachable states"""
+
+        init = hts.single_init()
+        trans = hts.single_trans()
+        invar = hts.single_invar()
+
+        def get_value(solver, t):
+            return lambda var: solver.get_value(unroller.at_time(var, t))
+
+        solver = Solver(name=solver_name, logic=QF_ABV)
+
+        # Base case, the candidates hold in the initial states
+        solver.add_assertion(unroller.at_time(And(init, invar), 0))
+        while len(classes) > 0:
+            solver.push()
+            solver.add_assertion(unroller.at_time(Not(And(self._equalities(classes))), 0))
+            if not solver.solve():
+                solver.pop()
+                break
+            classes = self._refine(hts, classes, get_value(solver, 0))
+            solver.pop()
+
+        # Inductive step, refining the candidates does not affect the base case
+        solver.reset_assertions()
+        solver.add_assertion(unroller.at_time(invar, 0))
+        solver.add_assertion(unroller.at_time(trans, 0))
+        solver.add_assertion(unroller.at_time(invar, 1))
+        iterations = 0
+        while len(classes) > 0:
+            iterations += 1
+            equalities = And(self._equalities(classes))
+            solver.push()
+            solver.add_assertion(unroller.at_time(equalities, 0))
+            solver.add_assertion(unroller.at_time(Not(equalities), 1))
+            if not solver.solve():
+                solver.pop()
+                break
+            classes = self._refine(hts, classes, get_value(solver, 1))
+            solver.pop()
+
+        solver.exit()
+
+        Logger.log("Sweeping: %s equivalence classes proved in %s iterations"%(len(classes), iterations), 2)
+        return classes
+
+    def _rebuild(self, hts, merges):
+        subs = self._substitution(merges)
+
+        reduced = HTS(hts.name)
+        seen = (set([]), set([]), set([]))
+        nconjuncts = [0, 0]
+
+        for ts in hts.tss:
+            behavior = []
+            for (index, formula) in enumerate([ts.init, ts.trans, ts.invar]):
+                conjuncts = []
+                if formula is not None:
+                    for conjunct in self._split(formula):
+                        nconjuncts[0] += 1
+                        conjunct = simplify(conjunct.substitute(subs))
+                        if conjunct.is_true() or (conjunct in seen[index]):
+                            continue
+                        seen[index].add(conjunct)
+                        conjuncts.append(conjunct)
+                nconjuncts[1] += len(conjuncts)
+                behavior.append(And(conjuncts) if len(conjuncts) > 0 else TRUE())
+
+            s_ts = TS(ts.comment)
+            s_ts.logic = ts.logic
+            s_ts.vars = set(ts.vars)
+            s_ts.state_vars = set(ts.state_vars)
+            s_ts.input_vars = set(ts.input_vars)
+            s_ts.output_vars = set(ts.output_vars)
+            s_ts.set_behavior(behavior[0], behavior[1], behavior[2])
+            reduced.add_ts(s_ts)
+
+        if len(merges) > 0:
+            a_ts = TS("Sweeping aliases")
+            a_ts.vars = set(merges.keys()) | set([term for term in merges.values() if term.is_symbol()])
+            a_ts.invar = And([EqualsOrIff(var, self._find(merges, var)) for var in sorted(merges, key=lambda v: v.symbol_name())])
+            reduced.add_ts(a_ts)
+
+        reduced.vars.update(hts.vars)
+        reduced.input_vars.update(hts.input_vars)
+        reduced.output_vars.update(hts.output_vars)
+        reduced.state_vars.update(hts.state_vars)
+
+        for assumption in hts.assumptions if hts.assumptions is not None else []:
+            reduced.add_assumption(assumption)
+        for lemma in hts.lemmas if hts.lemmas is not None else []:
+            reduced.add_lemma(lemma)
+        reduced.definitions = hts.definitions
+
+        return (reduced, nconjuncts)
+
+    def reduce(self, hts, solver_name):
+        """Returns the HTS where the equivalent signals are merged"""
+
+        assumptions = frozenset(hts.assumptions) if hts.assumptions is not None else frozenset([])
+        lemmas = frozenset(hts.lemmas) if hts.lemmas is not None else frozenset([])
+        key = (assumptions, lemmas)
+        if key in self.reduced:
+            Logger.log("Sweeping cached", 1)
+            return self.reduced[key]
+
+        start_time = time.time()
+
+        merges = {}
+        definitions = self._definitions(hts)
+        structural = self._strash(hts, definitions, merges)
+
+        unroller = Unroller()
+        unroller.set_vars(hts.vars)
+
+        (s_hts, _) = self._rebuild(hts, merges)
+        candidates = sorted([v for v in hts.vars if (v not in merges) and \
+                             (v.symbol_type().is_bool_type() or v.symbol_type().is_bv_type())], \
+                            key=lambda v: v.symbol_name())
+
+        classes = []
+        if len(candidates) > 0:
+            classes = self._classes(hts, candidates, self._simulate(s_hts, unroller, solver_name, candidates))
+            classes = self._prove(s_hts, unroller, solver_name, classes)
+
+        proved = 0
+        for cls in classes:
+            for term in cls[1:]:
+                if self._merge(hts, merges, cls[0], term):
+                    proved += 1
+
+        # The proved equivalences enable new structural merges
+        if proved > 0:
+            structural += self._strash(hts, definitions, merges)
+
+        (reduced, nconjuncts) = self._rebuild(hts, merges)
+
+        Logger.log("Sweeping: %s signals removed (%s structural, %s proved), %s/%s constraints, %.2f sec"% \
+                   (len(merges), structural, proved, nconjuncts[1], nconjuncts[0], time.time()-start_time), 1)
+
+        self.reduced[key] = reduced
+        return reduced
@@ -0,0 +1,126 @@
+# Copyright 2018 Cristian Mattarei
+#
+# Licensed under the modified BSD (3-clause BSD) License.
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from pysmt.walkers.identitydag import IdentityDagWalker
+from pysmt.shortcuts import Symbol
+
+from cosa.representation import TS, NEXT, PREV
+from cosa.utils.formula_mngm import get_free_variables
+
+class FrameRenamer(IdentityDagWalker):
+    """Renames the symbols of a formula into a single time frame.
+
+    The memoization is kept across walks, hence sub-DAGs shared by
+    different formulae (e.g., trans, invar and the property) are renamed
+    only once per frame.
+    """
+
+    def __init__(self, timed_symbol, env=None):
+        IdentityDagWalker.__init__(self, env=env, invalidate_memoization=False)
+        self.timed_symbol = timed_symbol
+
+    def walk_symbol(self, formula, args, **kwargs):
+        return self.timed_symbol(formula)
+
+class Unroller(object):
+    """Template based unrolling engine.
+
+    Each formula is analyzed once into a frame template, i.e., the free
+    symbols are classified by reference variable and frame offset
+    (current, next or previous). Time frames are then instantiated by
+    renaming the template with a frame renamer, that shares the
+    renaming of common sub-DAGs.
+    """
+
+    vars = None
+    templates = None
+    renamers = None
+    total_time = 0.0
+
+    def __init__(self):
+        self.vars = set([])
+        self.templates = {}
+        self.renamers = {}
+        self.total_time = 0.0
+
+    def set_vars(self, vars):
+        varsstr = set([v.symbol_name() for v in vars])
+        if varsstr == self.vars:
+            return
+
+        self.vars = varsstr
+        self.clear()
+
+    def clear(self):
+        self.templates = {}
+        self.renamers = {}
+
+    def _classify(self, symbol):
+        name = symbol.symbol_name()
+
+        if name in self.vars:
+            return (name, 0)
+
+        if (name[-len(NEXT):] == NEXT) and (name[:-len(NEXT)] in self.vars):
+            return (name[:-len(NEXT)], 1)
+
+        if (name[-len(PREV):] == PREV) and (name[:-len(PREV)] in self.vars):
+            return (name[:-len(PREV)], -1)
+
+        return None
+
+    def template(self, formula):
+        if formula in self.templates:
+            return self.templates[formula]
+
+        template = []
+        for symbol in get_free_variables(formula):
+            timing = self._classify(symbol)
+            if timing is not None:
+                ref_var = Symbol(timing[0], symbol.symbol_type())
+                template.append((symbol, ref_var, timing[1]))
+
+        self.templates[formula] = template
+        return template
+
+    def _renamer(self, t, forward):
+        key = (t, forward)
+        if key not in self.renamers:
+            mapping = {}
+
+            def timed_symbol(symbol):
+                if symbol in mapping:
+                    return mapping[symbol]
+                return symbol
+
+            renamer = FrameRenamer(timed_symbol)
+            self.renamers[key] = (renamer, mapping)
+
+        return self.renamers[key]
+
+    def _frame_symbol(self, var, offset, t, forward):
+        if forward:
+            return TS.get_timed(var, t+offset)
+        return TS.get_ptimed(var, t+1-offset)
+
+    def instantiate(self, formula, t, forward=True):
+        (renamer, mapping) = self._renamer(t, forward)
+
+        for (symbol, var, offset) in self.template(formula):
+            if symbol not in mapping:
+                mapping[symbol] = self._frame_symbol(var, offset, t, forward)
+
+        return renamer.walk(formula)
+
+    def at_time(self, formula, t):
+        return self.instantiate(formula, t, True)
+
+    def at_ptime(self, formula, t):
+        return self.instantiate(formula, t, False)
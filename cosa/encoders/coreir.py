@@ -17,7 +17,7 @@ except:
 
 from six.moves import cStringIO
 
-from pysmt.shortcuts import Symbol, BV, TRUE, FALSE, And, EqualsOrIff, BVExtract, BVConcat, Ite
+from pysmt.shortcuts import Symbol, BV, TRUE, FALSE, And, Or, Not, EqualsOrIff, BVExtract, BVConcat, Ite
 from pysmt.typing import BOOL, BVType
 from pysmt.smtlib.printers import SmtPrinter
 
@@ -27,6 +27,7 @@ from cosa.utils.logger import Logger
 from cosa.encoders.model import ModelParser, ModelFlags
 from cosa.encoders.modules import Modules, ModuleSymbols, SEP, CSEP
 from cosa.utils.generic import bin_to_dec, suppress_output, restore_output
+from cosa.utils.formula_mngm import substitute
 
 CR = "_const_replacement"
 RCR = "_reg_const_replacement"
@@ -68,9 +69,11 @@ class CoreIRParser(ModelParser):
     attrnames = None
     boolean = False
     pack_connections = False
+    collapse_aliases = False
     anonimize_names = False
     map_an2or = None
     map_or2an = None
+    map_aliases = None
     bitvec_new_version = True
     idvars = 0
 
@@ -94,8 +97,10 @@ class CoreIRParser(ModelParser):
 
         self.boolean = False
         self.pack_connections = True
+        self.collapse_aliases = True
         self.map_an2or = {}
         self.map_or2an = {}
+        self.map_aliases = {}
         self.anonimize_names = False
 
         self._init_mod_map()
@@ -136,10 +141,10 @@ class CoreIRParser(ModelParser):
         return name
 
     def remap_or2an(self, name):
-        if not self.anonimize_names:
-            return name
-        if name in self.map_or2an:
-            return self.map_or2an[name]
+        if self.anonimize_names and (name in self.map_or2an):
+            name = self.map_or2an[name]
+        if name in self.map_aliases:
+            return self.map_aliases[name]
         return name
     
     def BVVar(self, name, width):
@@ -344,6 +349,11 @@ class CoreIRParser(ModelParser):
         invar_props = []
         ltl_props = []
 
+        fc_lemmas = (flags is not None) and (CoreIRModelFlags.FC_LEMMAS in flags)
+        registers = []
+        muxes = []
+        comparators = []
+
         Logger.msg("Starting encoding... ", 1)
 
         count = 0
@@ -441,7 +451,15 @@ class CoreIRParser(ModelParser):
                     if CoreIRModelFlags.NO_INIT in flags:
                         ts.init = TRUE()
 
-                    if CoreIRModelFlags.FC_LEMMAS in flags:
+                    if fc_lemmas:
+                        module = self.mod_map[inst_type][0]
+                        if module == Modules.Reg:
+                            registers.append(args([self.IN, self.CLR, self.OUT, self.INIT]))
+                        elif module == Modules.Mux:
+                            muxes.append(args([self.IN0, self.IN1, self.SEL, self.OUT]))
+                        elif module == Modules.Eq:
+                            comparators.append(args([self.IN0, self.IN1, self.OUT]))
+
                         for v in ts.vars:
                             v_name = v.symbol_name()
                             if (CR in v_name) or (RCR in v_name):
@@ -576,6 +594,10 @@ class CoreIRParser(ModelParser):
             if secondvar.is_symbol():
                 eq_vars.add(secondvar)
 
+        if fc_lemmas:
+            for lemma in self.__structural_lemmas(eq_conns, registers, muxes, comparators):
+                hts.add_lemma(lemma)
+
         conns_len = len(eq_conns)
 
         if self.pack_connections:
@@ -583,9 +605,11 @@ class CoreIRParser(ModelParser):
 
         if len(eq_conns) < conns_len:
             Logger.log("Packed %d connections"%(conns_len - len(eq_conns)), 1)
-            
+
+        if self.collapse_aliases:
+            (eq_conns, eq_vars) = self.__collapse_aliases(hts, eq_conns, eq_vars)
         
-        eq_formula = TRUE()
+        eq_formula = []
         
         for eq_conn in eq_conns:
 
@@ -613,12 +637,12 @@ class CoreIRParser(ModelParser):
             if (first.get_type() == BOOL) and (second.get_type() != BOOL):
                 first = Ite(first, BV(1,1), BV(0,1))
 
-            eq_formula = And(eq_formula, EqualsOrIff(first, second))
+            eq_formula.append(EqualsOrIff(first, second))
 
             Logger.log(str(EqualsOrIff(first, second)), 3)
 
         ts = TS("Connections")
-        ts.invar = eq_formula
+        ts.invar = And(eq_formula) if len(eq_formula) > 0 else TRUE()
         ts.vars = eq_vars
 
         hts.add_ts(ts)
@@ -632,6 +656,181 @@ class CoreIRParser(ModelParser):
         return (hts, invar_props, ltl_props)
 
 
+    def __structural_lemmas(self, connections, registers, muxes, comparators):
+        """Returns the invariants given by the structure of the netlist: the values of the
+        registers loaded only with constants or with themselves, and the mutually exclusive
+        outputs of the comparators of a signal with different constants (e.g., decoders)
+        """
+
+        parents = {}
+
+        def find(var):
+            parents.setdefault(var, var)
+            while parents[var] != var:
+                parents[var] = parents[parents[var]]
+                var = parents[var]
+            return var
+
+        def is_value(var, value):
+            if var.symbol_type() == BOOL:
+                return var if value else Not(var)
+            return EqualsOrIff(var, BV(value, var.symbol_type().width))
+
+        driven = []
+        for conn in connections:
+            ((first, sel1), (second, sel2)) = (conn[0][:2], conn[1][:2])
+            if (sel1 is not None) or (sel2 is not None):
+                continue
+            if first.is_symbol() and second.is_symbol():
+                if first.symbol_type() == second.symbol_type():
+                    parents[find(first)] = find(second)
+            elif first.is_symbol() and second.is_constant():
+                driven.append((first, second))
+            elif second.is_symbol() and first.is_constant():
+                driven.append((second, first))
+
+        constants = dict([(find(var), int(value.constant_value())) for (var, value) in driven])
+        mux_outs = dict([(find(out), (in0, in1)) for (in0, in1, sel, out) in muxes])
+
+        def values(var, target, path):
+            # Constants reaching var through the muxes, None if var depends on other signals
+            var = find(var)
+            if var == find(target):
+                return set([])
+            if var in constants:
+                return set([constants[var]])
+            if (var not in mux_outs) or (var in path):
+                return None
+
+            path.add(var)
+            ret = set([])
+            for in_ in mux_outs[var]:
+                in_values = values(in_, target, path)
+                if in_values is None:
+                    ret = None
+                    break
+                ret |= in_values
+            path.remove(var)
+
+            return ret
+
+        lemmas = []
+
+        for (in_, clr, out, initval) in registers:
+            if (in_ is None) or (initval is None) or Modules.symbolic_init:
+                continue
+            reg_values = values(in_, out, set([]))
+            if reg_values is None:
+                continue
+            reg_values.add(initval)
+            if (clr is not None) and (constants.get(find(clr), None) != 0):
+                reg_values.add(0)
+            lemmas.append(Or([is_value(out, value) for value in sorted(reg_values)]))
+
+        decoders = {}
+        for (in0, in1, out) in comparators:
+            for (signal, value) in [(in0, in1), (in1, in0)]:
+                if (find(value) in constants) and (find(signal) not in constants):
+                    decoders.setdefault(find(signal), {}).setdefault(constants[find(value)], out)
+                    break
+
+        for (signal, outputs) in decoders.items():
+            outputs = [outputs[value] for value in sorted(outputs)]
+            for i in range(len(outputs)):
+                for j in range(i+1, len(outputs)):
+                    lemmas.append(Not(And(is_value(outputs[i], 1), is_value(outputs[j], 1))))
+
+            width = 1 if signal.symbol_type() == BOOL else signal.symbol_type().width
+            if len(outputs) == 2**width:
+                lemmas.append(Or([is_value(output, 1) for output in outputs]))
+
+        Logger.log("Structural lemmas: %d"%(len(lemmas)), 1)
+
+        return lemmas
+
+    def __collapse_aliases(self, hts, connections, eq_vars):
+        """Replaces the wires connected without slicing (or with a full-width slice)
+        with a single representative. The removed wires are kept as definitions
+        of the HTS, hence the traces still show them"""
+
+        parents = {}
+
+        def full_width(side):
+            (var, low) = side[:2]
+            if low is None:
+                return True
+            high = side[2] if len(side) > 2 else low
+            return var.is_symbol() and var.symbol_type().is_bv_type() and \
+                (high - low + 1 == var.symbol_type().width)
+
+        def find(var):
+            while parents[var] != var:
+                parents[var] = parents[parents[var]]
+                var = parents[var]
+            return var
+
+        new_conns = []
+        for conn in connections:
+            (first, second) = (conn[0][0], conn[1][0])
+            if first.is_symbol() and second.is_symbol() and full_width(conn[0]) and full_width(conn[1]) and \
+               (first.symbol_type() == second.symbol_type()):
+                parents.setdefault(first, first)
+                parents.setdefault(second, second)
+                parents[find(first)] = find(second)
+            else:
+                new_conns.append(conn)
+
+        classes = {}
+        for var in parents:
+            classes.setdefault(find(var), []).append(var)
+
+        interface = hts.input_vars | hts.output_vars
+        priority = lambda v: (v not in interface, v not in hts.state_vars, len(v.symbol_name()), v.symbol_name())
+
+        aliases = {}
+        for cls in classes.values():
+            cls.sort(key=priority)
+            for var in cls[1:]:
+                if var in interface:
+                    # The interface of the system is preserved
+                    new_conns.append(((var, None), (cls[0], None)))
+                else:
+                    aliases[var] = cls[0]
+
+        if len(aliases) == 0:
+            return (connections, eq_vars)
+
+        names = {}
+        for (var, rep) in aliases.items():
+            self.map_aliases[var.symbol_name()] = rep.symbol_name()
+            names[var.symbol_name()] = rep.symbol_name()
+            names[TS.get_prime_name(var.symbol_name())] = TS.get_prime_name(rep.symbol_name())
+            names[TS.get_prev_name(var.symbol_name())] = TS.get_prev_name(rep.symbol_name())
+
+        rename = lambda varset: set([aliases[v] if v in aliases else v for v in varset])
+        rename_conn = lambda conn: tuple([(aliases[side[0]],)+side[1:] if side[0] in aliases else side for side in conn])
+
+        for ts in hts.tss:
+            if ts.vars.isdisjoint(aliases):
+                continue
+            (ts.init, ts.trans, ts.invar) = [substitute(f, names) if f is not None else None for f in [ts.init, ts.trans, ts.invar]]
+            (ts.vars, ts.state_vars, ts.input_vars, ts.output_vars) = \
+                [rename(varset) for varset in [ts.vars, ts.state_vars, ts.input_vars, ts.output_vars]]
+
+        (hts.vars, hts.state_vars, hts.input_vars, hts.output_vars) = \
+            [rename(varset) for varset in [hts.vars, hts.state_vars, hts.input_vars, hts.output_vars]]
+
+        if hts.lemmas is not None:
+            hts.lemmas = set([substitute(lemma, names) for lemma in hts.lemmas])
+
+        if hts.definitions is None:
+            hts.definitions = {}
+        hts.definitions.update(aliases)
+
+        Logger.log("Collapsed %d aliases"%(len(aliases)), 1)
+
+        return ([rename_conn(conn) for conn in new_conns], rename(eq_vars))
+
     def __pack_connections(self, connections):
 
         new_conns = []
@@ -59,7 +59,7 @@ class StringParser(object):
             return None
 
         if quote:
-            strformula = quote_names(strformula)
+            strformula = quote_names(strformula, remap=self.remap_or2an)
 
         return self.parse_string(strformula)
 
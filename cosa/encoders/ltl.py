@@ -11,7 +11,7 @@
 import re
 
 from pyparsing import Literal, Word, nums, alphas, OneOrMore, ZeroOrMore, restOfLine, LineEnd, Combine, White
-from pysmt.shortcuts import TRUE, FALSE, And, Or, Symbol, BV, EqualsOrIff, Implies, get_env
+from pysmt.shortcuts import TRUE, FALSE, And, Or, Not, Iff, Symbol, BV, EqualsOrIff, Implies, get_env
 from pysmt.typing import BOOL, BVType
 from pysmt.parsing import parse, HRParser, HRLexer, PrattParser, Rule, UnaryOpAdapter, InfixOpAdapter
 
@@ -208,221 +208,440 @@ def verification_type(formula):
     return (VerificationType.LTL, formula)
 
 class LTLEncoder(object):
+    """Bounded semantics of LTL, with (encode_l) and without (encode) loop.
+
+    The encodings are memoized on (formula, t_i, t_k[, t_l]), and the
+    temporal operators are unrolled as chains, e.g., [[F a]]_i is
+    [[a]]_i | [[F a]]_{i+1}, hence the subformulae are shared among the
+    time frames. The tables are kept across bounds, i.e., the encoding of
+    a formula at the next bound reuses the non-temporal part.
+    """
+
+    mgr = None
+    memo = None
+    memo_l = None
+    memo_nnf = None
+    memo_atoms = None
+    memo_ltl = None
 
     def __init__(self):
         self.mgr = get_env().formula_manager
-        
+        self.memo = {}
+        self.memo_l = {}
+        self.memo_nnf = {}
+        self.memo_atoms = {}
+        self.memo_ltl = {}
+
+    def _has_ltl(self, formula):
+        if formula not in self.memo_ltl:
+            self.memo_ltl[formula] = has_ltl_operators(formula)
+        return self.memo_ltl[formula]
+
     def to_nnf(self, formula):
+        if formula not in self.memo_nnf:
+            self.memo_nnf[formula] = self._to_nnf(formula)
+        return self.memo_nnf[formula]
+
+    def _to_nnf(self, formula):
         if formula.is_constant():
             return formula
-        
+
         if formula.is_symbol():
             return formula
 
-        if formula.is_equals():
-            return self.mgr.Equals(self.to_nnf(formula.args()[0]), self.to_nnf(formula.args()[1]))
+        args = formula.args()
 
         if formula.is_and():
-            return self.mgr.And(self.to_nnf(formula.args()[0]), self.to_nnf(formula.args()[1]))
-        
-        if formula.is_implies():
-            return self.mgr.Or(self.mgr.Not(self.to_nnf(formula.args()[0])), self.to_nnf(formula.args()[1]))
+            return self.mgr.And([self.to_nnf(arg) for arg in args])
 
         if formula.is_or():
-            return self.mgr.Or(self.to_nnf(formula.args()[0]), self.to_nnf(formula.args()[1]))
-        
-        if formula.is_not():
-            if formula.args()[0].is_symbol():
-                return self.mgr.Not(formula.args()[0])
+            return self.mgr.Or([self.to_nnf(arg) for arg in args])
 
-            if formula.args()[0].node_type() == LTL_X:
-                return self.mgr.X(self.to_nnf(self.mgr.Not(formula.args()[0].args()[0])))
+        if formula.is_implies():
+            return self.mgr.Or(self.to_nnf(self.mgr.Not(args[0])), self.to_nnf(args[1]))
 
-            if formula.args()[0].node_type() == LTL_F:
-                return self.mgr.G(self.to_nnf(self.mgr.Not(formula.args()[0].args()[0])))
+        if formula.node_type() in ALL_LTL:
+            return self.mgr.create_node(node_type=formula.node_type(), args=tuple([self.to_nnf(arg) for arg in args]))
 
-            if formula.args()[0].node_type() == LTL_G:
-                return self.mgr.F(self.to_nnf(self.mgr.Not(formula.args()[0].args()[0])))
+        if not formula.is_not():
+            return formula
 
-            if formula.args()[0].node_type() == LTL_U:
-                return self.mgr.R(self.to_nnf(self.mgr.Not(formula.args()[0].args()[0])), self.to_nnf(self.mgr.Not(formula.args()[0].args()[1])))
+        arg = args[0]
 
-            if formula.args()[0].node_type() == LTL_R:
-                return self.mgr.U(self.to_nnf(self.mgr.Not(formula.args()[0].args()[0])), self.to_nnf(self.mgr.Not(formula.args()[0].args()[1])))
+        if arg.is_not():
+            return self.to_nnf(arg.args()[0])
 
-            if formula.args()[0].node_type() == LTL_O:
-                return self.mgr.H(self.to_nnf(self.mgr.Not(formula.args()[0].args()[0])))
+        if (not self._has_ltl(arg)) and (not arg.is_and()) and (not arg.is_or()) and (not arg.is_implies()):
+            return formula
 
-            if formula.args()[0].node_type() == LTL_H:
-                return self.mgr.O(self.to_nnf(self.mgr.Not(formula.args()[0].args()[0])))
-            
-            if formula.args()[0].is_and():
-                l = formula.args()[0].args()[0]
-                r = formula.args()[0].args()[1]
-                return self.mgr.Or(self.to_nnf(self.mgr.Not(l)), self.to_nnf(self.mgr.Not(r)))
+        nargs = [self.to_nnf(self.mgr.Not(a)) for a in arg.args()]
 
-            if formula.args()[0].is_or():
-                l = formula.args()[0].args()[0]
-                r = formula.args()[0].args()[1]
-                return self.mgr.And(self.to_nnf(self.mgr.Not(l)), self.to_nnf(self.mgr.Not(r)))
+        if arg.node_type() == LTL_X:
+            return self.mgr.X(nargs[0])
 
-            if formula.args()[0].is_implies():
-                l = formula.args()[0].args()[0]
-                r = formula.args()[0].args()[1]
-                                
-                return self.mgr.And(self.to_nnf(l), self.to_nnf(self.mgr.Not(r)))
+        if arg.node_type() == LTL_F:
+            return self.mgr.G(nargs[0])
 
-            
-            return self.mgr.Not(self.to_nnf(formula.args()[0]))
+        if arg.node_type() == LTL_G:
+            return self.mgr.F(nargs[0])
 
-        return formula
-        
-    def encode(self, formula, t_i, t_k):
-        if formula.is_constant():
-            return formula
-        
-        if formula.is_symbol():
-            assert (t_i >= 0)
-            return TS.get_timed(formula, t_i)
+        if arg.node_type() == LTL_U:
+            return self.mgr.R(nargs[0], nargs[1])
+
+        if arg.node_type() == LTL_R:
+            return self.mgr.U(nargs[0], nargs[1])
+
+        if arg.node_type() == LTL_O:
+            return self.mgr.H(nargs[0])
+
+        if arg.node_type() == LTL_H:
+            return self.mgr.O(nargs[0])
+
+        if arg.is_and():
+            return self.mgr.Or(nargs)
+
+        if arg.is_or():
+            return self.mgr.And(nargs)
+
+        if arg.is_implies():
+            return self.mgr.And(self.to_nnf(arg.args()[0]), nargs[1])
+
+        return self.mgr.Not(self.to_nnf(arg))
 
-        if formula.is_equals():
-            return self.mgr.Equals(self.encode(formula.args()[0], t_i, t_k), self.encode(formula.args()[1], t_i, t_k))
+    def _atom(self, formula, t):
+        key = (formula, t)
+        if key not in self.memo_atoms:
+            assert (t >= 0)
+            timed = dict([(v.symbol_name(), TS.get_timed(v, t).symbol_name()) for v in get_free_variables(formula)])
+            self.memo_atoms[key] = substitute(formula, timed)
+        return self.memo_atoms[key]
+
+    def _boolean(self, formula, encode):
+        args = formula.args()
 
         if formula.is_and():
-            return self.mgr.And(self.encode(formula.args()[0], t_i, t_k), self.encode(formula.args()[1], t_i, t_k))
+            return self.mgr.And([encode(arg) for arg in args])
+
+        if formula.is_or():
+            return self.mgr.Or([encode(arg) for arg in args])
 
         if formula.is_implies():
-            return self.mgr.Or(self.mgr.Not(self.encode(formula.args()[0], t_i, t_k)), self.encode(formula.args()[1], t_i, t_k))
-        
+            return self.mgr.Or(self.mgr.Not(encode(args[0])), encode(args[1]))
+
+        if formula.is_iff():
+            return self.mgr.Iff(encode(args[0]), encode(args[1]))
+
         if formula.is_not():
-            return self.mgr.Not(self.encode(formula.args()[0], t_i, t_k))
+            return self.mgr.Not(encode(args[0]))
 
-        if formula.is_lt():
-            return self.mgr.LT(self.encode(formula.args()[0], t_i, t_k), self.encode(formula.args()[1], t_i, t_k))
+        return None
 
-        if formula.is_bv_ult():
-            return self.mgr.BVULT(self.encode(formula.args()[0], t_i, t_k), self.encode(formula.args()[1], t_i, t_k))
+    def encode(self, formula, t_i, t_k):
+        key = (formula, t_i, t_k)
+        if key in self.memo:
+            return self.memo[key]
 
-        if formula.is_bv_ule():
-            return self.mgr.BVULE(self.encode(formula.args()[0], t_i, t_k), self.encode(formula.args()[1], t_i, t_k))
-        
-        if formula.is_or():
-            return self.mgr.Or(self.encode(formula.args()[0], t_i, t_k), self.encode(formula.args()[1], t_i, t_k))
-        
-        if formula.node_type() == LTL_X:
-            if t_i < t_k:
-                return self.encode(formula.args()[0], t_i+1, t_k)
-            return FALSE()
+        if formula.is_constant():
+            return formula
 
-        if formula.node_type() == LTL_G:
-            return FALSE()
+        if not self._has_ltl(formula):
+            return self._atom(formula, t_i)
 
-        if formula.node_type() == LTL_F:
-            return Or([self.encode(formula.args()[0], j, t_k) for j in range(t_i, t_k+1, 1)])
+        ret = self._boolean(formula, lambda f: self.encode(f, t_i, t_k))
+
+        if ret is not None:
+            pass
+
+        elif formula.node_type() == LTL_X:
+            ret = self.encode(formula.args()[0], t_i+1, t_k) if t_i < t_k else FALSE()
+
+        elif formula.node_type() == LTL_G:
+            ret = FALSE()
+
+        elif formula.node_type() in [LTL_F, LTL_O, LTL_H, LTL_U, LTL_R]:
+            self._encode_chain(formula, t_i, t_k)
+            ret = self.memo[key]
+
+        else:
+            Logger.error("Invalid LTL operator")
+
+        self.memo[key] = ret
+        return ret
+
+    def _step(self, formula, now, succ):
+        """Returns the encoding of formula from its arguments now and its value in the successor"""
+
+        args = formula.args()
+
+        if formula.node_type() in [LTL_F, LTL_O]:
+            return self.mgr.Or(now(args[0]), succ) if succ is not None else now(args[0])
+
+        if formula.node_type() in [LTL_G, LTL_H]:
+            return self.mgr.And(now(args[0]), succ) if succ is not None else now(args[0])
 
         if formula.node_type() == LTL_U:
-            formula_h = formula.args()[0]
-            formula_g = formula.args()[1]
-            
-            return Or([And(self.encode(formula_g, j, t_k), \
-                           And([self.encode(formula_h, n, t_k) for n in range(t_i, j, 1)])) for j in range(t_i, t_k+1, 1)])
+            if succ is None:
+                return now(args[1])
+            return self.mgr.Or(now(args[1]), self.mgr.And(now(args[0]), succ))
 
         if formula.node_type() == LTL_R:
-            formula_h = formula.args()[0]
-            formula_g = formula.args()[1]
-            
-            return Or([And(self.encode(formula_h, j, t_k), \
-                           And([self.encode(formula_g, n, t_k) for n in range(t_i, j+1, 1)])) for j in range(t_i, t_k+1, 1)])
+            if succ is None:
+                return self.mgr.And(now(args[1]), now(args[0]))
+            return self.mgr.And(now(args[1]), self.mgr.Or(now(args[0]), succ))
 
-        if formula.node_type() == LTL_O:
-            return Or([self.encode(formula.args()[0], j, t_k) for j in range(t_i, t_k+1, 1)])
+        Logger.error("Invalid LTL operator")
 
-        if formula.node_type() == LTL_H:
-            return And([self.encode(formula.args()[0], j, t_k) for j in range(t_i, t_k+1, 1)])
-        
+    def _encode_chain(self, formula, t_i, t_k):
+        succ = None
+        for j in range(t_k, t_i-1, -1):
+            key = (formula, j, t_k)
+            if key not in self.memo:
+                self.memo[key] = self._step(formula, lambda f: self.encode(f, j, t_k), succ)
+            succ = self.memo[key]
 
-        Logger.error("Invalid LTL operator")
-        
     def encode_l(self, formula, t_i, t_k, t_l):
+        key = (formula, t_i, t_k, t_l)
+        if key in self.memo_l:
+            return self.memo_l[key]
 
         if formula.is_constant():
             return formula
-        
-        if formula.is_symbol():
-            assert (t_i >= 0)
-            return TS.get_timed(formula, t_i)
 
-        if formula.is_equals():
-            return self.mgr.Equals(self.encode_l(formula.args()[0], t_i, t_k, t_l), self.encode_l(formula.args()[1], t_i, t_k, t_l))
+        if not self._has_ltl(formula):
+            return self._atom(formula, t_i)
+
+        ret = self._boolean(formula, lambda f: self.encode_l(f, t_i, t_k, t_l))
+
+        if ret is not None:
+            pass
+
+        elif formula.node_type() == LTL_X:
+            ret = self.encode_l(formula.args()[0], t_i+1 if t_i < t_k else t_l, t_k, t_l)
+
+        elif formula.node_type() in [LTL_F, LTL_G]:
+            # The value in the loop is the same for each position in the loop
+            ret = self._encode_l_chain(formula, min(t_i, t_l), t_k, t_l)
+
+        elif formula.node_type() in [LTL_U, LTL_R]:
+            # After the last state the loop is unrolled once more, and
+            # a release holds if the second unrolling reaches the end
+            tail = TRUE() if formula.node_type() == LTL_R else None
+            loop = self._encode_l_chain(formula, t_l, t_k, t_l, 1, tail)
+            ret = self._encode_l_chain(formula, t_i, t_k, t_l, 0, loop)
+
+        elif formula.node_type() in [LTL_O, LTL_H]:
+            ret = self._encode_l_chain(formula, t_i, t_k, t_l)
+
+        else:
+            Logger.error("Invalid LTL operator")
+
+        self.memo_l[key] = ret
+        return ret
+
+    def _encode_l_chain(self, formula, t_i, t_k, t_l, lap=0, tail=None):
+        succ = tail
+        for j in range(t_k, t_i-1, -1):
+            key = (formula, j, t_k, t_l, lap)
+            if key not in self.memo_l:
+                self.memo_l[key] = self._step(formula, lambda f: self.encode_l(f, j, t_k, t_l), succ)
+            succ = self.memo_l[key]
+        return succ
+
+class LTLLinearEncoder(object):
+    """Linear size and incremental encoding of the bounded LTL semantics
+    (Biere et al., Linear Encodings of Bounded LTL Model Checking, and
+    Latvala et al., Simple is Better).
+
+    Each subformula has an auxiliary variable per time frame, and the
+    loop is selected by the l_i variables (l_i implies that the last
+    state is equal to the state i-1). The constraints returned by frame
+    are independent from the bound, while the ones returned by final
+    only hold for the current bound, i.e., they refer to the copy E of
+    the successor of the last state, that is the loop state L if a loop
+    exists, or false otherwise.
+
+    The formula is expected to be in NNF, with only future operators,
+    and the names of the auxiliary variables are enclosed by hidden.
+    """
+
+    formula = None
+    vars = None
+    at_time = None
+    hidden = None
+
+    nodes = None
+    aux = None
+    nexts = None
+
+    def __init__(self, formula, vars, at_time, hidden=""):
+        self.formula = formula
+        self.vars = sorted(vars, key=lambda v: v.symbol_name())
+        self.at_time = at_time
+        self.hidden = hidden
+
+        self.nodes = []
+        self.aux = {}
+        self.nexts = set([])
+        self._collect(formula)
+
+        self.loop_exists = Symbol(self._name("loop_exists"), BOOL)
+        self.sel = Symbol(self._name("l"), BOOL)
+        self.inloop = Symbol(self._name("inloop"), BOOL)
+        self.loop_vars = dict([(v, TS.get_prefix(v, self._name("loop"))) for v in self.vars])
+
+    @staticmethod
+    def is_supported(formula):
+        if not has_ltl_operators(formula):
+            return True
 
-        if formula.is_and():
-            return self.mgr.And(self.encode_l(formula.args()[0], t_i, t_k, t_l), self.encode_l(formula.args()[1], t_i, t_k, t_l))
+        if formula.node_type() in [LTL_X, LTL_F, LTL_G, LTL_U, LTL_R] or \
+           formula.is_and() or formula.is_or():
+            return all([LTLLinearEncoder.is_supported(arg) for arg in formula.args()])
 
-        if formula.is_or():
-            return self.mgr.Or(self.encode_l(formula.args()[0], t_i, t_k, t_l), self.encode_l(formula.args()[1], t_i, t_k, t_l))
+        return False
 
-        if formula.is_lt():
-            return self.mgr.LT(self.encode_l(formula.args()[0], t_i, t_k, t_l), self.encode_l(formula.args()[1], t_i, t_k, t_l))
+    def _name(self, name):
+        return "%sltl_%s%s"%(self.hidden, name, self.hidden)
 
-        if formula.is_bv_ult():
-            return self.mgr.BVULT(self.encode_l(formula.args()[0], t_i, t_k, t_l), self.encode_l(formula.args()[1], t_i, t_k, t_l))
+    def _collect(self, formula):
+        if formula in self.aux:
+            return
+
+        if not has_ltl_operators(formula):
+            self.aux[formula] = None
+            return
+
+        for arg in formula.args():
+            self._collect(arg)
+
+        node_id = len(self.nodes)
+        self.nodes.append(formula)
+        self.aux[formula] = (Symbol(self._name(node_id), BOOL), \
+                             Symbol(self._name("%s_E"%node_id), BOOL), \
+                             Symbol(self._name("%s_L"%node_id), BOOL), \
+                             Symbol(self._name("%s_ev"%node_id), BOOL))
 
-        if formula.is_bv_ule():
-            return self.mgr.BVULE(self.encode_l(formula.args()[0], t_i, t_k, t_l), self.encode_l(formula.args()[1], t_i, t_k, t_l))
-        
-        if formula.is_implies():
-            return self.mgr.Implies(self.encode_l(formula.args()[0], t_i, t_k, t_l), self.encode_l(formula.args()[1], t_i, t_k, t_l))
-        
-        if formula.is_not():
-            return self.mgr.Not(self.encode_l(formula.args()[0], t_i, t_k, t_l))
-        
         if formula.node_type() == LTL_X:
-            if t_i < t_k:
-                return self.encode_l(formula.args()[0], t_i+1, t_k, t_l)
-            return self.encode_l(formula.args()[0], t_l, t_k, t_l)
+            self._add_next(formula.args()[0])
+        elif formula.node_type() in [LTL_F, LTL_G, LTL_U, LTL_R]:
+            self._add_next(formula)
+
+    def _add_next(self, formula):
+        if (formula not in self.nexts) and (self.aux[formula] is None):
+            node_id = "a%s"%len(self.nexts)
+            self.aux[formula] = (None, \
+                                 Symbol(self._name("%s_E"%node_id), BOOL), \
+                                 Symbol(self._name("%s_L"%node_id), BOOL), \
+                                 None)
+        self.nexts.add(formula)
+
+    def _is_temporal(self, formula):
+        return formula.node_type() in [LTL_X, LTL_F, LTL_G, LTL_U, LTL_R]
+
+    def value(self, formula, t):
+        if not has_ltl_operators(formula):
+            return self.at_time(formula, t)
+        return TS.get_timed(self.aux[formula][0], t)
+
+    def _value_E(self, formula):
+        return self.aux[formula][1]
+
+    def _value_L(self, formula):
+        return self.aux[formula][2]
+
+    def _eventuality(self, formula, t):
+        if t == 0:
+            return FALSE() if formula.node_type() in [LTL_F, LTL_U] else TRUE()
+        return TS.get_timed(self.aux[formula][3], t)
+
+    def _inloop(self, t):
+        if t == 0:
+            return FALSE()
+        return TS.get_timed(self.inloop, t)
 
-        if formula.node_type() == LTL_G:
-            return And([self.encode_l(formula.args()[0], j, t_k, t_l) for j in range(min(t_i, t_l), t_k+1, 1)])
+    def _step(self, formula, t, next_value):
+        args = formula.args()
+        value = self.value(formula, t)
+
+        if formula.node_type() == LTL_X:
+            return Iff(value, next_value(args[0]))
 
         if formula.node_type() == LTL_F:
-            return Or([self.encode_l(formula.args()[0], j, t_k, t_l) for j in range(min(t_i, t_l), t_k+1, 1)])
+            return Iff(value, Or(self.value(args[0], t), next_value(formula)))
+
+        if formula.node_type() == LTL_G:
+            return Iff(value, And(self.value(args[0], t), next_value(formula)))
 
         if formula.node_type() == LTL_U:
-            formula_h = formula.args()[0]
-            formula_g = formula.args()[1]
-            
-            u1 = Or([And(self.encode_l(formula_g, j, t_k, t_l), \
-                         And([self.encode_l(formula_h, n, t_k, t_l) for n in range(t_i, j, 1)])) for j in range(t_i, t_k+1, 1)])
-        
-            u2 = Or([And(self.encode_l(formula_g, j, t_k, t_l), \
-                         And([self.encode_l(formula_h, n, t_k, t_l) for n in range(t_i, t_k+1, 1)]), \
-                         And([self.encode_l(formula_h, n, t_k, t_l) for n in range(t_l, j, 1)])) for j in range(t_l, t_i, 1)])
-
-            return Or(u1, u2)
+            return Iff(value, Or(self.value(args[1], t), And(self.value(args[0], t), next_value(formula))))
 
         if formula.node_type() == LTL_R:
-            formula_h = formula.args()[0]
-            formula_g = formula.args()[1]
-            
-            r1 = And([self.encode_l(formula_g, j, t_k, t_l) for j in range(min(t_i, t_l), t_k+1, 1)])
-            
-            r2 = Or([And(self.encode_l(formula_h, j, t_k, t_l), \
-                         And([self.encode_l(formula_g, n, t_k, t_l) for n in range(t_i, j+1, 1)])) for j in range(t_i, t_k+1, 1)])
-        
-            r3 = Or([And(self.encode_l(formula_h, j, t_k, t_l), \
-                         And([self.encode_l(formula_g, n, t_k, t_l) for n in range(t_i, t_k+1, 1)]), \
-                         And([self.encode_l(formula_g, n, t_k, t_l) for n in range(t_l, j+1, 1)])) for j in range(t_l, t_i, 1)])
-
-            return Or(r1, r2, r3)
-
-        if formula.node_type() == LTL_O:
-            return Or([self.encode_l(formula.args()[0], j, t_k, t_l) for j in range(t_i, t_k+1, 1)])
-
-        if formula.node_type() == LTL_H:
-            return And([self.encode_l(formula.args()[0], j, t_k, t_l) for j in range(t_i, t_k+1, 1)])
-        
+            return Iff(value, And(self.value(args[1], t), Or(self.value(args[0], t), next_value(formula))))
+
         Logger.error("Invalid LTL operator")
 
+    def frame(self, t):
+        """Returns the bound independent constraints of frame t"""
+
+        formulae = []
+
+        if t == 0:
+            formulae.append(self.value(self.formula, 0))
+            for formula in self.nexts:
+                formulae.append(Iff(self._value_E(formula), And(self.loop_exists, self._value_L(formula))))
+
+        for formula in self.nodes:
+            if formula.is_and():
+                formulae.append(Iff(self.value(formula, t), And([self.value(arg, t) for arg in formula.args()])))
+            elif formula.is_or():
+                formulae.append(Iff(self.value(formula, t), Or([self.value(arg, t) for arg in formula.args()])))
+            elif t > 0:
+                formulae.append(self._step(formula, t-1, lambda f: self.value(f, t)))
+
+        if t == 0:
+            return formulae
+
+        sel_t = TS.get_timed(self.sel, t)
+        inloop_t = self._inloop(t)
+        formulae.append(Implies(sel_t, And([EqualsOrIff(TS.get_timed(v, t-1), self.loop_vars[v]) for v in self.vars])))
+        formulae.append(Iff(inloop_t, Or(self._inloop(t-1), sel_t)))
+        formulae.append(Implies(self._inloop(t-1), Not(sel_t)))
+
+        for formula in self.nexts:
+            formulae.append(Implies(sel_t, Iff(self._value_L(formula), self.value(formula, t))))
+
+        # Auxiliary variables for the eventualities in the loop
+        for formula in self.nodes:
+            if formula.node_type() in [LTL_F, LTL_U]:
+                arg = formula.args()[-1]
+                formulae.append(Iff(self._eventuality(formula, t), \
+                                    Or(self._eventuality(formula, t-1), And(inloop_t, self.value(arg, t)))))
+            elif formula.node_type() in [LTL_G, LTL_R]:
+                arg = formula.args()[-1]
+                formulae.append(Iff(self._eventuality(formula, t), \
+                                    And(self._eventuality(formula, t-1), Or(Not(inloop_t), self.value(arg, t)))))
+
+        return formulae
+
+    def final(self, t):
+        """Returns the constraints that hold only for bound t"""
+
+        formulae = []
+
+        for formula in self.nodes:
+            if self._is_temporal(formula):
+                formulae.append(self._step(formula, t, self._value_E))
+
+        formulae.append(And([EqualsOrIff(self.loop_vars[v], TS.get_timed(v, t)) for v in self.vars]))
+        formulae.append(Iff(self.loop_exists, self._inloop(t)))
+
+        for formula in self.nodes:
+            if formula.node_type() in [LTL_F, LTL_U]:
+                formulae.append(Implies(self.loop_exists, Implies(self._value_E(formula), self._eventuality(formula, t))))
+            elif formula.node_type() in [LTL_G, LTL_R]:
+                formulae.append(Implies(self.loop_exists, Implies(self._eventuality(formula, t), self._value_E(formula))))
+
+        return formulae
 
 class LTLParser(object):
 
@@ -438,7 +657,7 @@ class LTLParser(object):
     def parse_formula(self, strformula):
         if strformula is None:
             return None
-        return self.parse_string(quote_names(strformula))
+        return self.parse_string(quote_names(strformula, remap=self.remap_or2an))
 
     def parse_formulae(self, strforms):
         formulae = []
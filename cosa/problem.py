@@ -66,6 +66,7 @@ class Problems(object):
     relative_path = None
     boolean = None
     time = False
+    multi_property = False
 
     def __init__(self):
         self.problems = []
@@ -137,6 +138,15 @@ class Problem(object):
     verification = None
     formula = None
     prove = False
+    parallel_prove = None
+    cube_split = None
+    portfolio = None
+    liveness_to_safety = None
+    coi = None
+    sweep = None
+    functional = None
+    random_sim = None
+    mine_invariants = None
     expected = None
     bmc_length = 10
     bmc_length_min = 0
@@ -148,6 +158,9 @@ class Problem(object):
     name = None
     trace = None
     time = None
+    engine = None
+    cached = False
+    invariant = None
 
     vcd = False
     skip_solving = False
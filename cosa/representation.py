@@ -8,7 +8,9 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-from pysmt.shortcuts import Symbol, And, TRUE, simplify, EqualsOrIff
+import sys
+
+from pysmt.shortcuts import Symbol, And, TRUE, simplify, EqualsOrIff, get_env
 from cosa.utils.formula_mngm import get_free_variables, substitute
 
 NEXT = "_N"
@@ -38,6 +40,12 @@ class HTS(object):
 
     logic = None
     en_simplify = False
+    coi = None
+    sweeper = None
+    functional = None
+    definitions = None
+    inductive_lemmas = None
+    mined_lemmas = None
     
     def __init__(self, name=""):
         self.tss = set([])
@@ -58,6 +66,12 @@ class HTS(object):
 
         self.logic = L_BV
         self.en_simplify = False
+        self.coi = None
+        self.sweeper = None
+        self.functional = None
+        self.definitions = None
+        self.inductive_lemmas = None
+        self.mined_lemmas = None
         
     def add_sub(self, name, sub, parameters):
         self.subs.add((name, parameters, sub))
@@ -174,6 +188,11 @@ class HTS(object):
             for lemma in other_hts.lemmas:
                 self.add_lemma(lemma)
 
+        if other_hts.definitions is not None:
+            if self.definitions is None:
+                self.definitions = {}
+            self.definitions.update(other_hts.definitions)
+
     def newname(self, varname, path=[]):
         return varname.replace(self.name, ".".join(path))
 
@@ -361,11 +380,11 @@ class TS(object):
     
     @staticmethod
     def get_timed(v, t):
-        return Symbol(TS.get_timed_name(v.symbol_name(), t), v.symbol_type())
+        return TIMED.get(v, t)
 
     @staticmethod
     def get_ptimed(v, t):
-        return Symbol(TS.get_ptimed_name(v.symbol_name(), t), v.symbol_type())
+        return PTIMED.get(v, t)
 
     @staticmethod
     def get_prefix(v, pref):
@@ -416,4 +435,57 @@ class TS(object):
             if TS.is_prime(v):
                 return True
         return False
-    
+
+class TimedSymbols(object):
+    """Interned table of the timed copies of the variables.
+
+    Frames are created on demand, and each frame maps the integer id of a
+    variable into its timed symbol. The table is flushed when the pysmt
+    environment changes.
+    """
+
+    timed_name = None
+    frames = None
+    env = None
+    size = 0
+
+    def __init__(self, timed_name):
+        self.timed_name = timed_name
+        self.clear()
+
+    def clear(self):
+        self.frames = []
+        self.env = None
+        self.size = 0
+
+    def get(self, var, t):
+        env = get_env()
+        if env is not self.env:
+            self.clear()
+            self.env = env
+
+        t = t if t > 0 else 0
+        while len(self.frames) <= t:
+            self.frames.append({})
+
+        frame = self.frames[t]
+        key = var.node_id()
+        if key not in frame:
+            frame[key] = env.formula_manager.Symbol(self.timed_name(var.symbol_name(), t), var.symbol_type())
+            self.size += 1
+
+        return frame[key]
+
+    def memory_usage(self):
+        size = sys.getsizeof(self.frames)
+        for frame in self.frames:
+            size += sys.getsizeof(frame)
+            for key in frame:
+                size += sys.getsizeof(key) + sys.getsizeof(frame[key])
+        return size
+
+    def __len__(self):
+        return self.size
+
+TIMED = TimedSymbols(TS.get_timed_name)
+PTIMED = TimedSymbols(TS.get_ptimed_name)
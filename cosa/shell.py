@@ -18,7 +18,7 @@ import pickle
 from argparse import RawTextHelpFormatter
 
 from cosa.analyzers.dispatcher import ProblemSolver
-from cosa.analyzers.mcsolver import MCConfig
+from cosa.analyzers.mcsolver import MCConfig, VerificationStrategy
 from cosa.analyzers.bmc_safety import BMCSafety
 from cosa.analyzers.bmc_ltl import BMCLTL
 from cosa.utils.logger import Logger
@@ -32,6 +32,7 @@ from cosa.encoders.miter import Miter
 from cosa.encoders.ltl import ltl_reset_env, LTLParser
 from cosa.problem import Problems, VerificationStatus, VerificationType
 from cosa.representation import HTS
+from cosa.utils.cache import ModelCache, ResultCache, DEFAULT_CACHE_DIR
 
 from pysmt.shortcuts import TRUE, reset_env, get_env
 
@@ -68,11 +69,27 @@ class Config(object):
     solver_name = None
     vcd = False
     prove = False
+    parallel_prove = False
+    cube_split = 0
+    portfolio = None
+    liveness_to_safety = False
+    coi = False
+    sweep = False
+    functional = False
+    random_sim = 0
+    mine_invariants = None
+    multi_property = False
     incremental = True
     deterministic = False
     time = False
     monitors = None
     force_expected = False
+    jobs = 1
+    timeout = None
+    memory_limit = None
+    cache = False
+    cache_results = False
+    cache_dir = None
 
     def __init__(self):
         PrintersFactory.init_printers()
@@ -108,9 +125,25 @@ class Config(object):
         self.solver_name = "msat"
         self.vcd = False
         self.prove = False
+        self.parallel_prove = False
+        self.cube_split = 0
+        self.portfolio = None
+        self.liveness_to_safety = False
+        self.coi = False
+        self.sweep = False
+        self.functional = False
+        self.random_sim = 0
+        self.mine_invariants = None
+        self.multi_property = False
         self.incremental = True
         self.deterministic = False
         self.time = False
+        self.jobs = 1
+        self.timeout = None
+        self.memory_limit = None
+        self.cache = False
+        self.cache_results = False
+        self.cache_dir = DEFAULT_CACHE_DIR
         
 def trace_printed(msg, hr_trace, vcd_trace):
     vcd_msg = ""
@@ -141,6 +174,22 @@ def print_trace(msg, trace, index, prefix):
         Logger.log("%s:"%msg, 0)
         Logger.log(trace_hr, 0)
 
+def print_invariant(invariant, index, prefix):
+    # The conjunction is inductive, while the single lemmas might not be
+    strinvariant = " & ".join(["(%s)"%lemma for lemma in invariant])
+    if len(invariant) == 0:
+        # The property alone is inductive
+        strinvariant = TRUE().serialize()
+
+    if prefix:
+        invariant_file = "%s-%s-invariant.txt"%(prefix, index)
+        with open(invariant_file, "w") as f:
+            f.write(strinvariant+"\n")
+        Logger.log("Inductive invariant (%s lemmas) stored in \"%s\""%(len(invariant), invariant_file), 0)
+    else:
+        Logger.log("Inductive invariant (%s lemmas):"%len(invariant), 0)
+        Logger.log(strinvariant, 0)
+
 def get_file_flags(strfile):
     if "[" not in strfile:
         return (strfile, [])
@@ -163,6 +212,8 @@ def run_verification(config):
 
     if config.strfiles[0][-4:] != ".pkl":
         ps = ProblemSolver()
+        if config.cache:
+            ps.model_cache = ModelCache(config.cache_dir)
         (hts, invar_props, ltl_props) = ps.parse_model("./", config.strfiles, config.abstract_clock, config.symbolic_init, deterministic=config.deterministic, boolean=config.boolean, no_clock=config.no_clock)
         config.parser = ps.parser
 
@@ -187,6 +238,7 @@ def run_verification(config):
     sparser = StringParser()
     sparser.remap_or2an = config.parser.remap_or2an
     ltlparser = LTLParser()
+    ltlparser.remap_or2an = config.parser.remap_or2an
 
     # if equivalence checking wait to add assumptions to combined system
     if config.assumptions is not None and config.equivalence is None:
@@ -215,6 +267,15 @@ def run_verification(config):
     mc_config.solver_name = config.solver_name
     mc_config.vcd_trace = config.vcd
     mc_config.prove = config.prove
+    mc_config.parallel_prove = config.parallel_prove
+    mc_config.cube_split = config.cube_split
+    mc_config.portfolio = config.portfolio
+    mc_config.liveness_to_safety = config.liveness_to_safety
+    mc_config.coi = config.coi
+    mc_config.sweep = config.sweep
+    mc_config.functional = config.functional
+    mc_config.random_sim = config.random_sim
+    mc_config.mine_invariants = config.mine_invariants
     mc_config.incremental = config.incremental
 
     if config.ltl:
@@ -259,13 +320,24 @@ def run_verification(config):
         if len(props) == 0:
             Logger.warning("Safety verification requires at least a property")
             
-        for (strprop, prop, _) in props:
+        results = None
+        if config.multi_property and (len(props) > 1):
+            results = bmc_safety.safety_multi([prop for (_, prop, _) in props], config.bmc_length, config.bmc_length_min)
+
+        for (index, (strprop, prop, _)) in enumerate(props):
             Logger.log("Safety verification for property \"%s\":"%(strprop), 0)
-            res, trace, t = bmc_safety.safety(prop, config.bmc_length, config.bmc_length_min)
+            if results is not None:
+                res, trace, t = results[index]
+            else:
+                res, trace, t = bmc_safety.safety(prop, config.bmc_length, config.bmc_length_min)
             Logger.log("\nProperty is %s"%res, 0)
+            if bmc_safety.engine is not None:
+                Logger.log("Engine: %s"%bmc_safety.engine, 0)
             if res == VerificationStatus.FALSE:
                 count += 1
                 print_trace("Counterexample", trace, count, config.prefix)
+            if (res == VerificationStatus.TRUE) and (bmc_safety.invariant is not None):
+                print_invariant([lemma.serialize() for lemma in bmc_safety.invariant], count, config.prefix)
 
         return 0
     
@@ -323,9 +395,13 @@ def run_verification(config):
             Logger.log("LTL verification for property \"%s\":"%(strprop), 0)
             res, trace, t = bmc_ltl.ltl(prop, config.bmc_length, config.bmc_length_min)
             Logger.log("\nProperty is %s"%res, 0)
+            if bmc_ltl.engine is not None:
+                Logger.log("Engine: %s"%bmc_ltl.engine, 0)
             if res == VerificationStatus.FALSE:
                 count += 1
                 print_trace("Counterexample", trace, count, config.prefix)
+            if (res == VerificationStatus.TRUE) and (bmc_ltl.invariant is not None):
+                print_invariant([lemma.serialize() for lemma in bmc_ltl.invariant], count, config.prefix)
 
         return 0
             
@@ -334,6 +410,10 @@ def run_problems(problems, config):
     Logger.verbosity = config.verbosity
     pbms = Problems()
     psol = ProblemSolver()
+    if config.cache:
+        psol.model_cache = ModelCache(config.cache_dir)
+    if config.cache_results:
+        psol.result_cache = ResultCache(config.cache_dir)
     pbms.load_problems(problems)
     psol.solve_problems(pbms, config)
 
@@ -345,7 +425,7 @@ def run_problems(problems, config):
         unk_k = "" if pbm.status != VerificationStatus.UNK else "\nBMC depth: %s"%pbm.bmc_length
         Logger.log("\n** Problem %s **"%(pbm.name), 0)
         Logger.log("Description: %s"%(pbm.description), 0)
-        Logger.log("Result: %s%s"%(pbm.status, unk_k), 0)
+        Logger.log("Result: %s%s%s"%(pbm.status, " (cached)" if pbm.cached else "", unk_k), 0)
         if (pbm.expected is not None):
             expected = VerificationStatus.convert(pbm.expected) == pbm.status
             Logger.log("Expected: %s"%("OK" if expected else "WRONG"), 0)
@@ -362,6 +442,12 @@ def run_problems(problems, config):
         if (pbm.verification == VerificationType.SIMULATION) and (pbm.status == VerificationStatus.TRUE):
             print_trace("Execution", pbm.trace, pbm.name, prefix)
 
+        if (pbm.status == VerificationStatus.TRUE) and (pbm.invariant is not None):
+            print_invariant(pbm.invariant, pbm.name, prefix)
+
+        if pbm.engine:
+            Logger.log("Engine: %s"%(pbm.engine), 0)
+
         if pbm.time:
             Logger.log("Time: %.2f sec"%(pbm.time), 0)
             
@@ -441,12 +527,53 @@ def main():
     ver_params.add_argument('--prove', dest='prove', action='store_true',
                        help='use indution to prove the satisfiability of the property.')
 
+    ver_params.set_defaults(parallel_prove=False)
+    ver_params.add_argument('--parallel-prove', dest='parallel_prove', action='store_true',
+                       help='runs the base case and the inductive step of the induction in parallel.')
+
+    ver_params.set_defaults(cube_split=config.cube_split)
+    ver_params.add_argument('--cube-split', metavar='<seconds>', type=float, required=False,
+                       help="solves again in cubes, in parallel, the BMC depths (and the following ones) taking more than <seconds> (0 disables). (Default is \"%s\")"%config.cube_split)
+
     strategies = [" - \"%s\": %s"%(x[0], x[1]) for x in MCConfig.get_strategies()]
     defstrategy = MCConfig.get_strategies()[0][0]
     ver_params.set_defaults(strategy=defstrategy)
     ver_params.add_argument('--strategy', metavar='strategy', type=str, nargs='?',
                         help='select the BMC strategy between (Default is \"%s\"):\n%s'%(defstrategy, "\n".join(strategies)))
 
+    ver_params.set_defaults(portfolio=None)
+    ver_params.add_argument('--portfolio', metavar='<engines>', type=str, required=False,
+                       help='comma separated list of engines run in parallel by the "%s" strategy,\n'%(VerificationStrategy.ALL) + \
+                        'each in the form STRATEGY[@solver][:seconds] (e.g., "FWD,BWD@z3:60").')
+
+    ver_params.set_defaults(liveness_to_safety=False)
+    ver_params.add_argument('--l2s', dest='liveness_to_safety', action='store_true',
+                       help='checks liveness and eventually properties as safety (liveness to safety reduction).')
+
+    ver_params.set_defaults(coi=False)
+    ver_params.add_argument('--coi', dest='coi', action='store_true',
+                       help='restricts the model to the cone of influence of each property.')
+
+    ver_params.set_defaults(sweep=False)
+    ver_params.add_argument('--sweep', dest='sweep', action='store_true',
+                       help='merges the equivalent signals (structural hashing and SAT sweeping).')
+
+    ver_params.set_defaults(functional=False)
+    ver_params.add_argument('--functional', dest='functional', action='store_true',
+                       help='unrolls the functional form of the model (only inputs and state variables).')
+
+    ver_params.set_defaults(random_sim=config.random_sim)
+    ver_params.add_argument('--random-sim', metavar='<runs>', type=int, required=False,
+                       help="number of random simulation runs before the verification (requires NumPy). (Default is \"%s\")"%config.random_sim)
+
+    ver_params.set_defaults(mine_invariants=None)
+    ver_params.add_argument('--mine-invariants', metavar='<file>', type=str, required=False,
+                       help='mines inductive invariants from the reachable states (with --prove), and stores them in <file> to be used as lemmas.')
+
+    ver_params.set_defaults(multi_property=False)
+    ver_params.add_argument('--multi-prop', dest='multi_property', action='store_true',
+                       help='checks all the safety properties (or problems with the same options) on a single unrolling.')
+
     ver_params.set_defaults(ninc=False)
     ver_params.add_argument('--ninc', dest='ninc', action='store_true',
                        help='disables incrementality.')
@@ -455,6 +582,18 @@ def main():
     ver_params.add_argument('--solver-name', metavar='<Solver Name>', type=str, required=False,
                         help="name of SMT solver to be use. (Default is \"%s\")"%config.solver_name)
     
+    ver_params.set_defaults(jobs=config.jobs)
+    ver_params.add_argument('-j', '--jobs', metavar='<jobs>', type=int, required=False,
+                        help="number of problems solved in parallel. (Default is \"%s\")"%config.jobs)
+
+    ver_params.set_defaults(timeout=None)
+    ver_params.add_argument('--timeout', metavar='<seconds>', type=float, required=False,
+                        help="wall-clock limit for each problem.")
+
+    ver_params.set_defaults(memory_limit=None)
+    ver_params.add_argument('--memory-limit', metavar='<MB>', type=int, required=False,
+                        help="address-space limit for each problem.")
+    
     # Encoding parameters
 
     enc_params = parser.add_argument_group('encoding')
@@ -529,6 +668,18 @@ def main():
     trans_params.add_argument('--pickle', metavar='<pickle file>', type=str, required=False,
                        help='pickles the transition system to be loaded later.')
 
+    trans_params.set_defaults(cache=False)
+    trans_params.add_argument('--cache', dest='cache', action='store_true',
+                       help='enables the models cache.')
+
+    trans_params.set_defaults(cache_results=False)
+    trans_params.add_argument('--cache-results', dest='cache_results', action='store_true',
+                       help='reuses the results of the unchanged problems (used with --problems).')
+
+    trans_params.set_defaults(cache_dir=config.cache_dir)
+    trans_params.add_argument('--cache-dir', metavar='<directory>', type=str, required=False,
+                        help="location of the models and results cache. (Default is \"%s\")"%config.cache_dir)
+
     # Debugging
 
     deb_params = parser.add_argument_group('verbosity')
@@ -573,9 +724,25 @@ def main():
     config.verbosity = args.verbosity
     config.vcd = args.vcd
     config.prove = args.prove
+    config.parallel_prove = args.parallel_prove
+    config.cube_split = args.cube_split
+    config.portfolio = args.portfolio
+    config.liveness_to_safety = args.liveness_to_safety
+    config.coi = args.coi
+    config.sweep = args.sweep
+    config.functional = args.functional
+    config.random_sim = args.random_sim
+    config.mine_invariants = args.mine_invariants
+    config.multi_property = args.multi_property
     config.solver_name = args.solver_name
     config.incremental = not args.ninc
     config.time = args.time
+    config.jobs = args.jobs
+    config.cache = args.cache
+    config.cache_results = args.cache_results
+    config.cache_dir = args.cache_dir
+    config.timeout = args.timeout
+    config.memory_limit = args.memory_limit
     config.no_clock = args.no_clock
     # config.monitors = args.monitors
 
@@ -0,0 +1,358 @@
+# Copyright 2018 Cristian Mattarei
+#
+# Licensed under the modified BSD (3-clause BSD) License.
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import io
+import time
+import pickle
+import sqlite3
+import hashlib
+import tempfile
+
+from pysmt.fnode import FNode
+from pysmt.typing import PySMTType
+from pysmt.shortcuts import get_env
+from pysmt.operators import SYMBOL
+
+from cosa.utils.logger import Logger
+
+CACHE_VERSION = 1
+DEFAULT_CACHE_DIR = "~/.cosa/cache"
+
+def file_hash(strfile):
+    digest = hashlib.sha256()
+    with open(strfile, "rb") as f:
+        for block in iter(lambda: f.read(1<<20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def sources_hash(package_dir):
+    digest = hashlib.sha256()
+    for (dirpath, dirnames, filenames) in sorted(os.walk(package_dir)):
+        dirnames.sort()
+        for filename in sorted(filenames):
+            if filename.endswith(".py"):
+                with open(os.path.join(dirpath, filename), "rb") as f:
+                    digest.update(f.read())
+    return digest.hexdigest()
+
+class FormulaPickler(pickle.Pickler):
+    """Pickler that stores formulae and types as a DAG table.
+
+    The nodes are stored in topological order as (node type, argument
+    indexes, payload), hence the (possibly deep) formulae are not
+    traversed recursively by pickle, and are re-created in the current
+    environment when loaded.
+    """
+
+    nodes = None
+    ids = None
+
+    def __init__(self, file):
+        pickle.Pickler.__init__(self, file, pickle.HIGHEST_PROTOCOL)
+        self.nodes = []
+        self.ids = {}
+
+    def persistent_id(self, obj):
+        if isinstance(obj, FNode):
+            return ("F", self._node(obj))
+        if isinstance(obj, PySMTType):
+            return ("T", self._type(obj))
+        return None
+
+    def _type(self, vtype):
+        if vtype.is_bool_type():
+            return ("B",)
+        if vtype.is_bv_type():
+            return ("BV", vtype.width)
+        if vtype.is_int_type():
+            return ("I",)
+        if vtype.is_real_type():
+            return ("R",)
+        if vtype.is_array_type():
+            return ("A", self._type(vtype.index_type), self._type(vtype.elem_type))
+        if vtype.is_function_type():
+            return ("FN", self._type(vtype.return_type), tuple([self._type(t) for t in vtype.param_types]))
+
+        Logger.error("Type \"%s\" not supported by the cache"%vtype)
+
+    def _payload(self, formula):
+        payload = formula._content.payload
+        if formula.node_type() == SYMBOL:
+            return (payload[0], self._type(payload[1]))
+        if isinstance(payload, FNode):
+            return ("F", self.ids[payload])
+        if isinstance(payload, PySMTType):
+            return ("T", self._type(payload))
+        return ("V", payload)
+
+    def _node(self, formula):
+        if formula in self.ids:
+            return self.ids[formula]
+
+        to_visit = [formula]
+        while len(to_visit) > 0:
+            node = to_visit[-1]
+            if node in self.ids:
+                to_visit.pop()
+                continue
+
+            deps = [arg for arg in node.args() if arg not in self.ids]
+            payload = node._content.payload
+            if isinstance(payload, FNode) and (payload not in self.ids):
+                deps.append(payload)
+
+            if len(deps) > 0:
+                to_visit += deps
+                continue
+
+            to_visit.pop()
+            self.nodes.append((node.node_type(), tuple([self.ids[arg] for arg in node.args()]), self._payload(node)))
+            self.ids[node] = len(self.nodes)-1
+
+        return self.ids[formula]
+
+class FormulaUnpickler(pickle.Unpickler):
+
+    nodes = None
+    types = None
+
+    def __init__(self, file, nodes):
+        pickle.Unpickler.__init__(self, file)
+        self.types = {}
+        self.nodes = self._load_nodes(nodes)
+
+    def _type(self, strtype):
+        if strtype in self.types:
+            return self.types[strtype]
+
+        mgr = get_env().type_manager
+        if strtype[0] == "B":
+            vtype = mgr.BOOL()
+        elif strtype[0] == "BV":
+            vtype = mgr.BVType(strtype[1])
+        elif strtype[0] == "I":
+            vtype = mgr.INT()
+        elif strtype[0] == "R":
+            vtype = mgr.REAL()
+        elif strtype[0] == "A":
+            vtype = mgr.ArrayType(self._type(strtype[1]), self._type(strtype[2]))
+        elif strtype[0] == "FN":
+            vtype = mgr.FunctionType(self._type(strtype[1]), [self._type(t) for t in strtype[2]])
+        else:
+            Logger.error("Type \"%s\" not supported by the cache"%str(strtype))
+
+        self.types[strtype] = vtype
+        return vtype
+
+    def _load_nodes(self, table):
+        mgr = get_env().formula_manager
+        nodes = []
+        for (node_type, args, payload) in table:
+            if node_type == SYMBOL:
+                nodes.append(mgr.get_or_create_symbol(payload[0], self._type(payload[1])))
+                continue
+
+            if payload[0] == "F":
+                payload = nodes[payload[1]]
+            elif payload[0] == "T":
+                payload = self._type(payload[1])
+            else:
+                payload = payload[1]
+
+            nodes.append(mgr.create_node(node_type, tuple([nodes[arg] for arg in args]), payload))
+
+        return nodes
+
+    def persistent_load(self, pid):
+        if pid[0] == "F":
+            return self.nodes[pid[1]]
+        return self._type(pid[1])
+
+def dumps(obj):
+    payload = io.BytesIO()
+    pickler = FormulaPickler(payload)
+    pickler.dump(obj)
+    return pickle.dumps((CACHE_VERSION, pickler.nodes, payload.getvalue()), pickle.HIGHEST_PROTOCOL)
+
+def loads(data):
+    (version, nodes, payload) = pickle.loads(data)
+    if version != CACHE_VERSION:
+        return None
+    return FormulaUnpickler(io.BytesIO(payload), nodes).load()
+
+class CachedParser(object):
+    """Stand-in for the parser of a cached model, keeps the names remapping"""
+
+    anonimize_names = False
+    map_an2or = None
+    map_or2an = None
+    map_aliases = None
+
+    def __init__(self, parser):
+        self.anonimize_names = getattr(parser, "anonimize_names", False)
+        self.map_an2or = getattr(parser, "map_an2or", {})
+        self.map_or2an = getattr(parser, "map_or2an", {})
+        self.map_aliases = getattr(parser, "map_aliases", {})
+
+    def remap_an2or(self, name):
+        if not self.anonimize_names:
+            return name
+        if name in self.map_an2or:
+            return self.map_an2or[name]
+        return name
+
+    def remap_or2an(self, name):
+        if self.anonimize_names and (name in self.map_or2an):
+            name = self.map_or2an[name]
+        if name in self.map_aliases:
+            return self.map_aliases[name]
+        return name
+
+class ModelCache(object):
+    """Content-addressed cache of parsed models.
+
+    Entries are keyed on the hash of the model file, of the encoding
+    options and of the encoders sources.
+    """
+
+    directory = None
+    hits = 0
+    misses = 0
+    time_saved = 0.0
+
+    _sources = None
+
+    def __init__(self, directory=DEFAULT_CACHE_DIR):
+        self.directory = os.path.join(os.path.expanduser(directory), "models")
+        self.hits = 0
+        self.misses = 0
+        self.time_saved = 0.0
+
+    @staticmethod
+    def encoders_hash():
+        if ModelCache._sources is None:
+            encoders = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "encoders")
+            ModelCache._sources = sources_hash(encoders)
+        return ModelCache._sources
+
+    def key(self, strfile, flags, options):
+        if not os.path.isfile(strfile):
+            return None
+
+        digest = hashlib.sha256()
+        for value in [CACHE_VERSION, ModelCache.encoders_hash(), file_hash(strfile), flags, options]:
+            digest.update(str(value).encode())
+        return digest.hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, "%s.pkl"%key)
+
+    def load(self, key):
+        """Returns (model, parser) or None"""
+
+        if (key is None) or (not os.path.isfile(self._path(key))):
+            self.misses += 1
+            return None
+
+        start = time.time()
+        try:
+            with open(self._path(key), "rb") as f:
+                entry = loads(f.read())
+        except Exception as e:
+            Logger.log("Invalid cache entry \"%s\": %s"%(key, e), 1)
+            entry = None
+
+        if entry is None:
+            self.misses += 1
+            return None
+
+        (model, parser, parse_time) = entry
+        self.hits += 1
+        self.time_saved += max(0, parse_time - (time.time() - start))
+        return (model, parser)
+
+    def store(self, key, model, parser, parse_time):
+        if key is None:
+            return
+
+        try:
+            data = dumps((model, CachedParser(parser), parse_time))
+        except Exception as e:
+            Logger.log("Model not cached: %s"%(e), 1)
+            return
+
+        os.makedirs(self.directory, exist_ok=True)
+
+        # Atomic replace, concurrent runs can share the cache
+        (fd, tmpfile) = tempfile.mkstemp(dir=self.directory)
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmpfile, self._path(key))
+
+class ResultCache(object):
+    """Persistent store of verification results (SQLite).
+
+    A new connection is opened for each access, hence the cache can be
+    used by forked workers.
+    """
+
+    database = None
+
+    _sources = None
+
+    def __init__(self, directory=DEFAULT_CACHE_DIR):
+        directory = os.path.expanduser(directory)
+        os.makedirs(directory, exist_ok=True)
+        self.database = os.path.join(directory, "results.db")
+
+        self._execute("CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, status TEXT, depth INTEGER, trace BLOB, time REAL)")
+
+    def _execute(self, query, args=()):
+        conn = sqlite3.connect(self.database, timeout=60)
+        try:
+            with conn:
+                return conn.execute(query, args).fetchone()
+        finally:
+            conn.close()
+
+    @staticmethod
+    def sources_hash():
+        if ResultCache._sources is None:
+            ResultCache._sources = sources_hash(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+        return ResultCache._sources
+
+    def model_hash(self, model_files, options):
+        digest = hashlib.sha256()
+        for (strfile, flags) in model_files:
+            digest.update(str((file_hash(strfile), flags)).encode())
+        digest.update(str(options).encode())
+        return digest.hexdigest()
+
+    def key(self, values):
+        digest = hashlib.sha256()
+        for value in [CACHE_VERSION, ResultCache.sources_hash()] + values:
+            digest.update(str(value).encode())
+        return digest.hexdigest()
+
+    def load(self, key):
+        """Returns (status, depth, trace, time) or None"""
+
+        row = self._execute("SELECT status, depth, trace, time FROM results WHERE key = ?", (key,))
+
+        if row is None:
+            return None
+
+        (status, depth, trace, time) = row
+        return (status, depth, pickle.loads(trace), time)
+
+    def store(self, key, status, depth, trace, time):
+        self._execute("INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?)", \
+                      (key, status, depth, pickle.dumps(trace, pickle.HIGHEST_PROTOCOL), time))
@@ -69,7 +69,7 @@ OPERATORS = [(" < "," u< "), \
              (" >= "," u>= "), \
              (" <= "," u<= ")]
 
-def quote_names(strformula, prefix=None, replace_ops=True):
+def quote_names(strformula, prefix=None, replace_ops=True, remap=None):
     lst_names = []
     if (prefix is not None) and (prefix != ""):
         lst_names.append(prefix)
@@ -89,7 +89,10 @@ def quote_names(strformula, prefix=None, replace_ops=True):
         repl_lst.append((newlit, lit))
 
     for (newlit, lit) in repl_lst:
-        strformula = strformula.replace(newlit, "\'%s\'"%(".".join(lst_names+[lit])))
+        name = ".".join(lst_names+[lit])
+        if remap is not None:
+            name = remap(name)
+        strformula = strformula.replace(newlit, "\'%s\'"%(name))
     if replace_ops:
         for op in OPERATORS:
             strformula = strformula.replace(op[0], op[1])
@@ -0,0 +1,148 @@
+# Copyright 2018 Cristian Mattarei
+#
+# Licensed under the modified BSD (3-clause BSD) License.
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import sys
+import time
+import signal
+import resource
+import traceback
+import multiprocessing
+
+from multiprocessing.connection import wait
+
+class TaskStatus(object):
+    OK = "OK"
+    ERROR = "ERROR"
+    TIMEOUT = "TIMEOUT"
+    MEMOUT = "MEMOUT"
+
+class Task(object):
+
+    name = None
+    function = None
+    args = None
+    timeout = None
+    memory = None
+
+    process = None
+    conn = None
+    start_time = None
+
+    def __init__(self, name, function, args, timeout=None, memory=None):
+        self.name = name
+        self.function = function
+        self.args = args
+        self.timeout = timeout
+        self.memory = memory
+
+    def elapsed(self):
+        return time.time() - self.start_time
+
+    def expired(self):
+        return (self.timeout is not None) and (self.elapsed() > self.timeout)
+
+def run_task(conn, task):
+    if task.memory is not None:
+        resource.setrlimit(resource.RLIMIT_AS, (task.memory, task.memory))
+
+    try:
+        result = (TaskStatus.OK, task.function(*task.args))
+    except MemoryError:
+        result = (TaskStatus.MEMOUT, None)
+    except BaseException:
+        result = (TaskStatus.ERROR, traceback.format_exc())
+
+    try:
+        conn.send(result)
+    except MemoryError:
+        conn.send((TaskStatus.MEMOUT, None))
+    finally:
+        conn.close()
+
+class ProcessPool(object):
+    """Runs tasks in forked worker processes.
+
+    The workers inherit the memory of the parent (copy-on-write), hence
+    the models are not serialized. Each task can have a wall-clock limit
+    (in seconds) and an address-space limit (in bytes), and its result is
+    returned through a pipe, thus it has to be picklable.
+    """
+
+    jobs = None
+    pending = None
+    running = None
+    context = None
+
+    def __init__(self, jobs=None):
+        self.jobs = jobs if jobs is not None else multiprocessing.cpu_count()
+        self.pending = []
+        self.running = []
+        self.context = multiprocessing.get_context("fork")
+
+    def submit(self, name, function, args=(), timeout=None, memory=None):
+        self.pending.append(Task(name, function, args, timeout, memory))
+
+    def _start(self, task):
+        (conn_parent, conn_child) = self.context.Pipe(False)
+        task.process = self.context.Process(target=run_task, args=(conn_child, task))
+        task.conn = conn_parent
+        task.start_time = time.time()
+        task.process.start()
+        conn_child.close()
+        self.running.append(task)
+
+    def _stop(self, task):
+        self.running.remove(task)
+        if task.process.is_alive():
+            task.process.terminate()
+        task.process.join()
+        task.conn.close()
+
+    def _next_timeout(self):
+        timeouts = [task.timeout - task.elapsed() for task in self.running if task.timeout is not None]
+        if len(timeouts) == 0:
+            return None
+        return max(0, min(timeouts))
+
+    def results(self):
+        """Generator of (name, status, result, time), in completion order"""
+
+        # Buffered output would be duplicated by the forked processes
+        sys.stdout.flush()
+        sys.stderr.flush()
+
+        while (len(self.pending) > 0) or (len(self.running) > 0):
+            while (len(self.pending) > 0) and (len(self.running) < self.jobs):
+                self._start(self.pending.pop(0))
+
+            ready = wait([task.conn for task in self.running], self._next_timeout())
+
+            for task in list(self.running):
+                if task.conn in ready:
+                    try:
+                        (status, result) = task.conn.recv()
+                    except EOFError:
+                        task.process.join()
+                        (status, result) = (TaskStatus.ERROR, "Worker exited with code %s"%task.process.exitcode)
+                        # Native code (e.g., the SMT solvers) aborts when an allocation fails
+                        if (task.memory is not None) and (-task.process.exitcode in [signal.SIGSEGV, signal.SIGABRT]):
+                            status = TaskStatus.MEMOUT
+                    elapsed = task.elapsed()
+                    self._stop(task)
+                    yield (task.name, status, result, elapsed)
+                elif task.expired():
+                    elapsed = task.elapsed()
+                    self._stop(task)
+                    yield (task.name, TaskStatus.TIMEOUT, None, elapsed)
+
+    def terminate(self):
+        self.pending = []
+        for task in list(self.running):
+            self._stop(task)
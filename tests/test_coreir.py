@@ -0,0 +1,106 @@
+# Copyright 2018 Cristian Mattarei
+#
+# Licensed under the modified BSD (3-clause BSD) License.
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from cosa.representation import TS, HTS
+from cosa.encoders.coreir import CoreIRParser
+from pysmt.shortcuts import Symbol, BV, BVAdd, EqualsOrIff, And, Or, Not, reset_env
+from pysmt.typing import BVType
+
+def new_parser():
+    # The CoreIR context is not needed by the passes on the connections
+    parser = CoreIRParser.__new__(CoreIRParser)
+    parser.anonimize_names = False
+    parser.map_aliases = {}
+    return parser
+
+def test_collapse_aliases():
+    reset_env()
+
+    [inp, w1, w2, w3, w4, reg, out] = [Symbol(name, BVType(8)) for name in ["inp", "w1", "w2", "w3", "w4", "reg", "out"]]
+    wide = Symbol("wide", BVType(16))
+
+    ts = TS("Module")
+    for var in [w1, w2, w3, w4, wide]:
+        ts.add_var(var)
+    ts.add_input_var(inp)
+    ts.add_output_var(out)
+    ts.add_state_var(reg)
+    ts.init = EqualsOrIff(reg, BV(0, 8))
+    ts.trans = EqualsOrIff(TS.get_prime(reg), BVAdd(w2, w4))
+    ts.invar = EqualsOrIff(w3, BVAdd(w1, BV(1, 8)))
+
+    hts = HTS("Top")
+    hts.add_ts(ts)
+
+    connections = [((inp, None), (w1, None)), \
+                   ((w1, 0, 7), (w2, None)), \
+                   ((w2, None), (out, None)), \
+                   ((wide, 0, 7), (w3, None)), \
+                   ((reg, None), (w4, None))]
+
+    parser = new_parser()
+    (connections, eq_vars) = parser._CoreIRParser__collapse_aliases(hts, connections, set([inp, w1, w2, w3, w4, reg, out, wide]))
+
+    # Full-width slices are aliases, the partial ones are kept
+    assert hts.definitions == {w1: inp, w2: inp, w4: reg}
+    assert ((wide, 0, 7), (w3, None)) in connections
+    # The outputs are kept with an equality to the representative
+    assert ((out, None), (inp, None)) in connections
+    assert len(connections) == 2
+
+    assert hts.vars.isdisjoint([w1, w2, w4])
+    assert eq_vars == set([inp, w3, reg, out, wide])
+    assert ts.trans == EqualsOrIff(TS.get_prime(reg), BVAdd(inp, reg))
+    assert ts.invar == EqualsOrIff(w3, BVAdd(inp, BV(1, 8)))
+
+    # Formulae on the removed wires refer to the representative
+    assert [parser.remap_or2an(name) for name in ["w1", "w2", "w3", "w4"]] == ["inp", "inp", "w3", "reg"]
+
+def test_structural_lemmas():
+    reset_env()
+
+    bv8 = lambda name: Symbol(name, BVType(8))
+    bv1 = lambda name: Symbol(name, BVType(1))
+
+    # r loads 5 or keeps its value, q loads an input
+    [r_in, r_out, q_in, q_out, inp, m_in0, m_in1, m_out] = [bv8(name) for name in \
+                                                            ["r.in", "r.out", "q.in", "q.out", "inp", "m.in0", "m.in1", "m.out"]]
+    # e0 and e1 compare s with 0 and 1, and e0 selects the mux
+    [m_sel, s, e0_in0, e0_in1, e0_out, e1_in0, e1_in1, e1_out] = [bv1(name) for name in \
+                                                                  ["m.sel", "s", "e0.in0", "e0.in1", "e0.out", "e1.in0", "e1.in1", "e1.out"]]
+
+    connections = [((m_out, None), (r_in, None)), \
+                   ((m_in0, None), (BV(5, 8), None)), \
+                   ((m_in1, None), (r_out, None)), \
+                   ((m_sel, None), (e0_out, None)), \
+                   ((q_in, None), (inp, None)), \
+                   ((e0_in0, None), (s, None)), \
+                   ((e0_in1, None), (BV(0, 1), None)), \
+                   ((e1_in0, None), (s, None)), \
+                   ((e1_in1, None), (BV(1, 1), None))]
+
+    registers = [(r_in, None, r_out, 0), (q_in, None, q_out, 0)]
+    muxes = [(m_in0, m_in1, m_sel, m_out)]
+    comparators = [(e0_in0, e0_in1, e0_out), (e1_in0, e1_in1, e1_out)]
+
+    parser = new_parser()
+    lemmas = parser._CoreIRParser__structural_lemmas(connections, registers, muxes, comparators)
+
+    one = BV(1, 1)
+    expected = [Or(EqualsOrIff(r_out, BV(0, 8)), EqualsOrIff(r_out, BV(5, 8))), \
+                Not(And(EqualsOrIff(e0_out, one), EqualsOrIff(e1_out, one))), \
+                Or(EqualsOrIff(e0_out, one), EqualsOrIff(e1_out, one))]
+
+    # q can take any value of the input, hence it has no lemma
+    assert set(lemmas) == set(expected)
+
+if __name__ == "__main__":
+    test_collapse_aliases()
+    test_structural_lemmas()
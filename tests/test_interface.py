@@ -56,7 +56,7 @@ def run_translation(path):
 
     models = list(os.walk(path))[-1][-1]
     j_files = ["%s/%s"%(path,f) for f in models if f.split(".")[1] == "json"]
-    s_files = ["%s/%s"%(path,f) for f in models if f.split(".")[1] in ["sts","ets"]]
+    s_files = ["%s/%s"%(path,f) for f in models if f.split(".")[1] in ["sts","ets","btor"]]
     
     config.strfiles = ",".join(j_files+s_files)
         
@@ -0,0 +1,154 @@
+# Copyright 2018 Cristian Mattarei
+#
+# Licensed under the modified BSD (3-clause BSD) License.
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import shutil
+import tempfile
+
+from unittest import SkipTest
+
+from cosa.shell import Config
+from cosa.problem import Problems, VerificationStatus, VerificationType
+from cosa.analyzers.dispatcher import ProblemSolver
+from cosa.utils.cache import ModelCache, ResultCache
+from pysmt.shortcuts import reset_env, get_env
+
+abspath = os.path.abspath(__file__)
+path = ("/".join(abspath.split("/")[:-1]))
+testdirs = [d[0] for d in os.walk(path) if d[0] != path and "__" not in d[0]]
+
+SOLVER = "msat"
+
+# Each variant is (name, options, exact, verifications). The variants that
+# only change the encoding have to give the same results as BMC, while
+# the other engines can be more conclusive. If verifications is None the
+# options are given to the configuration, otherwise they are given to the
+# problems of the verification types in verifications, and the comparison
+# is restricted to them. The simulation with no unrolling also succeeds
+# when it runs for the whole bound without reaching the cover, hence the
+# examples only have reachable covers
+SAFETY = [VerificationType.SAFETY]
+LTL = [VerificationType.LTL]
+SIMULATION = [VerificationType.SIMULATION]
+
+variants = [("PDR", {"strategy": "PDR"}, False, SAFETY), \
+            ("Portfolio", {"strategy": "ALL"}, False, SAFETY), \
+            ("Portfolio-Engines", {"strategy": "ALL", "portfolio": "FWD,BWD:60,PDR"}, False, SAFETY), \
+            ("Executor", {"jobs": 2, "timeout": 600, "memory_limit": 4096}, True, None), \
+            ("Parallel-Prove", {"parallel_prove": True}, True, SAFETY), \
+            ("INT", {"strategy": "INT"}, False, SAFETY), \
+            ("LTL", {"strategy": "LTL"}, False, LTL), \
+            ("LTL-Loops", {"strategy": "LTL", "incremental": False}, False, LTL), \
+            ("L2S", {"liveness_to_safety": True}, False, LTL), \
+            ("COI", {"coi": True}, True, None), \
+            ("Sweeping", {"sweep": True}, True, None), \
+            ("Functional", {"functional": True}, True, None), \
+            ("Simulation", {"random_sim": 64}, True, None), \
+            ("NU", {"strategy": "NU"}, False, SIMULATION), \
+            ("BMC-Min", {"bmc_length_min": 8}, True, SAFETY), \
+            ("BMC-Non-Incremental", {"incremental": False}, False, SAFETY), \
+            ("ZZ", {"strategy": "ZZ"}, False, SAFETY), \
+            ("Multi-Property", {"multi_property": True}, True, None), \
+            ("Multi-Property-Executor", {"multi_property": True, "jobs": 2}, True, None), \
+            ("Miner", {"mine_invariants": os.devnull}, False, SAFETY), \
+            ("Cube-Budget", {"cube_split": 600}, True, SAFETY), \
+            ("Cube-Split", {"cube_split": 1e-6}, True, SAFETY)]
+
+# Each cache configuration is (name, options)
+caches = [("ModelCache", {"cache": True}), \
+          ("ResultCache", {"cache_results": True}), \
+          ("Caches", {"cache": True, "cache_results": True})]
+
+def solve(example, options, verifications=None):
+    reset_env()
+
+    config = Config()
+
+    config.verbosity = 0
+    config.solver_name = SOLVER
+    if verifications is None:
+        for (attr, value) in options.items():
+            setattr(config, attr, value)
+
+    psol = ProblemSolver()
+    if config.cache:
+        psol.model_cache = ModelCache(config.cache_dir)
+    if config.cache_results:
+        psol.result_cache = ResultCache(config.cache_dir)
+
+    problems = Problems()
+    problems.load_problems("%s/problem.txt"%example)
+    if verifications is not None:
+        for problem in problems.problems:
+            if problem.verification in verifications:
+                for (attr, value) in options.items():
+                    setattr(problem, attr, value)
+    psol.solve_problems(problems, config)
+
+    return (problems.problems, psol)
+
+def statuses(problems, verifications):
+    return dict([(problem.name, problem.status) for problem in problems \
+                 if (verifications is None) or (problem.verification in verifications)])
+
+def compare(example, name, options, exact, verifications):
+    if SOLVER not in get_env().factory.all_solvers():
+        raise SkipTest("Solver \"%s\" not available"%SOLVER)
+    if (options.get("strategy", None) == "INT") and (SOLVER not in get_env().factory.all_interpolators()):
+        raise SkipTest("Interpolator \"%s\" not available"%SOLVER)
+
+    expected = statuses(solve(example, {})[0], verifications)
+    results = statuses(solve(example, options, verifications)[0], verifications)
+
+    for (problem, status) in expected.items():
+        if exact or (VerificationStatus.UNK not in [status, results[problem]]):
+            assert results[problem] == status, \
+                "%s: \"%s\" is %s, BMC gives %s"%(name, problem, results[problem], status)
+
+def compare_cached(example, name, options):
+    """Solves the problems twice sharing the cache, which has to be used by the second run"""
+
+    if SOLVER not in get_env().factory.all_solvers():
+        raise SkipTest("Solver \"%s\" not available"%SOLVER)
+
+    expected = statuses(solve(example, {})[0], None)
+
+    directory = tempfile.mkdtemp()
+    try:
+        options = dict(options, cache_dir=directory)
+        for run in range(2):
+            (problems, psol) = solve(example, options)
+            assert statuses(problems, None) == expected, "%s: results differ from BMC"%(name)
+
+        if options.get("cache", False):
+            assert psol.model_cache.hits > 0, "%s: models not cached"%(name)
+        if options.get("cache_results", False):
+            # Only the safety and LTL results are cached
+            for problem in [p for p in problems if p.verification in SAFETY + LTL]:
+                assert problem.cached, "%s: \"%s\" not cached"%(name, problem.name)
+    finally:
+        shutil.rmtree(directory)
+
+def test_strategies():
+    for test in testdirs:
+        for variant in variants:
+            yield (compare, test) + variant
+
+def test_caches():
+    for test in testdirs:
+        for (name, options) in caches:
+            yield (compare_cached, test, name, options)
+
+if __name__ == "__main__":
+    for test in testdirs:
+        for variant in variants:
+            compare(test, *variant)
+        for (name, options) in caches:
+            compare_cached(test, name, options)